@@ -28,11 +28,17 @@ from donkeycar.parts.actuator import TwoWheelSteeringThrottle
 
 # from manage import add_drivetrain
 from parts.cameras import Jetson_CSI_Camera, CV_USB_Camera
+from parts.camera_frame import to_rgb
+from parts.frame_trace import Frame_Latency_Tracer, Frame_Trace_Stamp
+from parts.frame_sync import Dual_Camera_Synchronizer
+from parts.frame_bus import Shared_Frame_Ring, Frame_Bus_Publisher, Frame_Bus_Worker
 from parts.web_controller.web import LocalWebController
 
-from parts.actuators import autobot_platform
+from parts.actuators import start_autobot_platform, get_autobot_platform
+from parts.serial_asyncio import Asyncio_Serial_Transport
 from parts.actuators import AutoBot_Actuator, AutoBot_Flashlight, AutoBot_UV_Flashlight, AutoBot_Camera_Servo
-from parts.actuators import Sensor_RFID, Sensor_Battery, Sensor_US, Sensor_IR
+from parts.actuators import Sensor_RFID, Sensor_Telemetry, Sensor_Telemetry_Filtered
+from parts.safety import Obstacle_Stop_Interlock
 
 from parts.aruco import ArucoSignDetector
 
@@ -44,8 +50,9 @@ def remove_collected_data(dir_path: str):
 
 
 
-def add_controller(V, cfg):
-	ctr = LocalWebController(port=cfg.WEB_CONTROL_PORT, mode=cfg.WEB_INIT_MODE)
+def add_controller(V, cfg, loop_services=None, telemetry_source=None):
+	ctr = LocalWebController(port=cfg.WEB_CONTROL_PORT, mode=cfg.WEB_INIT_MODE,
+							 loop_services=loop_services, telemetry_source=telemetry_source)
 	V.add(ctr,
 		  inputs=[f'cam_top/image_array', f'cam_bot/image_array', f'cam_top/detected_aruco', 'tub/num_records', 'user/mode', 'recording'],
 		  outputs=['user/angle', 'user/throttle', 'user/mode', 'recording', 'web/buttons'],
@@ -237,7 +244,37 @@ def dual_cam_drive(cfg,
 		ch.setFormatter(logging.Formatter(cfg.LOGGING_FORMAT))
 		logger.addHandler(ch)
 
-	V.add(AutoBot_Actuator(), inputs=['left/throttle', 'right/throttle'])
+	safety_interlock = None
+	if cfg.AUTOBOT_SAFETY_STOP:
+		safety_interlock = Obstacle_Stop_Interlock(us_stop_distance=cfg.AUTOBOT_SAFETY_US_STOP_DISTANCE,
+												   ir_stop_distance=cfg.AUTOBOT_SAFETY_IR_STOP_DISTANCE,
+												   release_margin=cfg.AUTOBOT_SAFETY_RELEASE_MARGIN,
+												   us_channels=cfg.AUTOBOT_SAFETY_US_CHANNELS,
+												   ir_channels=cfg.AUTOBOT_SAFETY_IR_CHANNELS,
+												   allow_reverse=cfg.AUTOBOT_SAFETY_ALLOW_REVERSE)
+
+	# connect to the MegaBot controller in background while cameras and model are loading
+	start_autobot_platform(backend=cfg.AUTOBOT_BACKEND,
+						   transport=cfg.AUTOBOT_SERIAL_TRANSPORT,
+						   safety_interlock=safety_interlock,
+						   traffic_log_dir=cfg.AUTOBOT_SERIAL_LOG_DIR,
+						   sensor_filters=dict(capacity=cfg.AUTOBOT_SENSOR_HISTORY_SIZE,
+											   median_window=cfg.AUTOBOT_SENSOR_MEDIAN_WINDOW,
+											   outlier_threshold=cfg.AUTOBOT_SENSOR_OUTLIER_THRESHOLD,
+											   ema_alpha=cfg.AUTOBOT_SENSOR_EMA_ALPHA))
+
+	V.add(AutoBot_Actuator(hysteresis=cfg.AUTOBOT_WHEELS_HYSTERESIS,
+						   keepalive_interval=cfg.AUTOBOT_WHEELS_KEEPALIVE_SEC),
+		  inputs=['left/throttle', 'right/throttle'])
+
+	# glass-to-wheel latency of the road camera frames: each stage stamps the frame right after it runs
+	frame_tracer = None
+	if cfg.FRAME_TRACE:
+		frame_tracer = Frame_Latency_Tracer(stages=['aruco', 'pilot', 'drive_mode', 'actuator'],
+											log_interval=cfg.FRAME_TRACE_LOG_INTERVAL)
+		# the actuator runs first in the loop, so it sends the command computed from the previous tick's frame,
+		# which is still in memory here
+		V.add(Frame_Trace_Stamp(frame_tracer, 'actuator', report=True), inputs=[f'{cfg.ROAD_CAM}/pure_image'])
 
 	control_flashlight = AutoBot_Flashlight()
 	control_uv_flashlight = AutoBot_UV_Flashlight()
@@ -248,13 +285,40 @@ def dual_cam_drive(cfg,
 	# 							image_w=cfg.IMAGE_W, image_h=cfg.IMAGE_H,
 	# 							capture_width=cfg.IMAGE_W, capture_height=cfg.IMAGE_H,
 	# 							framerate=cfg.CAMERA_FRAMERATE, gstreamer_flip=cfg.CSIC_CAM_GSTREAMER_FLIP_PARM)
-	cam_top = CV_USB_Camera(camera_path='/dev/cams/rpi_src', capture_width=cfg.IMAGE_W, capture_height=cfg.IMAGE_H)
-	V.add(cam_top, inputs=[], outputs=[f'cam_top/pure_image'], threaded=True)
+	# the road camera additionally outputs a reduced frame (ROI / decimation slice of the full frame) for the pilot
+	road_cam_reduced = cfg.CAMERA_ROI is not None or cfg.CAMERA_DECIMATION > 1
+	road_frame_key = f'{cfg.ROAD_CAM}/reduced_image' if road_cam_reduced else f'{cfg.ROAD_CAM}/pure_image'
+	cam_kwargs = {'cam_top': {}, 'cam_bot': {}}
+	if road_cam_reduced:
+		cam_kwargs[cfg.ROAD_CAM] = dict(roi=cfg.CAMERA_ROI, decimation=cfg.CAMERA_DECIMATION)
+
+	cam_top = CV_USB_Camera(camera_path='/dev/cams/rpi_src', capture_width=cfg.IMAGE_W, capture_height=cfg.IMAGE_H,
+							mjpeg=cfg.CAMERA_MJPEG, expected_fps=cfg.CAMERA_FRAMERATE, demand=cfg.CAMERA_DEMAND,
+							**cam_kwargs['cam_top'])
+	V.add(cam_top, inputs=[],
+		  outputs=[f'cam_top/pure_image'] + ([f'cam_top/reduced_image'] if cam_kwargs['cam_top'] else []),
+		  threaded=True)
 
 	# setup bottom camera
-	cam_bot = CV_USB_Camera(camera_path='/dev/cams/usb_src', capture_width=cfg.IMAGE_W, capture_height=cfg.IMAGE_H)
+	cam_bot = CV_USB_Camera(camera_path='/dev/cams/usb_src', capture_width=cfg.IMAGE_W, capture_height=cfg.IMAGE_H,
+							mjpeg=cfg.CAMERA_MJPEG, expected_fps=cfg.CAMERA_FRAMERATE, demand=cfg.CAMERA_DEMAND,
+							**cam_kwargs['cam_bot'])
 	# V.add(cam_bot, inputs=[], outputs=[f'cam_bot/pure_image'], threaded=True)
-	V.add(cam_bot, inputs=[], outputs=[f'cam_bot/image_array'], threaded=True)
+	V.add(cam_bot, inputs=[],
+		  outputs=[f'cam_bot/image_array'] + ([f'cam_bot/reduced_image'] if cam_kwargs['cam_bot'] else []),
+		  threaded=True)
+
+	# replace the last frames of both cameras with the freshest pair captured within the tolerance
+	if cfg.CAMERA_SYNC:
+		cam_sync = Dual_Camera_Synchronizer(tolerance_ms=cfg.CAMERA_SYNC_TOLERANCE_MS,
+											history_size=cfg.CAMERA_SYNC_HISTORY_SIZE)
+		cam_sync.attach(cam_top, cam_bot)
+		V.add(cam_sync, inputs=[], outputs=[f'cam_top/pure_image', f'cam_bot/image_array', 'cams/synced', 'cams/skew_ms'])
+		# the reduced frame must be cut from the paired frame, not from the camera's last one
+		for cam_name, cam, frame_key in [('cam_top', cam_top, 'cam_top/pure_image'),
+										 ('cam_bot', cam_bot, 'cam_bot/image_array')]:
+			if cam.reduced_view is not None:
+				V.add(Lambda(cam.reduced_view), inputs=[frame_key], outputs=[f'{cam_name}/reduced_image'])
 
 	time.sleep(0.4)
 
@@ -265,7 +329,9 @@ def dual_cam_drive(cfg,
 
 	aruco_sign_detector = ArucoSignDetector(signs_dict=cfg.ARUCO_SIGNS_DICT,
 											calib_data_path=cfg.ARUCO_CAMERA_CALIB_DATA_PATH,
-											marker_size_mm=cfg.ARUCO_SIGN_SIZE_MM)
+											marker_size_mm=cfg.ARUCO_SIGN_SIZE_MM,
+											detect_scale=cfg.ARUCO_DETECT_SCALE,
+											detect_roi=cfg.ARUCO_DETECT_ROI)
 											# marker_size_mm=38/2)
 	if cfg.ARUCO_SIGNS_SAVE_TO_DIR:
 		aruco_sign_detector.save_signs_to_dir()
@@ -288,15 +354,34 @@ def dual_cam_drive(cfg,
 	# 	  threaded=False)
 
 
-	V.add(aruco_sign_detector,
-		  # inputs=[f'{cfg.ROAD_CAM}/pure_image', f'{cfg.SIGNS_CAM}/pure_image'],
-		  # outputs=[f'{cfg.ROAD_CAM}/image_array', f'{cfg.SIGNS_CAM}/image_array', 'aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'],
-
-		  # inputs=[f'cam_top/pure_image', f'cam_bot/pure_image'],
-		  inputs=[f'cam_top/pure_image'],
-		  # outputs=[f'cam_top/image_array', 'aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'],
-		  outputs=[f'cam_top/image_array', f'cam_top/detected_aruco', 'aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'],
-		  threaded=False)
+	if cfg.ARUCO_WORKER_PROCESS:
+		# cam_top frames go to shared memory, markers are found in a worker process with its own GIL,
+		# only drawing stays in the loop
+		frame_bus = Shared_Frame_Ring(shape=(cfg.IMAGE_H, cfg.IMAGE_W, 3), slots=cfg.FRAME_BUS_SLOTS)
+		V.add(Frame_Bus_Publisher(frame_bus), inputs=[f'cam_top/pure_image'])
+		V.add(Frame_Bus_Worker(frame_bus, ArucoSignDetector,
+							   kwargs=dict(signs_dict=cfg.ARUCO_SIGNS_DICT,
+										   calib_data_path=cfg.ARUCO_CAMERA_CALIB_DATA_PATH,
+										   marker_size_mm=cfg.ARUCO_SIGN_SIZE_MM,
+										   detect_scale=cfg.ARUCO_DETECT_SCALE,
+										   detect_roi=cfg.ARUCO_DETECT_ROI),
+							   method='find_signs', default=([], [], None, [])),
+			  outputs=['aruco/signNames', 'aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'])
+		V.add(Lambda(aruco_sign_detector.mark),
+			  inputs=[f'cam_top/pure_image', 'aruco/signNames', 'aruco/markerCorners', 'aruco/distances'],
+			  outputs=[f'cam_top/image_array', f'cam_top/detected_aruco'])
+	else:
+		V.add(aruco_sign_detector,
+			  # inputs=[f'{cfg.ROAD_CAM}/pure_image', f'{cfg.SIGNS_CAM}/pure_image'],
+			  # outputs=[f'{cfg.ROAD_CAM}/image_array', f'{cfg.SIGNS_CAM}/image_array', 'aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'],
+
+			  # inputs=[f'cam_top/pure_image', f'cam_bot/pure_image'],
+			  inputs=[f'cam_top/pure_image'],
+			  # outputs=[f'cam_top/image_array', 'aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'],
+			  outputs=[f'cam_top/image_array', f'cam_top/detected_aruco', 'aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'],
+			  threaded=False)
+		if frame_tracer is not None:
+			V.add(Frame_Trace_Stamp(frame_tracer, 'aruco'), inputs=[f'cam_top/pure_image'])
 
 	V.add(ArucoDriveController(signs_dict=cfg.ARUCO_SIGNS_DICT),
 		  inputs=['aruco/markerCorners', 'aruco/markerIds', 'aruco/distances'],
@@ -308,7 +393,16 @@ def dual_cam_drive(cfg,
 	# - this will add the web controller
 	# - it will optionally add any configured 'joystick' controller
 	#
-	ctr = add_controller(V, cfg)
+	serial_services = []
+	if cfg.AUTOBOT_SERIAL_TRANSPORT == 'asyncio' and cfg.AUTOBOT_BACKEND == 'serial':
+		# serial port is read and written on the web controller's event loop instead of its own threads
+		serial_services.append(Asyncio_Serial_Transport(get_autobot_platform().hardware))
+	# camera health (stalls, reopens, recovery time) is pushed to the web UI together with the robot telemetry
+	ctr = add_controller(V, cfg,
+						 loop_services=serial_services,
+						 telemetry_source=lambda: dict(get_autobot_platform().get_telemetry_dict(),
+													   cameras={'cam_top': cam_top.health.get_stats(),
+																'cam_bot': cam_bot.health.get_stats()}))
 
 	# explode the buttons into their own key/values in memory
 	V.add(ExplodeDict(V.mem, "web/"), inputs=['web/buttons'])
@@ -340,6 +434,13 @@ def dual_cam_drive(cfg,
 	# This is only needed because the part run_condition only accepts boolean
 	V.add(PilotCondition(), inputs=['user/mode'], outputs=['run_pilot'])
 
+	# cameras publish frames in BGR (native OpenCV order); the pilot and the tub need RGB,
+	# so the road frame (reduced one, if configured) is converted only on ticks when one of them runs
+	V.add(Lambda(lambda run_pilot, recording: bool(run_pilot) or bool(recording)),
+		  inputs=['run_pilot', 'recording'], outputs=['road_cam/need_rgb'])
+	V.add(Lambda(to_rgb), inputs=[road_frame_key], outputs=[f'{cfg.ROAD_CAM}/rgb_image'],
+		  run_condition='road_cam/need_rgb')
+
 	def get_record_alert_color(num_records):
 		col = (0, 0, 0)
 		for count, color in cfg.RECORD_ALERT_COLOR_ARR:
@@ -471,9 +572,9 @@ def dual_cam_drive(cfg,
 				ctr.set_button_down_trigger('L1', bh.increment_state)
 			except:
 				pass
-			inputs = [f'{cfg.ROAD_CAM}/pure_image', "behavior/one_hot_state_array"]
+			inputs = [f'{cfg.ROAD_CAM}/rgb_image', "behavior/one_hot_state_array"]
 		else:
-			inputs = [f'{cfg.ROAD_CAM}/pure_image']
+			inputs = [f'{cfg.ROAD_CAM}/rgb_image']
 
 		# collect model inference outputs
 		outputs = ['pilot/angle', 'pilot/throttle']
@@ -489,6 +590,9 @@ def dual_cam_drive(cfg,
 		# 		  outputs=[f'{cfg.ROAD_CAM}/pure_image_trans'])
 		# 	inputs = [f'{cfg.ROAD_CAM}/pure_image_trans'] + inputs[1:]
 		V.add(kl, inputs=inputs, outputs=outputs, run_condition='run_pilot')
+		if frame_tracer is not None:
+			V.add(Frame_Trace_Stamp(frame_tracer, 'pilot'), inputs=[f'{cfg.ROAD_CAM}/pure_image'],
+				  run_condition='run_pilot')
 
 	# NOTE: when launch throttle is in effect, pilot speed is set to None
 	#
@@ -501,6 +605,8 @@ def dual_cam_drive(cfg,
 							   'pilot/angle', 'pilot/throttle',
 							   'aruco/angle', 'aruco/throttle',
 							   ], outputs=['angle', 'throttle'])
+	if frame_tracer is not None:
+		V.add(Frame_Trace_Stamp(frame_tracer, 'drive_mode'), inputs=[f'{cfg.ROAD_CAM}/pure_image'])
 
 	if isinstance(ctr, JoystickController):
 		ctr.set_button_down_trigger(cfg.AI_LAUNCH_ENABLE_BUTTON, aiLauncher.enable_ai_launch)
@@ -533,23 +639,18 @@ def dual_cam_drive(cfg,
 		# inputs += ['telemetry/rfid']
 		# types += ['str']
 
-		V.add(Sensor_Battery(), inputs=[], outputs=['telemetry/battery'], threaded=False)
-		inputs += ['telemetry/battery']
-		types += ['int']
-
-		V.add(Sensor_US(),
-			  inputs=[],
-			  outputs=['telemetry/us1', 'telemetry/us2', 'telemetry/us3', 'telemetry/us4', 'telemetry/us5'],
-			  threaded=False)
-		inputs += ['telemetry/us1', 'telemetry/us2', 'telemetry/us3', 'telemetry/us4', 'telemetry/us5']
-		types += ['int', 'int', 'int', 'int', 'int']
+		telemetry_outputs = ['telemetry/ir1', 'telemetry/ir2', 'telemetry/ir3', 'telemetry/ir4', 'telemetry/ir5',
+							 'telemetry/us1', 'telemetry/us2', 'telemetry/us3', 'telemetry/us4', 'telemetry/us5',
+							 'telemetry/battery']
+		V.add(Sensor_Telemetry(), inputs=[], outputs=telemetry_outputs, threaded=False)
+		inputs += telemetry_outputs
+		types += ['int'] * len(telemetry_outputs)
 
-		V.add(Sensor_IR(),
-			  inputs=[],
-			  outputs=['telemetry/ir1', 'telemetry/ir2', 'telemetry/ir3', 'telemetry/ir4', 'telemetry/ir5'],
-			  threaded=False)
-		inputs += ['telemetry/ir1', 'telemetry/ir2', 'telemetry/ir3', 'telemetry/ir4', 'telemetry/ir5']
-		types += ['int', 'int', 'int', 'int', 'int']
+		if cfg.AUTOBOT_TELEMETRY_FILTERED:
+			filtered_outputs = ['telemetry/ir_filtered', 'telemetry/us_filtered']
+			V.add(Sensor_Telemetry_Filtered(), inputs=[], outputs=filtered_outputs, threaded=False)
+			inputs += filtered_outputs
+			types += ['list'] * len(filtered_outputs)
 
 	current_tub_path = cfg.DATA_PATH
 	if cfg.AUTO_CREATE_NEW_TUB:
@@ -560,7 +661,7 @@ def dual_cam_drive(cfg,
 								   inputs=inputs + ['cam/image_array', ],
 								   types=types + ['image_array', ], metadata=meta)
 	# V.add(cam_top_tub_writer, inputs=inputs + [f'{cfg.ROAD_CAM}/pure_image'], outputs=["tub/num_records"], run_condition='recording')
-	V.add(cam_top_tub_writer, inputs=inputs + [f'{cfg.ROAD_CAM}/pure_image'], outputs=["tub/num_records"], run_condition='recording')
+	V.add(cam_top_tub_writer, inputs=inputs + [f'{cfg.ROAD_CAM}/rgb_image'], outputs=["tub/num_records"], run_condition='recording')
 
 	print(f"{'-' * 20}\n{'-' * 20}\n{'-' * 20}\n")
 	print(f"You can now go to:\n\n<your hostname.local>:{cfg.WEB_CONTROL_PORT}\nto drive your car.\n")
@@ -34,9 +34,23 @@ CAMERA_SENSOR_ID = 0				# in double_cam.py mode specifies camera idx to write fr
 CSIC_CAM_GSTREAMER_FLIP_PARM = 2	# (0 => none , 4 => Flip horizontally, 6 => Flip vertically)
 # IMAGE_W, IMAGE_H = 224, 224		# default
 IMAGE_W, IMAGE_H = 320, 240			# custom
+CAMERA_MJPEG = False				# request MJPEG from the USB cameras and keep frames compressed until a part needs pixels
+# ROAD_CAM reduced frame for the pilot and the tub: ROI (x_min, y_min, x_max, y_max) and decimation step applied at capture
+# time as a zero-copy slice; the model must be trained on frames reduced the same way
+CAMERA_ROI = None					# None - full frame
+# CAMERA_ROI = (0, 60, 320, 240)	# e.g. drop the top quarter of the frame
+CAMERA_DECIMATION = 1				# take every n-th row and column (1 - all)
+# USB camera capture driven by the drive loop rate: 'grab' - frames the loop will not consume are only grabbed
+# (no decode / copy), 'fps' - the camera frame rate is lowered to the loop rate with headroom
+CAMERA_DEMAND = None					# None - capture and decode every frame
+CAMERA_SYNC = False					# pair cam_top / cam_bot frames by capture time (parts/frame_sync.py)
+CAMERA_SYNC_TOLERANCE_MS = 15		# max capture time difference of a matched pair
+CAMERA_SYNC_HISTORY_SIZE = 4		# frames of each camera kept for pairing
 
 ROAD_CAM, SIGNS_CAM = 'cam_top', 'cam_bot'
 # ROAD_CAM, SIGNS_CAM = 'cam_bot', 'cam_top'
+FRAME_TRACE = False					# log capture-to-stage latency (p50 / p99) of ROAD_CAM frames (parts/frame_trace.py)
+FRAME_TRACE_LOG_INTERVAL = 10		# the interval in seconds for logging the latency report
 
 
 ### HW AND CONTROLS ----------------------------------------------------------------------------------------------------
@@ -51,6 +65,32 @@ JOYSTICK_MAX_THROTTLE = 1
 # ENABLE_AUTOBOT_TELEMETRY = False
 ENABLE_AUTOBOT_TELEMETRY = True
 
+### AUTOBOT CONTROLLER -------------------------------------------------------------------------------------------------
+AUTOBOT_BACKEND = os.getenv('AUTOBOT_BACKEND', 'serial')	# (serial | sim) sim runs without MegaBot controller
+AUTOBOT_SERIAL_TRANSPORT = 'thread'	# (thread | asyncio) asyncio serves the serial port on the web controller's event loop
+AUTOBOT_SERIAL_LOG_DIR = None		# directory for binary serial traffic log (parts/serial_log.py), None - disabled
+# AUTOBOT_SERIAL_LOG_DIR = os.path.join(DONKEY_CAR_DIR_PATH, 'logs', 'serial')
+
+### AUTOBOT SENSOR FILTERS ---------------------------------------------------------------------------------------------
+AUTOBOT_TELEMETRY_FILTERED = True		# add telemetry/ir_filtered and telemetry/us_filtered outputs to the tub
+AUTOBOT_SENSOR_HISTORY_SIZE = 256		# IR / US samples kept per channel (parts/sensor_history.py)
+AUTOBOT_SENSOR_MEDIAN_WINDOW = 5		# samples in the running median window
+AUTOBOT_SENSOR_OUTLIER_THRESHOLD = 50	# samples farther than this from the running median are replaced by it
+AUTOBOT_SENSOR_EMA_ALPHA = 0.3			# smoothing factor of the filtered output (1 - no smoothing)
+
+### AUTOBOT SAFETY -----------------------------------------------------------------------------------------------------
+AUTOBOT_SAFETY_STOP = False				# stop wheels from the serial reader thread when an obstacle is too close
+AUTOBOT_SAFETY_US_STOP_DISTANCE = 20	# US reading below this trips the stop, None - US not checked
+AUTOBOT_SAFETY_IR_STOP_DISTANCE = None	# IR reading below this trips the stop, None - IR not checked
+AUTOBOT_SAFETY_RELEASE_MARGIN = 5		# all readings must be this much above the threshold to release the stop
+AUTOBOT_SAFETY_US_CHANNELS = None		# US channels (0..4) to check, None - all
+AUTOBOT_SAFETY_IR_CHANNELS = None		# IR channels (0..4) to check, None - all
+AUTOBOT_SAFETY_ALLOW_REVERSE = True		# allow backing away while the stop is active
+
+### AUTOBOT WHEELS -----------------------------------------------------------------------------------------------------
+AUTOBOT_WHEELS_HYSTERESIS = 2		# wheel power changes smaller than this (of -100..100) are not sent
+AUTOBOT_WHEELS_KEEPALIVE_SEC = 0.5	# resend unchanged WHEELS command after this interval (firmware watchdog)
+
 ### GAMEPAD ------------------------------------------------------------------------------------------------------------
 # USE_JOYSTICK_AS_DEFAULT = False
 USE_JOYSTICK_AS_DEFAULT = True
@@ -95,6 +135,12 @@ PI_HOSTNAME = '192.168.42.220'
 # ARUCO_SIGN_SIZE_MM = 38/2
 ARUCO_SIGN_SIZE_MM = 80/2.3
 ARUCO_CAMERA_CALIB_DATA_PATH = './camera_calibartion/calib_data/MultiMatrix.npz'
+ARUCO_DETECT_SCALE = 1		# (1 | 2 | 4 | 8) search markers on a frame downscaled this many times (MJPEG frames are decoded downscaled)
+ARUCO_DETECT_ROI = None		# (x_min, y_min, x_max, y_max) region of the frame to search markers in, None - full frame
+# detect markers in a worker process reading cam_top frames from shared memory (parts/frame_bus.py);
+# marker results then lag the camera by about one tick
+ARUCO_WORKER_PROCESS = False
+FRAME_BUS_SLOTS = 4			# frames kept in the shared memory ring; a worker slower than this many frames discards its results
 
 ARUCO_SIGNS_SAVE_TO_DIR = True
 ARUCO_SIGNS_DICT = {
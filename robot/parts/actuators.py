@@ -2,16 +2,31 @@ import os
 import serial
 import sys
 import time
+import asyncio
 import json
 import datetime
 import threading
-from textwrap import wrap
+import traceback
+import contextlib
+import collections
 from typing import List, Tuple, Any, Dict
+from concurrent.futures import Future
 import logging
 
+import numpy as np
+
 import donkeycar as dk
 from donkeycar.utils import clamp
 
+from parts.serial_protocol import Sensor_Frame_Parser, Serial_Frame_Splitter, Command_Frame_Encoder
+from parts.telemetry import Telemetry_Snapshot, SNAPSHOT_SIZE, TELEMETRY_VALUES_COUNT, DEFAULT_RANGE_VALUE, \
+	Seqlock_Array, FILTERED_SIZE, FILTERED_IR_SLICE, FILTERED_US_SLICE, IR_SLICE, US_SLICE, BATTERY_IDX, TIME_NS_IDX
+from parts.sensor_history import Sensor_History
+from parts.safety import Obstacle_Stop_Interlock
+from parts.serial_sim import Simulated_Serial
+from parts.serial_log import Serial_Traffic_Log, DIRECTION_IN, DIRECTION_OUT
+from parts.serial_ack import Command_Ack_Tracker
+
 
 
 
@@ -28,13 +43,33 @@ class Base_Serial():
 	def __init__(self,
 				 device: str = os.getenv('HW_SERIAL', '/dev/ttyUSB0'),
 				 baudrate: int = 115200,
+				 serial_port=None,
 				 ):
+		"""
+		:param device:      Путь к serial устройству.
+		:param baudrate:    Скорость serial порта.
+		:param serial_port: Уже открытый порт с интерфейсом serial.Serial (например, Simulated_Serial).
+							Если не задан, открывается `device`.
+		"""
 		self.device = device
 		self.baudrate = baudrate
 
-		self.serial = serial.Serial(self.device)
+		if serial_port is None:
+			serial_port = serial.Serial(self.device)
+		self.serial = serial_port
 		self.serial.baudrate = self.baudrate
 
+		# Журнал трафика serial (см. self.set_traffic_log). По умолчанию выключен.
+		self.traffic_log = None
+
+	def set_traffic_log(self, traffic_log: Serial_Traffic_Log or None) -> None:
+		"""
+		Включить запись всех входящих и исходящих сообщений в журнал или выключить ее (None).
+		:param traffic_log: parts.serial_log.Serial_Traffic_Log или None.
+		:return:
+		"""
+		self.traffic_log = traffic_log
+
 	def __encode_message(self,
 						 message: str) -> bytes:
 		"""
@@ -71,7 +106,11 @@ class Base_Serial():
 		# try:
 		# self.serial.write(encoded_message)
 		# return True
-		return self.serial.write(encoded_message)
+		written = self.serial.write(encoded_message)
+		traffic_log = self.traffic_log
+		if traffic_log is not None:
+			traffic_log.record(DIRECTION_OUT, encoded_message)
+		return written
 
 		# except:
 		#     return False
@@ -100,6 +139,19 @@ class Base_Serial():
 			return ""
 		return self.__decode_message(bytes_message=encoded_message)
 
+	def _read_available(self) -> bytes:
+		"""
+		Считать с контроллера self.serial все накопившиеся в порту байты за один вызов.
+		Если в порту ничего нет, ждет хотя бы один байт.
+
+		:return:
+		"""
+		bytes_waiting = self.serial.in_waiting
+		data_from_serial = self.serial.read(bytes_waiting if bytes_waiting else 1)
+		if type(data_from_serial) == type(None):
+			return b""
+		return data_from_serial
+
 	def write(self, message: str) -> bool:
 		"""
 		Кодировать и отправить сообщение на контроллер self.serial.
@@ -113,6 +165,15 @@ class Base_Serial():
 		# except:
 		#     return False
 
+	def write_bytes(self, encoded_message: bytes) -> int:
+		"""
+		Отправить уже кодированное сообщение на контроллер self.serial.
+
+		:param encoded_message: bytes
+		:return:
+		"""
+		return self.__write_bytes_to_serial(encoded_message=encoded_message)
+
 class Threaded_Serial(Base_Serial, threading.Thread):
 	"""
 	- Клас для взаимодействия с контроллером serial.
@@ -123,17 +184,55 @@ class Threaded_Serial(Base_Serial, threading.Thread):
 				 device: str = os.getenv('HW_SERIAL', '/dev/ttyUSB0'),
 				 baudrate: int = 115200,
 				 daemon=False,
+				 serial_port=None,
 				 ):
 		# BaseSerialConnection.__init__(self,
 		super().__init__(device=device,
-						 baudrate=baudrate)
+						 baudrate=baudrate,
+						 serial_port=serial_port)
+
+		self.splitter = Serial_Frame_Splitter()
+		# Сообщения, на которых self.parse_message упал с исключением
+		self.parse_errors = 0
 
 		self.is_active = True
 		threading.Thread.__init__(self, daemon=daemon)
 
-	def parse_message(self, message: str):
+	def parse_message(self, message: bytes or memoryview):
 		pass
 
+	def fileno(self) -> int:
+		"""
+		:return: Файловый дескриптор порта для selectors / asyncio.
+		"""
+		return self.serial.fileno()
+
+	def process_available(self) -> int:
+		"""
+		Считать и распарсить все байты, уже накопившиеся в порту, не блокируя поток.
+		Используется вместо потока чтения (self.run), когда порт читается из внешнего цикла
+		по готовности self.fileno() (например, parts.robot_hub.RobotHub).
+		:return: Количество прочитанных байт.
+		"""
+		bytes_waiting = self.serial.in_waiting
+		if not bytes_waiting:
+			return 0
+		data = self.serial.read(bytes_waiting)
+		self.__feed(data)
+		return len(data)
+
+	def get_read_stats(self) -> dict:
+		"""
+		Получить статистику чтения: количество принятых, поврежденных и отброшенных сообщений.
+		:return:
+		"""
+		return {
+			'frames': self.splitter.frames,
+			'malformed_frames': self.splitter.malformed_frames,
+			'dropped_frames': self.splitter.dropped_frames,
+			'parse_errors': self.parse_errors,
+		}
+
 	def stop(self):
 		"""
 		Остановить чтение данных, выполняемое в отдельном потоке (смотри self.run)
@@ -143,15 +242,318 @@ class Threaded_Serial(Base_Serial, threading.Thread):
 
 	def run(self):
 		"""
-		Читает сообщения с self.serial,
-			декодирует,
-			добавляет в self.sensors,
+		Читает все доступные байты с self.serial,
+			разбивает их на сообщения
+			и передает в self.parse_message
 			в отдельном потоке.
 		:return:
 		"""
 		while self.is_active:
-			message = self._read()
+			data = self._read_available()
+			if len(data):
+				self.__feed(data)
+
+	def __feed(self, data: bytes) -> None:
+		"""
+		Разбить прочитанные байты на сообщения и передать их в self.parse_message.
+		"""
+		if self.traffic_log is None:
+			self.splitter.feed(data, self.__parse_message_guarded)
+		else:
+			self.splitter.feed(data, self.__log_and_parse_message)
+
+	def __log_and_parse_message(self, message: memoryview) -> None:
+		"""
+		Записать принятое сообщение в журнал трафика и распарсить его.
+		Время сообщения в журнале - время добавления в журнал (см. Serial_Traffic_Log.record).
+		"""
+		traffic_log = self.traffic_log
+		if traffic_log is not None:
+			traffic_log.record(DIRECTION_IN, message)
+		self.__parse_message_guarded(message)
+
+	def __parse_message_guarded(self, message: memoryview) -> None:
+		"""
+		Распарсить сообщение. Исключение в разборе одного сообщения не должно останавливать поток чтения:
+		вместе с ним остановились бы телеметрия, подтверждения команд и аварийная остановка.
+		"""
+		try:
 			self.parse_message(message=message)
+		except Exception:
+			self.parse_errors += 1
+			# traceback передается строкой: запись журнала с exc_info держала бы кадр с memoryview сообщения,
+			# и Serial_Frame_Splitter не смог бы сдвинуть свой буфер
+			logger.error(f"[Threaded_Serial]: failed to parse message {bytes(message)!r}\n{traceback.format_exc()}")
+
+class Serial_Writer(threading.Thread):
+	"""
+	- Поток записи команд на контроллер serial.
+	- Команды складываются в ограниченную очередь и отправляются не чаще,
+	  чем раз в `frame_interval` секунд, не блокируя вызывающий поток.
+	- Ожидающая отправки команда заменяется более новой командой с тем же ключом
+	  (например, в очереди остается только последний кадр WHEELS).
+	- Срочная команда (self.put_urgent) не заменяется обычными командами и не вытесняется из переполненной очереди:
+	  обычная команда с тем же ключом, пришедшая раньше ее записи, отбрасывается.
+	"""
+
+	def __init__(self,
+				 write_function,
+				 max_queue_size: int = 16,
+				 frame_interval: float = 0.01,
+				 daemon: bool = True,
+				 on_write=None,
+				 on_discard=None,
+				 ):
+		"""
+		:param write_function: Функция отправки сообщения на контроллер (например, Base_Serial.write_bytes).
+		:param max_queue_size: Максимальное количество ожидающих отправки команд.
+		:param frame_interval: Минимальный интервал между отправкой команд в секундах.
+		:param daemon:         Запустить поток как daemon.
+		:param on_write:       Функция (ключ, сообщение, время записи по time.monotonic_ns()),
+							   вызывается непосредственно перед записью каждой команды в порт.
+		:param on_discard:     Функция (ключ, сообщение), вызывается для команды, которая не будет записана
+							   (заменена более новой командой или вытеснена из переполненной очереди).
+		"""
+		threading.Thread.__init__(self, daemon=daemon)
+		assert max_queue_size > 0, Exception(f"Bad value for argument `max_queue_size`. Must be > 0.")
+		self.write_function = write_function
+		self.on_write = on_write
+		self.on_discard = on_discard
+		# Функция без аргументов, вызывается после постановки команды в очередь.
+		# Нужна внешнему циклу записи (см. self.write_pending), чтобы проснуться.
+		self.on_put = None
+		self.__next_write_time = 0.
+		self.max_queue_size = max_queue_size
+		self.frame_interval = frame_interval
+
+		# ключ команды -> (((ключ устройства, сообщение), ...), время постановки в очередь, срочная команда)
+		self.__pending = collections.OrderedDict()
+		self.__condition = threading.Condition()
+		self.__is_writing = False
+
+		self.frames_written = 0
+		self.frames_coalesced = 0
+		self.frames_dropped = 0
+		self.last_write_latency = 0.
+		self.max_write_latency = 0.
+		self.__total_write_latency = 0.
+
+		self.is_active = True
+
+	def put(self, key: str, message: bytes) -> None:
+		"""
+		Поставить команду в очередь на отправку. Не блокирует вызывающий поток.
+		Если в очереди уже есть команда с таким же ключом, она заменяется новой
+		(кроме срочной команды - тогда отбрасывается новая).
+		Если очередь переполнена, самая старая несрочная команда отбрасывается.
+		:param key:     Ключ команды (имя устройства).
+		:param message: Сообщение для отправки.
+		:return:        None.
+		"""
+		self.__enqueue(key=key, messages=((key, message),))
+
+	def put_urgent(self, key: str, message: bytes) -> None:
+		"""
+		Поставить команду первой в очередь и записать ее без выдержки интервала self.frame_interval
+		(например, аварийная остановка колес). Команды с тем же ключом, ожидающие отправки, в том числе
+		в пакетах put_batch, отбрасываются.
+		:param key:     Ключ команды (имя устройства).
+		:param message: Сообщение для отправки.
+		:return:        None.
+		"""
+		with self.__condition:
+			for pending_key in [k for k in self.__pending.keys() if type(k) is tuple and key in k]:
+				messages, enqueue_time, urgent = self.__pending[pending_key]
+				for k, m in messages:
+					if k == key:
+						self.__discard(k, m)
+				messages = tuple((k, m) for k, m in messages if k != key)
+				if len(messages):
+					self.__pending[pending_key] = (messages, enqueue_time, urgent)
+				else:
+					del self.__pending[pending_key]
+			self.__enqueue(key=key, messages=((key, message),), urgent=True)
+			self.__pending.move_to_end(key, last=False)
+
+	def put_batch(self, messages: List[Tuple[str, bytes]]) -> None:
+		"""
+		Поставить в очередь несколько команд, которые будут записаны в порт одной записью.
+		Ожидающие отправки одиночные команды с теми же ключами отбрасываются как замененные.
+		Команда пакета, ключ которой занят ожидающей срочной командой, из пакета отбрасывается.
+		:param messages: Список (ключ команды, сообщение).
+		:return:         None.
+		"""
+		with self.__condition:
+			batch = []
+			for key, message in messages:
+				pending = self.__pending.get(key)
+				if pending is not None and pending[2]:
+					self.__discard(key, message)
+					continue
+				if pending is not None:
+					del self.__pending[key]
+					self.__discard(key, pending[0][0][1])
+				batch.append((key, message))
+			if len(batch):
+				self.__enqueue(key=tuple(key for key, _ in batch), messages=tuple(batch))
+
+	def __discard(self, key: str, message: bytes) -> None:
+		"""
+		Команда заменена в очереди и не будет записана.
+		"""
+		self.frames_coalesced += 1
+		if self.on_discard is not None:
+			self.on_discard(key, message)
+
+	def __drop(self, key: str or tuple, messages: tuple) -> None:
+		"""
+		Команда вытеснена из переполненной очереди и не будет записана.
+		"""
+		self.frames_dropped += 1
+		if self.on_discard is not None:
+			for discarded_key, message in messages:
+				self.on_discard(discarded_key, message)
+		logger.warning(f"[Serial_Writer]: queue is full, command `{key}` dropped")
+
+	def __enqueue(self, key: str or tuple, messages: tuple, urgent: bool = False) -> None:
+		with self.__condition:
+			if key in self.__pending:
+				pending_messages, enqueue_time, was_urgent = self.__pending[key]
+				if was_urgent and not urgent:
+					# срочная команда (аварийная остановка) не заменяется обычной
+					for discarded_key, message in messages:
+						self.__discard(discarded_key, message)
+					return
+				self.__pending[key] = (messages, enqueue_time, urgent)
+				for discarded_key, message in pending_messages:
+					self.__discard(discarded_key, message)
+			else:
+				if len(self.__pending) >= self.max_queue_size:
+					# вытесняется самая старая несрочная команда; если в очереди только срочные - новая несрочная
+					dropped_key = next((k for k, (_, _, was_urgent) in self.__pending.items() if not was_urgent), None)
+					if dropped_key is None and not urgent:
+						self.__drop(key, messages)
+						return
+					if dropped_key is not None:
+						self.__drop(dropped_key, self.__pending.pop(dropped_key)[0])
+				self.__pending[key] = (messages, time.monotonic(), urgent)
+			self.__condition.notify()
+		if self.on_put is not None:
+			self.on_put()
+
+	def get_queue_depth(self) -> int:
+		"""
+		:return: Количество команд, ожидающих отправки.
+		"""
+		with self.__condition:
+			return len(self.__pending)
+
+	def get_stats(self) -> dict:
+		"""
+		Получить статистику отправки команд.
+		Задержка записи считается от постановки команды в очередь до окончания записи в порт.
+		:return: Словарь со статистикой.
+		"""
+		with self.__condition:
+			return {
+				'queue_depth': len(self.__pending),
+				'frames_written': self.frames_written,
+				'frames_coalesced': self.frames_coalesced,
+				'frames_dropped': self.frames_dropped,
+				'last_write_latency_ms': self.last_write_latency * 1000,
+				'max_write_latency_ms': self.max_write_latency * 1000,
+				'avg_write_latency_ms': self.__total_write_latency * 1000 / self.frames_written
+										if self.frames_written else 0.,
+			}
+
+	def flush(self, timeout: float = 1.) -> bool:
+		"""
+		Дождаться отправки всех команд из очереди.
+		:param timeout: Максимальное время ожидания в секундах.
+		:return:        True, если очередь опустела.
+		"""
+		with self.__condition:
+			return self.__condition.wait_for(lambda: not len(self.__pending) and not self.__is_writing,
+											 timeout=timeout)
+
+	def stop(self):
+		"""
+		Остановить поток записи.
+		:return:
+		"""
+		with self.__condition:
+			self.is_active = False
+			self.__condition.notify_all()
+
+	def write_pending(self) -> float or None:
+		"""
+		Записать первую команду из очереди, если интервал self.frame_interval уже выдержан. Не блокирует поток.
+		Используется вместо потока записи (self.run), когда запись ведется из внешнего цикла
+		(например, parts.robot_hub.RobotHub); внешний цикл будится через self.on_put.
+		:return: Через сколько секунд вызвать снова или None, если очередь пуста.
+		"""
+		with self.__condition:
+			if not len(self.__pending):
+				return None
+			_, _, urgent = next(iter(self.__pending.values()))
+			delay = self.__next_write_time - time.monotonic()
+			if delay > 0 and not urgent:
+				return delay
+			_, (messages, enqueue_time, _) = self.__pending.popitem(last=False)
+			self.__is_writing = True
+
+		self.__write(messages=messages, enqueue_time=enqueue_time)
+		with self.__condition:
+			return self.frame_interval if len(self.__pending) else None
+
+	def run(self):
+		"""
+		Отправляет команды из очереди на контроллер, выдерживая интервал self.frame_interval.
+		:return:
+		"""
+		while self.is_active:
+			with self.__condition:
+				# Ждем интервал под условием: срочная команда, поставленная во время ожидания,
+				# встает первой и записывается сразу (первая команда очереди проверяется заново)
+				while self.is_active:
+					if not len(self.__pending):
+						self.__condition.wait()
+						continue
+					_, _, urgent = next(iter(self.__pending.values()))
+					delay = self.__next_write_time - time.monotonic()
+					if delay <= 0 or urgent:
+						break
+					self.__condition.wait(timeout=delay)
+				if not self.is_active:
+					break
+				_, (messages, enqueue_time, _) = self.__pending.popitem(last=False)
+				self.__is_writing = True
+
+			self.__write(messages=messages, enqueue_time=enqueue_time)
+
+	def __write(self, messages: tuple, enqueue_time: float) -> None:
+		"""
+		Записать команды одной записью в порт и обновить статистику.
+		"""
+		try:
+			# Отмечаем команду до записи: ответ контроллера может прийти раньше, чем вернется write_function
+			if self.on_write is not None:
+				write_start_time_ns = time.monotonic_ns()
+				for key, message in messages:
+					self.on_write(key, message, write_start_time_ns)
+			self.write_function(messages[0][1] if len(messages) == 1 else b''.join(message for _, message in messages))
+		finally:
+			write_time = time.monotonic()
+			self.__next_write_time = write_time + self.frame_interval
+
+			with self.__condition:
+				latency = write_time - enqueue_time
+				self.frames_written += 1
+				self.last_write_latency = latency
+				self.max_write_latency = max(self.max_write_latency, latency)
+				self.__total_write_latency += latency
+				self.__is_writing = False
+				self.__condition.notify_all()
 
 class RobotHardware(Threaded_Serial):
 	"""
@@ -163,118 +565,211 @@ class RobotHardware(Threaded_Serial):
 				 baudrate: int = 115200,
 				 autostart: bool = True,
 				 daemon: bool = False,
+				 write_queue_size: int = 16,
+				 write_interval: float = 0.01,
+				 serial_port=None,
+				 traffic_log_dir: str = None,
+				 sensor_filters: dict = None,
+				 safety_interlock: Obstacle_Stop_Interlock = None,
 				 ):
-		init_datetime = str(datetime.datetime.now())
-		self.__sensor_mask_placeholder = '@'
+		# Время в состоянии сенсоров и устройств хранится как time.monotonic_ns(),
+		# в строку даты оно переводится только в self.get_sensors_and_devices().
+		init_time_ns = time.monotonic_ns()
+		self.__wall_clock_offset_ns = time.time_ns() - init_time_ns
 
 		self.sensors = {
 				# SI  0   1   2   3   4  E
 				# SI 014 012 012 013 013 E
 				'IR': {
 					'message_mask': "SI",
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
-					'value': {int(ir_sensor_idx): None for ir_sensor_idx in range(5)},  # всего 5 сенсоров
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 				},
 
 				# SI  0   1   2   3   4  E
 				# SU 175 065 023 048 047 E
 				'US': {
 					'message_mask': "SU",
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
-					'value': {int(us_sensor_idx): None for us_sensor_idx in range(5)},  # всего 5 сенсоров
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 				},
 
 				'BATTERY': {
 					'message_mask': "SA",
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
-					'value': None,
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 				},
 				'RFID': {
 					'message_mask': "SF",
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
-					'value': None,
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 				},
 			}
+		# Значения сенсоров хранятся в буферах разборщика
+		self.parser = Sensor_Frame_Parser(default_value=DEFAULT_RANGE_VALUE)
+		# Согласованный снимок ИК + УЗ + аккумулятор для чтения из других потоков
+		self.telemetry = Telemetry_Snapshot()
+
+		# История и фильтры ИК и УЗ сенсоров (аргументы parts.sensor_history.Sensor_History в sensor_filters).
+		# Отфильтрованные значения [ir1..ir5, us1..us5] публикуются в self.filtered_telemetry.
+		sensor_filters = {} if sensor_filters is None else sensor_filters
+		self.ir_history = Sensor_History(**sensor_filters)
+		self.us_history = Sensor_History(**sensor_filters)
+		self.filtered_telemetry = Seqlock_Array(size=FILTERED_SIZE, dtype=np.float64, fill_value=DEFAULT_RANGE_VALUE)
+		self.__filtered_values = np.full(FILTERED_SIZE, DEFAULT_RANGE_VALUE, dtype=np.float64)
+
+		# Команды устройств кодируются в self.encoder (см. parts.serial_protocol.Command_Frame_Encoder)
+		self.encoder = Command_Frame_Encoder()
+		# Ожидание ответов контроллера на команды и задержка подтверждения (см. self.set_device_value(ack_future=...))
+		self.ack_tracker = Command_Ack_Tracker()
+		# Команды, накопленные в self.batch() текущего потока
+		self.__batch_local = threading.local()
+
+		# Аварийная остановка перед препятствием в потоке чтения (см. parts.safety). None - выключена.
+		self.safety_interlock = safety_interlock
+		self.__safety_stop_frame = self.encoder.encode_wheels(left=0, right=0)
+		self.__safety_trip_time_ns = None
+		# Проверка блокировки и постановка команды колес в очередь - под одной блокировкой с аварийной остановкой:
+		# команда, разрешенная до срабатывания, не может встать в очередь после команды остановки
+		self.__command_lock = threading.Lock()
+
 		self.devices = {
 				'FLASHLIGHT': {
-					'message_mask': f'ZSU{"++"}000{self.__sensor_mask_placeholder}00000E',
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 					'value': None,
 				},
 				'UV_FLASHLIGHT': {
-					'message_mask': f'ZSU{"++"}{self.__sensor_mask_placeholder}00000000E',
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 					'value': None,
 				},
 				# todo: Изменить команды согласно новой прошивке от Игоря
 				'CAMERA_SERVO': {
-					'message_mask': f'ZSS{self.__sensor_mask_placeholder}0000000000E',
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 					'value': None,
 				},
 				# todo: Изменить команды согласно новой прошивке от Игоря
 				'WHEELS': {
+					# ZST0 <lwdir> 00 <lwval> <rwdir> 00 <rwval> E
 					# lwdir - left wheel direction ['+', '-']
 					# lwval - left wheel power 0 to 100
 					# rwdir - right wheel direction ['+', '-']
 					# rwval - right wheel power 0 to 100
-					'message_mask': f'ZST0{"lwdir"}00{"lwval"}{"rwdir"}00{"rwval"}E',
-					'update_datetime': init_datetime,
-					'last_change_datetime': init_datetime,
+					'update_time_ns': init_time_ns,
+					'last_change_time_ns': init_time_ns,
 					'value': {'left': None,
 							  'right': None},
 				},
 			}
 
-		super().__init__(device=device, baudrate=baudrate, daemon=daemon)
+		super().__init__(device=device, baudrate=baudrate, daemon=daemon, serial_port=serial_port)
+		if traffic_log_dir is not None:
+			self.set_traffic_log(Serial_Traffic_Log(log_dir=traffic_log_dir))
+		self.writer = Serial_Writer(write_function=self.write_bytes,
+									max_queue_size=write_queue_size,
+									frame_interval=write_interval,
+									daemon=True,
+									on_write=self.__on_write,
+									on_discard=self.ack_tracker.discard)
 		if autostart:
 			self.start()
 			time.sleep(0.8)
 
-	def parse_message(self, message: str) -> None:
+	def start(self):
+		"""
+		Запустить поток чтения и поток записи.
+		:return:
+		"""
+		self.writer.start()
+		super().start()
+
+	def stop(self):
+		"""
+		Остановить поток чтения и поток записи.
+		:return:
+		"""
+		self.writer.stop()
+		super().stop()
+		if self.traffic_log is not None:
+			self.traffic_log.flush()
+
+	def parse_message(self, message: bytes or memoryview) -> None:
 		"""
 		Распарсить принятое с serial сообщение.
-		В случае совпадения сообщения с маской из self.sensors['sensor_name']['message_mask']
-		обновляет значение сенсора в self.sensors.
-		:param message: Декодированное сообщение с serial.
+		Сенсор определяется по двухбайтовому префиксу сообщения (см. self.sensors['sensor_name']['message_mask']),
+		значение сенсора обновляется в буферах self.parser.
+		:param message: Принятое с serial сообщение (bytes или memoryview).
 		:return:        None.
 		"""
-		this_datetime = str(datetime.datetime.now())
+		# Ответ контроллера на команду начинается с того же 'Z', что и команда (эхо ZST / ZSU / ZSS)
+		if message[0] == 0x5A:
+			self.ack_tracker.on_ack(message, receive_time_ns=time.monotonic_ns())
+			return
+
+		sensor_name = self.parser.parse(message)
+		if sensor_name is None:
+			return
+
+		this_time_ns = time.monotonic_ns()
+		if self.parser.changed:
+			self.sensors[sensor_name]['last_change_time_ns'] = this_time_ns
+		self.sensors[sensor_name]['update_time_ns'] = this_time_ns
 
-		# print(message)
+		if sensor_name != 'RFID':
+			self.telemetry.publish(ir=self.parser.ir,
+								   us=self.parser.us,
+								   battery=self.parser.battery,
+								   time_ns=this_time_ns)
 
-		# Проходимся по по каждой маске для каждого сенсора
-		for _sensor_name, _sensor_data in self.sensors.items():
-			message_mask = self.sensors[_sensor_name]['message_mask']
-			if type(message) == str and len(message):
-				if message[:2] == message_mask[:2]:
-					message = str(message)[2:].replace('E', '')
-					# парсинг многосоставных датчиков типа УЗ или ИК, данные с которых приходят в одной строке
-					if _sensor_name in ['IR', 'US']:
-						raw_values = [int(_value) for _value in wrap(message, 3)]
-						new_value = {_sensor_idx: raw_values[_sensor_idx] for _sensor_idx in range(5)}
-					elif _sensor_name in ['BATTERY', ]:
-						new_value = int(message)
-					# RFID
-					else:
-						new_value = str(message)
+		if self.safety_interlock is not None and sensor_name in Obstacle_Stop_Interlock.SENSOR_NAMES:
+			if self.safety_interlock.check(sensor_name, self.parser.ir if sensor_name == 'IR' else self.parser.us):
+				self.__safety_stop(trip_time_ns=this_time_ns)
 
-					if new_value != self.sensors[_sensor_name]['value']:
-						self.sensors[_sensor_name]['last_change_datetime'] = this_datetime
+		if sensor_name == 'IR':
+			self.__filtered_values[FILTERED_IR_SLICE] = self.ir_history.push(self.parser.ir, time_ns=this_time_ns)
+			self.filtered_telemetry.publish_array(self.__filtered_values)
+		elif sensor_name == 'US':
+			self.__filtered_values[FILTERED_US_SLICE] = self.us_history.push(self.parser.us, time_ns=this_time_ns)
+			self.filtered_telemetry.publish_array(self.__filtered_values)
+
+	def __safety_stop(self, trip_time_ns: int) -> None:
+		"""
+		Остановить колеса по срабатыванию self.safety_interlock, минуя очередь и интервал записи.
+		:param trip_time_ns: Время приема сообщения сенсора, на котором сработала блокировка.
+		:return:             None.
+		"""
+		with self.__command_lock:
+			self.__safety_trip_time_ns = trip_time_ns
+			self.writer.put_urgent(key='WHEELS', message=self.__safety_stop_frame)
+			this_time_ns = time.monotonic_ns()
+			self.safety_interlock.decision_latency.add((this_time_ns - trip_time_ns) / 1e6)
 
-					# if _sensor_name not in ['IR', 'US']: print(self.sensors[_sensor_name])
-					self.sensors[_sensor_name]['update_datetime'] = this_datetime
-					self.sensors[_sensor_name]['value'] = new_value
+			wheels = self.devices['WHEELS']
+			if wheels['value'] != {'left': 0, 'right': 0}:
+				wheels['last_change_time_ns'] = this_time_ns
+			wheels['update_time_ns'] = this_time_ns
+			wheels['value'] = {'left': 0, 'right': 0}
+		logger.warning(f"[RobotHardware]: obstacle stop {self.safety_interlock.last_trip}")
 
-		# print(self.sensors)
+	def __on_write(self, key: str, message: bytes, write_time_ns: int) -> None:
+		"""
+		Вызывается self.writer перед записью каждой команды в порт.
+		"""
+		self.ack_tracker.on_written(key, message, write_time_ns)
+		if self.__safety_trip_time_ns is not None and key == 'WHEELS' and message == self.__safety_stop_frame:
+			self.safety_interlock.stop_write_latency.add((write_time_ns - self.__safety_trip_time_ns) / 1e6)
+			self.__safety_trip_time_ns = None
 
+	def get_safety_stats(self) -> dict or None:
+		"""
+		Получить состояние и статистику аварийной остановки (задержки решения и записи команды остановки).
+		:return: Словарь со статистикой или None, если блокировка выключена.
+		"""
+		if self.safety_interlock is None:
+			return None
+		return self.safety_interlock.get_stats()
 
 	def get_sensor_value(self, sensor_name: str) -> None \
 													or str \
@@ -287,7 +782,7 @@ class RobotHardware(Threaded_Serial):
 		"""
 		sensor_name = sensor_name.upper()
 		assert sensor_name in self.sensors.keys(), Exception(f"Bad name for `sensor_name`. Must be one of {[i for i in self.sensors.keys()]}")
-		return self.sensors[sensor_name]['value']
+		return self.parser.get_value(sensor_name)
 
 	def get_device_value(self, device_name: str) -> int or Dict[str, None or int]:
 		"""
@@ -299,11 +794,16 @@ class RobotHardware(Threaded_Serial):
 		assert device_name in self.devices.keys(), Exception(f"Bad name for `device_name`. Must be one of {[i for i in self.devices.keys()]}")
 		return self.devices[device_name]['value']
 
-	def set_device_value(self, device_name: str, value: int or Tuple[int, int] or List[int]) -> int or Dict[str, int]:
+	def set_device_value(self,
+						 device_name: str,
+						 value: int or Tuple[int, int] or List[int],
+						 ack_future: Future = None) -> int or Dict[str, int]:
 		"""
 		Установить значение для устройства.
 		:param device_name: Имя устройства.
 		:param value:       Значение устройства.
+		:param ack_future:  concurrent.futures.Future, который получит задержку подтверждения команды контроллером в мс
+							(см. parts.serial_ack.Command_Ack_Tracker). None - не ждать подтверждения.
 		:return:            Новое значение устройства.
 		"""
 		device_name = device_name.upper()
@@ -316,9 +816,6 @@ class RobotHardware(Threaded_Serial):
 			assert 0 <= value <= 100, Exception(f"Bad value for argument `value`. Must be int from 0 to 100.\n"
 												 f"GOT:\t{type(value)}\t{value}")
 
-			command_for_serial = self.devices[device_name]['message_mask'].\
-				replace(self.__sensor_mask_placeholder,
-						str(1000 + value)[1:])
 			new_device_value = value
 
 		elif device_name == 'CAMERA_SERVO':
@@ -328,11 +825,7 @@ class RobotHardware(Threaded_Serial):
 			if value < 2:
 				value = 2   # todo: исправить после калибровки сервопривода. Сейчас команда в 0 градусов ставит камеру в 2.
 
-			command_for_serial = self.devices[device_name]['message_mask'].\
-				replace(self.__sensor_mask_placeholder,
-						# str(1000 + value)[1:])
-						# str(1000 + value - 15)[1:]) #
-						str(1000 + value)[1:])
+			assert value <= 999, Exception(f"Bad value for argument `value`. Must fit in 3 digits.")
 			new_device_value = value
 
 		elif device_name == 'WHEELS':
@@ -348,31 +841,145 @@ class RobotHardware(Threaded_Serial):
 													  f"Must be Tuple[left: int, right: int] "
 													  f"where `left` and `right` in range form -100 to 100.\n"
 													  f"GOT:\t{type(value)}\t{value}")
-			left_wheel_value = str(1000 + abs(value["left"]))[1:]
-			right_wheel_value = str(1000 + abs(value["right"]))[1:]
-
-			command_for_serial = self.devices[device_name]['message_mask'].\
-				replace("lwdir", '+' if value["left"] >= 0 else '-').\
-				replace("lwval", left_wheel_value).\
-				replace("rwdir", '+' if value["right"] >= 0 else '-').\
-				replace("rwval", right_wheel_value)
 			new_device_value = {'left': value["left"],
 								'right': value["right"]}
 		else:
 			raise NotImplementedError
 
-		# print(self.write(message=command_for_serial), command_for_serial)
-		self.write(message=command_for_serial)
-		time.sleep(0.01)
+		with self.__command_lock:
+			if device_name == 'WHEELS':
+				new_device_value = self.__apply_safety_interlock(new_device_value)
+
+			batch_commands = getattr(self.__batch_local, 'commands', None)
+			if batch_commands is not None:
+				batch_commands.pop(device_name, None)
+				batch_commands[device_name] = (new_device_value, ack_future)
+			else:
+				command_for_serial = self.encoder.encode(device_name=device_name, value=new_device_value)
+				if ack_future is not None:
+					self.ack_tracker.register(device_name=device_name, frame=command_for_serial, future=ack_future)
+				self.writer.put(key=device_name, message=command_for_serial)
 
-		this_datetime = str(datetime.datetime.now())
-		if new_device_value != self.devices[device_name]['value']:
-			self.devices[device_name]['last_change_datetime'] = this_datetime
-		self.devices[device_name]['update_datetime'] = this_datetime
+			this_time_ns = time.monotonic_ns()
+			if new_device_value != self.devices[device_name]['value']:
+				self.devices[device_name]['last_change_time_ns'] = this_time_ns
+			self.devices[device_name]['update_time_ns'] = this_time_ns
 
-		self.devices[device_name]['value'] = new_device_value
+			self.devices[device_name]['value'] = new_device_value
 		return new_device_value
 
+	def __apply_safety_interlock(self, wheels: Dict[str, int]) -> Dict[str, int]:
+		"""
+		Заменить команду колес остановкой, если ее не разрешает self.safety_interlock. Вызывается под self.__command_lock.
+		"""
+		if self.safety_interlock is not None and not self.safety_interlock.allows(wheels):
+			self.safety_interlock.blocked_commands += 1
+			return {'left': 0, 'right': 0}
+		return wheels
+
+	@contextlib.contextmanager
+	def batch(self):
+		"""
+		Собрать команды устройств, установленные в этом потоке внутри блока `with`, и отправить их одной записью в порт.
+		- Для каждого устройства отправляется только последнее значение.
+		- Фонарик и УФ фонарик, установленные в одном блоке, отправляются одной командой ZSU.
+		- Команды отправляются при выходе из блока, в том числе при исключении
+		  (значения в self.devices к этому моменту уже обновлены).
+		- Вложенный batch() добавляет команды во внешний.
+		- Ожидать подтверждения (Robot.*_set_async) внутри блока нельзя: команда уйдет только после выхода из блока.
+		:return:
+		"""
+		if getattr(self.__batch_local, 'commands', None) is not None:
+			yield
+			return
+
+		self.__batch_local.commands = collections.OrderedDict()
+		try:
+			yield
+		finally:
+			batch_commands = self.__batch_local.commands
+			self.__batch_local.commands = None
+			if len(batch_commands):
+				self.__send_batch(batch_commands)
+
+	def __send_batch(self, batch_commands: collections.OrderedDict) -> None:
+		"""
+		Закодировать и поставить в очередь записи команды, собранные в self.batch().
+		:param batch_commands: Имя устройства -> (значение, ack_future).
+		:return:               None.
+		"""
+		with self.__command_lock:
+			# блокировка могла сработать, пока собирался пакет
+			if 'WHEELS' in batch_commands:
+				wheels, wheels_future = batch_commands['WHEELS']
+				batch_commands['WHEELS'] = (self.__apply_safety_interlock(wheels), wheels_future)
+			self.__enqueue_batch(batch_commands)
+
+	def __enqueue_batch(self, batch_commands: collections.OrderedDict) -> None:
+		if 'FLASHLIGHT' in batch_commands and 'UV_FLASHLIGHT' in batch_commands:
+			flashlight, flashlight_future = batch_commands.pop('FLASHLIGHT')
+			uv_flashlight, uv_flashlight_future = batch_commands.pop('UV_FLASHLIGHT')
+			frame = self.encoder.encode_flashlights(flashlight=flashlight, uv_flashlight=uv_flashlight)
+			# Одна команда - один ответ контроллера: второй future получает результат первого
+			ack_future = flashlight_future or uv_flashlight_future
+			if flashlight_future is not None and uv_flashlight_future is not None:
+				ack_future.add_done_callback(lambda done: uv_flashlight_future.cancel() if done.cancelled()
+											 else uv_flashlight_future.set_result(done.result()))
+			frames = [('FLASHLIGHT', frame, ack_future)]
+		else:
+			frames = []
+		frames += [(device_name, self.encoder.encode(device_name=device_name, value=value), ack_future)
+				   for device_name, (value, ack_future) in batch_commands.items()]
+
+		for device_name, frame, ack_future in frames:
+			if ack_future is not None:
+				self.ack_tracker.register(device_name=device_name, frame=frame, future=ack_future)
+		self.writer.put_batch([(device_name, frame) for device_name, frame, _ in frames])
+
+	def __format_time_ns(self, monotonic_time_ns: int) -> str:
+		"""
+		Перевести время time.monotonic_ns() в строку даты и времени.
+		:param monotonic_time_ns: Время в наносекундах по time.monotonic_ns().
+		:return:                  Строка в формате str(datetime.datetime).
+		"""
+		return str(datetime.datetime.fromtimestamp((monotonic_time_ns + self.__wall_clock_offset_ns) / 1e9))
+
+	def get_sensor_age_ms(self, sensor_name: str) -> float:
+		"""
+		Получить время в миллисекундах, прошедшее с последнего обновления сенсора.
+		:param sensor_name: Имя-ключ сенсора из self.sensors.
+		:return:            Возраст значения сенсора в миллисекундах.
+		"""
+		sensor_name = sensor_name.upper()
+		assert sensor_name in self.sensors.keys(), Exception(f"Bad name for `sensor_name`. Must be one of {[i for i in self.sensors.keys()]}")
+		return (time.monotonic_ns() - self.sensors[sensor_name]['update_time_ns']) / 1e6
+
+	def get_read_stats(self) -> dict:
+		"""
+		Получить статистику чтения с учетом сообщений, которые не смог разобрать self.parser.
+		:return:
+		"""
+		stats = super().get_read_stats()
+		stats['malformed_frames'] += self.parser.malformed_frames
+		stats['unknown_frames'] = self.parser.unknown_frames
+		return stats
+
+	def get_telemetry_snapshot(self, out: np.ndarray = None) -> np.ndarray:
+		"""
+		Получить согласованный снимок телеметрии без блокировки потока чтения.
+		:param out: Массив для записи снимка (см. parts.telemetry.Telemetry_Snapshot.read).
+		:return:    Снимок: [ir1..ir5, us1..us5, battery, time_ns].
+		"""
+		return self.telemetry.read(out=out)
+
+	def get_filtered_telemetry(self, out: np.ndarray = None) -> np.ndarray:
+		"""
+		Получить согласованный снимок отфильтрованных значений ИК и УЗ сенсоров (см. parts.sensor_history.Sensor_History).
+		:param out: Массив np.float64 размера FILTERED_SIZE для записи снимка.
+		:return:    Снимок: [ir1..ir5, us1..us5].
+		"""
+		return self.filtered_telemetry.read(out=out)
+
 	def get_sensors_and_devices(self) -> dict:
 		"""
 		Получить объединенный словарь из self.sensors и self.devices.
@@ -380,28 +987,127 @@ class RobotHardware(Threaded_Serial):
 		"""
 		united = {}
 		united.update({sensor_name: {
-			'value': sensor_value['value'],
-			'update_datetime': sensor_value['update_datetime'],
-			'last_change_datetime': sensor_value['last_change_datetime'],
+			'value': self.parser.get_value(sensor_name),
+			'update_datetime': self.__format_time_ns(sensor_value['update_time_ns']),
+			'last_change_datetime': self.__format_time_ns(sensor_value['last_change_time_ns']),
 		} for (sensor_name, sensor_value) in self.sensors.items()})
 		united.update({device_name: {
 			'value': device_value['value'],
-			'update_datetime': device_value['update_datetime'],
-			'last_change_datetime': device_value['last_change_datetime'],
+			'update_datetime': self.__format_time_ns(device_value['update_time_ns']),
+			'last_change_datetime': self.__format_time_ns(device_value['last_change_time_ns']),
 		} for (device_name, device_value) in self.devices.items()})
 		return united
 
+	def get_writer_stats(self) -> dict:
+		"""
+		Получить статистику очереди записи: глубину очереди и задержку записи.
+		:return:
+		"""
+		return self.writer.get_stats()
+
+	def get_ack_stats(self) -> dict:
+		"""
+		Получить статистику подтверждения команд: счетчики и задержку от записи в порт до ответа контроллера
+		по устройствам (p50 / p99 / max).
+		:return:
+		"""
+		return self.ack_tracker.get_stats()
+
 class Robot:
-	def __init__(self):
-		self.hardware = RobotHardware(autostart=True, daemon=True)
+	def __init__(self,
+				 device: str = os.getenv('HW_SERIAL', '/dev/ttyUSB0'),
+				 serial_port=None,
+				 traffic_log_dir: str = None,
+				 sensor_filters: dict = None,
+				 safety_interlock: Obstacle_Stop_Interlock = None,
+				 hardware: RobotHardware = None,
+				 autostart: bool = True):
+		"""
+		:param device:          Путь к serial устройству контроллера.
+		:param serial_port:     Уже открытый порт с интерфейсом serial.Serial (например, Simulated_Serial).
+		:param traffic_log_dir: Папка для журнала трафика serial (parts.serial_log). None - не записывать.
+		:param sensor_filters:  Аргументы parts.sensor_history.Sensor_History для фильтров ИК и УЗ сенсоров.
+		:param safety_interlock: Аварийная остановка перед препятствием (parts.safety). None - выключена.
+		:param hardware:        Уже созданный RobotHardware (например, в parts.robot_hub.RobotHub).
+								Если задан, остальные аргументы не используются.
+		:param autostart:       Запустить потоки чтения и записи RobotHardware. False - порт обслуживается
+								внешним циклом (parts.serial_asyncio.Asyncio_Serial_Transport).
+		"""
+		if hardware is not None:
+			self.hardware = hardware
+			return
+		self.hardware = RobotHardware(device=device,
+									  serial_port=serial_port,
+									  traffic_log_dir=traffic_log_dir,
+									  sensor_filters=sensor_filters,
+									  safety_interlock=safety_interlock,
+									  autostart=autostart,
+									  daemon=True)
 		# self.wheels_stop()
 		# self.flashlight_turn_off()
 		# self.uv_flashlight_turn_off()
 		# self.camera_servo_set(angle=90)
 
+	def batch(self):
+		"""
+		Отправить несколько команд одной записью в порт:
+
+			with robot.batch():
+				robot.flashlight_set(value=100)
+				robot.uv_flashlight_set(value=50)
+				robot.camera_servo_set(angle=90)
+
+		Фонарик и УФ фонарик объединяются в одну команду ZSU (см. RobotHardware.batch).
+		:return: Контекстный менеджер.
+		"""
+		return self.hardware.batch()
+
 	def get_all_telemetry(self) -> dict:
 		return self.hardware.get_sensors_and_devices()
 
+	def flush(self, timeout: float = 1.) -> bool:
+		"""
+		Дождаться отправки на контроллер всех команд из очереди.
+		:param timeout: Максимальное время ожидания в секундах.
+		:return:        True, если все команды отправлены.
+		"""
+		return self.hardware.writer.flush(timeout=timeout)
+
+	async def set_device_value_async(self,
+									 device_name: str,
+									 value: int or Dict[str, int],
+									 timeout: float = 0.5) -> float:
+		"""
+		Отправить команду устройству и дождаться ответа контроллера (эхо или подтверждение команды).
+		Если команда заменена в очереди записи более новой командой того же устройства,
+		ожидание прерывается asyncio.CancelledError.
+		:param device_name: Имя устройства.
+		:param value:       Значение устройства.
+		:param timeout:     Максимальное время ожидания ответа в секундах.
+		:return:            Задержка от записи команды в порт до ответа контроллера в миллисекундах.
+		"""
+		ack_future = Future()
+		self.hardware.set_device_value(device_name=device_name, value=value, ack_future=ack_future)
+		try:
+			return await asyncio.wait_for(asyncio.wrap_future(ack_future), timeout=timeout)
+		except asyncio.TimeoutError:
+			self.hardware.ack_tracker.expire(ack_future)
+			raise
+
+	def safety_stats(self) -> dict or None:
+		"""
+		Получить состояние и статистику аварийной остановки перед препятствием.
+		:return:
+		"""
+		return self.hardware.get_safety_stats()
+
+	def ack_stats(self) -> dict:
+		"""
+		Получить статистику подтверждения команд контроллером по устройствам.
+		:return:
+		"""
+		return self.hardware.get_ack_stats()
+
 	def battery_get(self) -> int or None:
 		"""
 		Получить состояние аккумулятора.
@@ -429,6 +1135,43 @@ class Robot:
 		"""
 		return self.hardware.get_sensor_value('US')
 
+	def telemetry_get(self, out: np.ndarray = None) -> np.ndarray:
+		"""
+		Получить согласованный снимок ИК, УЗ сенсоров и аккумулятора.
+		:param out: Массив для записи снимка.
+		:return:    Снимок: [ir1..ir5, us1..us5, battery, time_ns].
+		"""
+		return self.hardware.get_telemetry_snapshot(out=out)
+
+	def get_telemetry_dict(self) -> dict:
+		"""
+		Получить снимок телеметрии в виде словаря для JSON (например, для websocket клиентов).
+		:return: {'ir': [5 значений], 'us': [5 значений], 'battery': int, 'age_ms': float}.
+		"""
+		snapshot = self.telemetry_get()
+		return {
+			'ir': snapshot[IR_SLICE].tolist(),
+			'us': snapshot[US_SLICE].tolist(),
+			'battery': int(snapshot[BATTERY_IDX]),
+			'age_ms': (time.monotonic_ns() - int(snapshot[TIME_NS_IDX])) / 1e6,
+		}
+
+	def telemetry_filtered_get(self, out: np.ndarray = None) -> np.ndarray:
+		"""
+		Получить отфильтрованные значения ИК и УЗ сенсоров (медиана, без выбросов, EMA).
+		:param out: Массив np.float64 размера FILTERED_SIZE для записи снимка (чтобы не создавать новый).
+		:return:    Снимок: [ir1..ir5, us1..us5].
+		"""
+		return self.hardware.get_filtered_telemetry(out=out)
+
+	def sensor_age_ms(self, sensor_name: str) -> float:
+		"""
+		Получить время в миллисекундах, прошедшее с последнего обновления сенсора.
+		:param sensor_name: Имя сенсора [`IR`, `US`, `BATTERY`, `RFID`].
+		:return:            Возраст значения сенсора в миллисекундах.
+		"""
+		return self.hardware.get_sensor_age_ms(sensor_name=sensor_name)
+
 
 	def flashlight_set(self, value: int) -> int:
 		"""
@@ -439,6 +1182,15 @@ class Robot:
 		assert 0 <= value <= 100, Exception('Уровень освещенности должен быть от 0 до 100.')
 		return self.hardware.set_device_value(device_name='FLASHLIGHT', value=value)
 
+	async def flashlight_set_async(self, value: int, timeout: float = 0.5) -> float:
+		"""
+		Установить яркость фонаря и дождаться ответа контроллера.
+		:param value:   Значение яркости фонаря от 0 до 100.
+		:param timeout: Максимальное время ожидания ответа в секундах.
+		:return:        Задержка подтверждения в миллисекундах.
+		"""
+		return await self.set_device_value_async(device_name='FLASHLIGHT', value=value, timeout=timeout)
+
 	def flashlight_get(self) -> int:
 		"""
 		Получить уровень освещенности фонарика.
@@ -470,6 +1222,15 @@ class Robot:
 		assert 0 <= value <= 100, Exception('Уровень освещенности должен быть от 0 до 100.')
 		return self.hardware.set_device_value(device_name='UV_FLASHLIGHT', value=value)
 
+	async def uv_flashlight_set_async(self, value: int, timeout: float = 0.5) -> float:
+		"""
+		Установить яркость УФ фонаря и дождаться ответа контроллера.
+		:param value:   Значение яркости УФ фонаря от 0 до 100.
+		:param timeout: Максимальное время ожидания ответа в секундах.
+		:return:        Задержка подтверждения в миллисекундах.
+		"""
+		return await self.set_device_value_async(device_name='UV_FLASHLIGHT', value=value, timeout=timeout)
+
 	def uv_flashlight_get(self) -> int:
 		"""
 		Получить уровень освещенности УФ фонарика.
@@ -502,6 +1263,15 @@ class Robot:
 		#assert 0 <= angle <= 100, Exception('Угол поворота должен быть от 45 до 140.')
 		return self.hardware.set_device_value(device_name='CAMERA_SERVO', value=angle)
 
+	async def camera_servo_set_async(self, angle: int, timeout: float = 0.5) -> float:
+		"""
+		Установить угол поворота камеры и дождаться ответа контроллера.
+		:param angle:   Угол поворота камеры.
+		:param timeout: Максимальное время ожидания ответа в секундах.
+		:return:        Задержка подтверждения в миллисекундах.
+		"""
+		return await self.set_device_value_async(device_name='CAMERA_SERVO', value=angle, timeout=timeout)
+
 	def camera_servo_get(self) -> int:
 		"""
 		Получить положение сервопривода.
@@ -522,6 +1292,19 @@ class Robot:
 		assert -100 <= right <= 100, Exception('Значение мощности для правых колес должно быть от -100 до 100.')
 		return self.hardware.set_device_value(device_name='WHEELS', value={"left": left, "right": right})
 
+	async def wheels_set_async(self, left: int, right: int, timeout: float = 0.5) -> float:
+		"""
+		Установить значения мощности для левых и правых колес и дождаться ответа контроллера.
+		:param left:    Значения мощности для левых колес.
+		:param right:   Значения мощности для правых колес.
+		:param timeout: Максимальное время ожидания ответа в секундах.
+		:return:        Задержка от записи команды в порт до ответа контроллера в миллисекундах.
+		"""
+		assert -100 <= left <= 100, Exception('Значение мощности для левых колес должно быть от -100 до 100.')
+		assert -100 <= right <= 100, Exception('Значение мощности для правых колес должно быть от -100 до 100.')
+		return await self.set_device_value_async(device_name='WHEELS', value={"left": left, "right": right},
+												 timeout=timeout)
+
 	def wheels_get(self)  -> Dict[str, int]:
 		"""
 		Получить значения мощности для левых и правых колес.
@@ -673,14 +1456,82 @@ class Robot:
 
 
 
-# ADD AUTOBOT SERIAL PORT
-autobot_platform = Robot()
+ROBOT_BACKENDS = ['serial', 'sim']
+ROBOT_TRANSPORTS = ['thread', 'asyncio']
+
+
+def create_robot(backend: str = os.getenv('AUTOBOT_BACKEND', 'serial'),
+				 traffic_log_dir: str = None,
+				 sensor_filters: dict = None,
+				 safety_interlock: Obstacle_Stop_Interlock = None,
+				 transport: str = 'thread',
+				 **kwargs) -> Robot:
+	"""
+	Создать Robot с выбранным backend.
+	:param backend:         `serial` - контроллер MegaBot на serial порту,
+							`sim`    - симуляция контроллера без железа (parts.serial_sim.Simulated_Serial).
+	:param traffic_log_dir: Папка для журнала трафика serial. None - не записывать.
+	:param sensor_filters:  Аргументы parts.sensor_history.Sensor_History для фильтров ИК и УЗ сенсоров.
+	:param safety_interlock: Аварийная остановка перед препятствием (parts.safety). None - выключена.
+	:param transport:       `thread`  - потоки чтения и записи RobotHardware,
+							`asyncio` - потоки не запускаются, порт нужно передать в
+										parts.serial_asyncio.Asyncio_Serial_Transport (только `serial`).
+	:param kwargs:          Аргументы для Robot (для `serial`) или Simulated_Serial (для `sim`).
+	:return:                Robot.
+	"""
+	backend = backend.lower()
+	assert backend in ROBOT_BACKENDS, Exception(f"Bad value for argument `backend`. Must be one of {ROBOT_BACKENDS}")
+	assert transport in ROBOT_TRANSPORTS, Exception(f"Bad value for argument `transport`. Must be one of {ROBOT_TRANSPORTS}")
+	if backend == 'sim':
+		# Simulated_Serial не имеет fileno(), поэтому всегда обслуживается потоками
+		return Robot(device='sim', serial_port=Simulated_Serial(**kwargs), traffic_log_dir=traffic_log_dir,
+					 sensor_filters=sensor_filters, safety_interlock=safety_interlock)
+	return Robot(traffic_log_dir=traffic_log_dir, sensor_filters=sensor_filters, safety_interlock=safety_interlock,
+				 autostart=transport == 'thread', **kwargs)
+
+
+# Общий для всех частей экземпляр Robot. Создается лениво, при первом обращении
+# к get_autobot_platform(), или в фоне через start_autobot_platform().
+_autobot_platform = None
+_autobot_platform_lock = threading.Lock()
+
+
+def get_autobot_platform(backend: str = os.getenv('AUTOBOT_BACKEND', 'serial'), **kwargs) -> Robot:
+	"""
+	Получить общий экземпляр Robot, при необходимости создав его.
+	Если экземпляр создается в фоне (start_autobot_platform), ждет окончания создания.
+	:param backend: Backend для create_robot, используется только при создании.
+	:param kwargs:  Аргументы для create_robot, используются только при создании.
+	:return:        Robot.
+	"""
+	global _autobot_platform
+	if _autobot_platform is not None:
+		return _autobot_platform
+	with _autobot_platform_lock:
+		if _autobot_platform is None:
+			_autobot_platform = create_robot(backend=backend, **kwargs)
+		return _autobot_platform
+
+
+def start_autobot_platform(backend: str = os.getenv('AUTOBOT_BACKEND', 'serial'), **kwargs) -> threading.Thread:
+	"""
+	Начать создание общего экземпляра Robot в фоновом потоке, чтобы подключение к контроллеру
+	шло параллельно с запуском камер и загрузкой модели.
+	:param backend: Backend для create_robot.
+	:param kwargs:  Аргументы для create_robot.
+	:return:        Поток, в котором создается Robot.
+	"""
+	thread = threading.Thread(target=get_autobot_platform, kwargs=dict(backend=backend, **kwargs), daemon=True)
+	thread.start()
+	return thread
 
 
 class AutoBot_Actuator(object):
 	def __init__(self,
 				 zero_throttle: float = 0,
-				 max_duty: float = 1):
+				 max_duty: float = 1,
+				 hysteresis: int = 0,
+				 keepalive_interval: float = 0.5):
 		"""
 		zero_throttle: values at or below zero_throttle are treated as zero.
 		max_duty: the maximum duty cycle that will be send to the motors
@@ -689,18 +1540,57 @@ class AutoBot_Actuator(object):
 			if pin_forward and pin_backward are both at duty_cycle == 1,
 			then the motor will be forcibly stopped (can be used for braking)
 		max_duty is from 0 to 1 (fully off to fully on). I've read 0.9 is a good max.
+		hysteresis: wheel power changes (in -100..100 units) smaller than this are
+			held at the last sent value. A command to stop a wheel is always sent.
+		keepalive_interval: seconds after which the last WHEELS command is resent
+			even if it did not change, to keep the firmware watchdog satisfied.
 		"""
 		self.running = True
 		self.zero_throttle = zero_throttle
 		self.max_duty = max_duty
+		self.hysteresis = hysteresis
+		self.keepalive_interval = keepalive_interval
 
 		self.left_throttle = 0
 		self.right_throttle = 0
 
+		self.last_sent_wheels = None
+		self.last_send_time = 0.
+		self.frames_sent = 0
+		self.frames_suppressed = 0
+
+	def _quantize(self, value: int, last_value: int) -> int:
+		"""
+		Удержать значение мощности на последнем отправленном, если изменение меньше self.hysteresis.
+		Остановка колеса (0) всегда проходит без изменений.
+		"""
+		if value == 0 or abs(value - last_value) >= self.hysteresis:
+			return value
+		return last_value
+
+	def _should_send(self, wheels: Tuple[int, int], now: float) -> bool:
+		"""
+		Нужно ли отправлять команду WHEELS на контроллер.
+		"""
+		if self.last_sent_wheels is None:
+			return True
+		if now - self.last_send_time >= self.keepalive_interval:
+			return True
+		return wheels != self.last_sent_wheels
+
+	def get_stats(self) -> dict:
+		"""
+		:return: Количество отправленных и подавленных команд WHEELS.
+		"""
+		return {
+			'frames_sent': self.frames_sent,
+			'frames_suppressed': self.frames_suppressed,
+		}
+
 	def run(self,
 			left_throttle: float = 0,
 			right_throttle: float = 0) -> None:
-		global autobot_platform
+		autobot_platform = get_autobot_platform()
 
 		if left_throttle is None:
 			logger.warn("`left_throttle` is None")
@@ -720,11 +1610,26 @@ class AutoBot_Actuator(object):
 		left_wheel = int(self.left_throttle * 100)
 		right_wheel = int(self.right_throttle * 100)
 
+		if self.last_sent_wheels is not None:
+			left_wheel = self._quantize(left_wheel, self.last_sent_wheels[0])
+			right_wheel = self._quantize(right_wheel, self.last_sent_wheels[1])
+
+		wheels = (left_wheel, right_wheel)
+		now = time.monotonic()
+		if not self._should_send(wheels, now):
+			self.frames_suppressed += 1
+			return
+
 		autobot_platform.wheels_set(left=left_wheel, right=right_wheel)
+		self.last_sent_wheels = wheels
+		self.last_send_time = now
+		self.frames_sent += 1
 
 	def shutdown(self):
-		global autobot_platform
+		autobot_platform = get_autobot_platform()
 		autobot_platform.wheels_set(left=0, right=0)
+		autobot_platform.flush()
+		logger.info(f"[AutoBot_Actuator]: {self.get_stats()}")
 
 
 
@@ -736,7 +1641,7 @@ class AutoBot_Flashlight(object):
 	def run(self, value: int = 0) -> int or None:
 		if value is None:
 			return None
-		global autobot_platform
+		autobot_platform = get_autobot_platform()
 		autobot_platform.flashlight_set(value=value)
 		self.value = value
 
@@ -752,7 +1657,7 @@ class AutoBot_UV_Flashlight(object):
 	def run(self, value: int = 0) -> int or None:
 		if value is None:
 			return None
-		global autobot_platform
+		autobot_platform = get_autobot_platform()
 		assert 0 <= value <= 100
 		autobot_platform.uv_flashlight_set(value=value)
 		self.value = value
@@ -769,7 +1674,7 @@ class AutoBot_Camera_Servo(object):
 	def run(self, value: int) -> int or None:
 		if value is None:
 			return None
-		global autobot_platform
+		autobot_platform = get_autobot_platform()
 		autobot_platform.camera_servo_set(angle=value)
 		self.value = value
 
@@ -787,7 +1692,7 @@ class Sensor_RFID(object):
 		return self.value
 
 	def get_data_from_device(self):
-		global autobot_platform
+		autobot_platform = get_autobot_platform()
 		value = autobot_platform.rfid_get()
 		if type(value) == type(None):
 			value = ""
@@ -797,62 +1702,38 @@ class Sensor_RFID(object):
 
 
 
-class Sensor_Battery(object):
-	def __init__(self):
-		self.running = True
-		self.value = 0
-
-	def run(self) -> int:
-		self.get_data_from_device()
-		return self.value
-
-	def get_data_from_device(self):
-		global autobot_platform
-		value = autobot_platform.battery_get()
-		if type(value) == type(None):
-			value = 0
-		self.value = value
-
-
-class Sensor_US(object):
+class Sensor_Telemetry(object):
+	"""
+	Одна часть для ИК, УЗ сенсоров и аккумулятора.
+	Читает согласованный снимок телеметрии за O(1), без словарей.
+	Выходы: ir1..ir5, us1..us5, battery.
+	"""
 	def __init__(self):
 		self.running = True
-		self.value = {int(ir_sensor_idx): 255 for ir_sensor_idx in range(5)}
+		self.snapshot = np.empty(SNAPSHOT_SIZE, dtype=np.int64)
 
 	def run(self) -> List[int]:
-		self.get_data_from_device()
-		# return self.value
-		return [self.value[sensor_idx] for sensor_idx in range(5)]
+		autobot_platform = get_autobot_platform()
+		autobot_platform.telemetry_get(out=self.snapshot)
+		return self.snapshot[:TELEMETRY_VALUES_COUNT].tolist()
 
-	def get_data_from_device(self):
-		global autobot_platform
-		value = autobot_platform.us_get()
-		for _key, _item in value.items():
-			if type(_item) == type(None):
-				self.value[_key] = 255
-			else:
-				self.value[_key] = _item
+	def shutdown(self):
+		pass
 
 
-class Sensor_IR(object):
+class Sensor_Telemetry_Filtered(object):
+	"""
+	Отфильтрованные в потоке чтения serial значения ИК и УЗ сенсоров.
+	Выходы: ir_filtered (5 значений), us_filtered (5 значений).
+	"""
 	def __init__(self):
 		self.running = True
-		self.value = {int(ir_sensor_idx): 255 for ir_sensor_idx in range(5)}
-
-	def run(self) -> List[int]:
-		self.get_data_from_device()
-		# return self.value
-		return [self.value[sensor_idx] for sensor_idx in range(5)]
-
-	def get_data_from_device(self):
-		global autobot_platform
-		value = autobot_platform.ir_get()
-		for _key, _item in value.items():
-			if type(_item) == type(None):
-				self.value[_key] = 255
-			else:
-				self.value[_key] = _item
-
-
+		self.snapshot = np.empty(FILTERED_SIZE, dtype=np.float64)
 
+	def run(self) -> Tuple[List[float], List[float]]:
+		autobot_platform = get_autobot_platform()
+		autobot_platform.telemetry_filtered_get(out=self.snapshot)
+		return self.snapshot[FILTERED_IR_SLICE].tolist(), self.snapshot[FILTERED_US_SLICE].tolist()
 
+	def shutdown(self):
+		pass
@@ -12,6 +12,8 @@ import tqdm
 import time
 import threading
 
+from parts.camera_frame import Frame_View, Jpeg_Frame, color_order_of, to_pixels
+
 
 
 class ArucoSignDetector():
@@ -23,7 +25,17 @@ class ArucoSignDetector():
                  calib_data_path: str = "../camera_calibartion//calib_data/MultiMatrix.npz",
                  signs_dict: dict = {},
                  image_size: int = 224,
-                 border_size: int = 1):
+                 border_size: int = 1,
+                 detect_scale: int = 1,
+                 detect_roi: tuple = None):
+        """
+        :param detect_scale: Во сколько раз уменьшать кадр для поиска маркеров: 1, 2, 4 или 8
+                             (кадры MJPEG уменьшаются сразу при декодировании).
+        :param detect_roi:   Область поиска маркеров (x_min, y_min, x_max, y_max). None - весь кадр.
+                             Углы маркеров в обоих случаях возвращаются в координатах полного кадра.
+        """
+        self.detect_scale = detect_scale
+        self.detect_view = Frame_View(roi=detect_roi, step=detect_scale)
         self.marker_size_mm  = marker_size_mm
         self.calib_data_path = os.path.abspath(calib_data_path)
         self.calib_data		 = self.load_calib_data()
@@ -54,8 +66,11 @@ class ArucoSignDetector():
         return markerImage
 
     def detect(self, frame: np.ndarray):
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # серый кадр из родного порядка каналов кадра (раньше к RGB кадрам применялся BGR2GRAY)
+        gray_frame = self.detect_view(frame, gray=True)
         marker_corners, marker_IDs, _ = cv2.aruco.detectMarkers(gray_frame, self.dictionary, parameters=self.detector_params)
+        if (self.detect_view.step != 1 or self.detect_view.roi is not None) and marker_IDs is not None:
+            marker_corners = type(marker_corners)(self.detect_view.to_full(corners) for corners in marker_corners)
         if type(marker_IDs) == np.ndarray:
             marker_IDs = marker_IDs.flatten()
         if type(marker_corners) == np.ndarray:
@@ -85,7 +100,8 @@ class ArucoSignDetector():
              bboxes: list,
              distances: list,
              ):
-        if type(frame) == np.ndarray:
+        if isinstance(frame, np.ndarray):
+            distance_color = (0, 0, 255) if color_order_of(frame) == 'BGR' else (255, 0, 0)
             for sign_name, bbox, distance in zip(sign_names, bboxes, distances):
                 bbox = bbox.reshape(-1, 2).astype(np.int32)
 
@@ -113,7 +129,7 @@ class ArucoSignDetector():
                             (top_right[0], top_right[1] + 18),
                             cv2.FONT_HERSHEY_PLAIN,
                             1.3,
-                            (255, 0, 0),
+                            distance_color,
                             1,
                             cv2.LINE_AA)
         return frame
@@ -140,13 +156,33 @@ class ArucoSignDetector():
     #         print('!!!!!')
     #         print(type(road_frame), type(sign_frame))
 
-    def run(self, sign_frame: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
-        if type(sign_frame) == np.ndarray:
-            marker_corners, markerIds = self.detect(frame=sign_frame)
-            sign_names, bboxes, distances = self.estimate_pose(marker_corners=marker_corners, markerIds=markerIds)
+    def find_signs(self, sign_frame) -> (list, list, np.ndarray, list):
+        """
+        Поиск знаков без рисования (в том числе в процессе-обработчике, см. parts.frame_bus).
+        :return: (имена знаков, углы маркеров, id маркеров, расстояния).
+        """
+        marker_corners, markerIds = self.detect(frame=sign_frame)
+        sign_names, bboxes, distances = self.estimate_pose(marker_corners=marker_corners, markerIds=markerIds)
+        return sign_names, marker_corners, markerIds, distances
+
+    def mark(self, sign_frame, sign_names: list, marker_corners: list, distances: list):
+        """
+        :return: (кадр, кадр с нарисованными знаками).
+        """
+        # Кадр камеры переиспользуется (Triple_Frame_Buffer), поэтому рисуем только на копии
+        # и копируем только тогда, когда есть что рисовать. Кадр без знаков отдается как есть:
+        # части, которые держат кадр дольше такта (веб-контроллер), копируют его сами (web.hold_frame).
+        # .copy(), а не np.copy(): копия остается Camera_Frame с тем же порядком каналов.
+        # Кадр MJPEG декодируется только для рисования
+        marked_sign_frame = sign_frame
+        if sign_frame is not None and sign_names:
+            marked_sign_frame = self.draw(frame=to_pixels(sign_frame).copy(), sign_names=sign_names, bboxes=marker_corners, distances=distances)
+        return sign_frame, marked_sign_frame
 
-            marked_sign_frame = np.copy(sign_frame)
-            marked_sign_frame = self.draw(frame=marked_sign_frame, sign_names=sign_names, bboxes=marker_corners, distances=distances)
+    def run(self, sign_frame: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+        if isinstance(sign_frame, (np.ndarray, Jpeg_Frame)):
+            sign_names, marker_corners, markerIds, distances = self.find_signs(sign_frame)
+            sign_frame, marked_sign_frame = self.mark(sign_frame, sign_names, marker_corners, distances)
             return sign_frame, marked_sign_frame, marker_corners, markerIds, distances
 
     def shutdown(self):
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кадр камеры с объявленным порядком каналов, номером и временем захвата
+и ленивым переводом в RGB / оттенки серого. Сжатый кадр MJPEG декодируется только по запросу.
+"""
+
+import cv2
+import numpy as np
+
+
+COLOR_ORDERS = ['BGR', 'RGB']
+
+_CVT_TO_RGB = {'BGR': cv2.COLOR_BGR2RGB}
+_CVT_TO_GRAY = {'BGR': cv2.COLOR_BGR2GRAY, 'RGB': cv2.COLOR_RGB2GRAY}
+
+# Масштаб декодирования JPEG -> флаг cv2.imdecode (libjpeg уменьшает кадр при декодировании, по DCT блокам)
+JPEG_DECODE_SCALES = [1, 2, 4, 8]
+_IMDECODE_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                   4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+_IMDECODE_GRAY = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                  4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+class Camera_Frame(np.ndarray):
+    """
+    - np.ndarray кадра с атрибутом color_order ('BGR' - как отдает OpenCV, или 'RGB').
+    - Камера публикует кадр в родном порядке каналов, без cvtColor на каждый кадр.
+      В RGB или оттенки серого кадр переводят только те части, которым это нужно (to_rgb, to_gray),
+      результат запоминается в кадре и переиспользуется остальными частями того же такта.
+    - seq и capture_time_ns - номер кадра у камеры и время захвата по time.monotonic_ns()
+      (для трассировки задержек, см. parts.frame_trace).
+    - stale - камера перестала отдавать кадры, и это последний полученный кадр (см. parts.camera_health).
+    - Срезы и копии (frame.copy(), frame[y0:y1]) сохраняют color_order, seq и capture_time_ns,
+      но не результаты перевода.
+      np.copy(frame) и np.uint8(frame) возвращают обычный np.ndarray - такой кадр считается RGB.
+    """
+
+    def __new__(cls,
+                array: np.ndarray,
+                color_order: str = 'BGR',
+                seq: int = None,
+                capture_time_ns: int = None):
+        """
+        :param array:           Кадр (высота, ширина, 3). Данные не копируются.
+        :param color_order:     Порядок каналов кадра: 'BGR' или 'RGB'.
+        :param seq:             Номер кадра у камеры.
+        :param capture_time_ns: Время захвата по time.monotonic_ns().
+        """
+        assert color_order in COLOR_ORDERS, Exception(f"Bad value for argument `color_order`. "
+                                                      f"Must be one of {COLOR_ORDERS}.")
+        frame = np.asarray(array).view(cls)
+        frame.color_order = color_order
+        frame.seq = seq
+        frame.capture_time_ns = capture_time_ns
+        frame.stale = False
+        return frame
+
+    def __array_finalize__(self, obj) -> None:
+        self.color_order = getattr(obj, 'color_order', 'RGB')
+        self.seq = getattr(obj, 'seq', None)
+        self.capture_time_ns = getattr(obj, 'capture_time_ns', None)
+        self.stale = getattr(obj, 'stale', False)
+        # Переведенные кадры ('RGB', ('GRAY', scale)) относятся только к этому объекту, а не к его срезам и копиям
+        self.converted = {}
+
+
+class Jpeg_Frame(object):
+    """
+    - Сжатый кадр MJPEG камеры в том виде, в каком его отдало устройство (см. CV_USB_Camera(mjpeg=True)).
+    - Веб-контроллер отдает байты кадра в MJPEG поток как есть, без декодирования и повторного сжатия.
+    - Пиксели получают через to_rgb / to_bgr / to_gray / to_pixels: кадр декодируется при первом запросе,
+      результат запоминается и переиспользуется остальными частями того же такта.
+      to_gray(frame, scale=2..8) декодирует сразу в оттенки серого и в уменьшенном размере.
+    """
+
+    color_order = 'BGR'
+
+    def __init__(self,
+                 jpeg: np.ndarray,
+                 shape: tuple = None,
+                 seq: int = None,
+                 capture_time_ns: int = None):
+        """
+        :param jpeg:            Байты JPEG (одномерный np.ndarray uint8).
+        :param shape:           Ожидаемый размер декодированного кадра (высота, ширина, 3).
+        :param seq:             Номер кадра у камеры.
+        :param capture_time_ns: Время захвата по time.monotonic_ns().
+        """
+        self.jpeg = jpeg
+        self.shape = shape
+        self.seq = seq
+        self.capture_time_ns = capture_time_ns
+        self.stale = False
+        self.converted = {}
+
+    def tobytes(self) -> bytes:
+        return self.jpeg.tobytes()
+
+    def decode(self, scale: int = 1, gray: bool = False) -> np.ndarray:
+        """
+        Декодировать кадр. Каждый вариант декодируется один раз на кадр.
+        :param scale: Во сколько раз уменьшить кадр при декодировании: 1, 2, 4 или 8.
+        :param gray:  Декодировать сразу в оттенки серого.
+        :return:      Camera_Frame в BGR или np.ndarray (высота, ширина) для gray.
+        """
+        assert scale in JPEG_DECODE_SCALES, Exception(f"Bad value for argument `scale`. "
+                                                      f"Must be one of {JPEG_DECODE_SCALES}.")
+        key = ('GRAY' if gray else 'BGR', scale)
+        decoded = self.converted.get(key)
+        if decoded is None:
+            decoded = cv2.imdecode(self.jpeg, (_IMDECODE_GRAY if gray else _IMDECODE_COLOR)[scale])
+            assert decoded is not None, Exception(f"Failed to decode jpeg frame {self.seq} ({self.jpeg.size} bytes).")
+            if not gray:
+                decoded = Camera_Frame(decoded, color_order='BGR', seq=self.seq, capture_time_ns=self.capture_time_ns)
+            self.converted[key] = decoded
+        return decoded
+
+
+def to_pixels(frame) -> np.ndarray:
+    """
+    Кадр как массив пикселей: Jpeg_Frame декодируется (в BGR), остальные кадры возвращаются как есть.
+    """
+    if isinstance(frame, Jpeg_Frame):
+        return frame.decode()
+    return frame
+
+
+def color_order_of(frame: np.ndarray) -> str:
+    """
+    Порядок каналов кадра. Обычный np.ndarray считается RGB (так кадры отдавались раньше).
+    """
+    return getattr(frame, 'color_order', 'RGB')
+
+
+def to_rgb(frame: np.ndarray) -> np.ndarray:
+    """
+    Кадр в порядке RGB. Перевод делается один раз на кадр.
+    :param frame: Camera_Frame или np.ndarray в RGB.
+    :return:      Кадр в RGB (для RGB кадра - он сам, без копирования). None, если кадра нет.
+                  Для Camera_Frame - Camera_Frame с теми же seq и capture_time_ns.
+    """
+    if frame is None or color_order_of(frame) == 'RGB':
+        return frame
+    frame = to_pixels(frame)
+    converted = frame.converted.get('RGB')
+    if converted is None:
+        converted = Camera_Frame(cv2.cvtColor(frame, _CVT_TO_RGB[frame.color_order]), color_order='RGB',
+                                 seq=frame.seq, capture_time_ns=frame.capture_time_ns)
+        frame.converted['RGB'] = converted
+    return converted
+
+
+def to_gray(frame: np.ndarray, scale: int = 1) -> np.ndarray:
+    """
+    Кадр в оттенках серого, получаемый напрямую из родного порядка каналов (без промежуточного RGB).
+    Перевод делается один раз на кадр.
+    :param frame: Jpeg_Frame, Camera_Frame или np.ndarray в RGB. Одноканальный кадр возвращается как есть.
+    :param scale: Во сколько раз уменьшить кадр: 1, 2, 4 или 8. Jpeg_Frame уменьшается при декодировании,
+                  остальные кадры - прореживанием строк и столбцов.
+    :return:      np.ndarray (высота / scale, ширина / scale). None, если кадра нет.
+    """
+    if frame is None:
+        return frame
+    if isinstance(frame, Jpeg_Frame):
+        return frame.decode(scale=scale, gray=True)
+    if frame.ndim == 2:
+        return frame[::scale, ::scale]
+    key = ('GRAY', scale)
+    converted = getattr(frame, 'converted', {}).get(key)
+    if converted is None:
+        converted = cv2.cvtColor(frame[::scale, ::scale], _CVT_TO_GRAY[color_order_of(frame)])
+        if isinstance(frame, Camera_Frame):
+            frame.converted[key] = converted
+    return converted
+
+
+def to_bgr(frame: np.ndarray) -> np.ndarray:
+    """
+    Кадр в порядке BGR (для cv2.imencode / cv2.imshow). Для BGR кадра - он сам, без копирования.
+    """
+    if frame is None or color_order_of(frame) == 'BGR':
+        return to_pixels(frame)
+    return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+
+class Frame_View(object):
+    """
+    - Область интереса (roi) и прореживание (step) кадра: кадр -> frame[y_min:y_max:step, x_min:x_max:step].
+    - Для np.ndarray / Camera_Frame это срез без копирования (Camera_Frame сохраняет color_order, seq
+      и capture_time_ns). Jpeg_Frame декодируется сразу уменьшенным, если step - 1, 2, 4 или 8.
+    - Результат запоминается в кадре (Camera_Frame, Jpeg_Frame): части одного такта получают тот же объект.
+    - self.to_full переводит координаты точек уменьшенного кадра в координаты полного кадра.
+    """
+
+    def __init__(self, roi: tuple = None, step: int = 1):
+        """
+        :param roi:  (x_min, y_min, x_max, y_max) в координатах полного кадра. None - весь кадр.
+        :param step: Шаг прореживания строк и столбцов (1 - без прореживания).
+        """
+        assert step >= 1, Exception(f"Bad value for argument `step`. Must be >= 1.")
+        if roi is not None:
+            x_min, y_min, x_max, y_max = roi
+            assert 0 <= x_min < x_max and 0 <= y_min < y_max, Exception(f"Bad value for argument `roi`: {roi}.")
+            roi = (int(x_min), int(y_min), int(x_max), int(y_max))
+        self.roi = roi
+        self.step = int(step)
+
+    def __crop(self, pixels: np.ndarray, scale: int) -> np.ndarray:
+        """
+        :param pixels: Кадр, уже уменьшенный в scale раз.
+        :param scale:  Во сколько раз уменьшен кадр (оставшееся прореживание делается срезом).
+        """
+        step = self.step // scale
+        if self.roi is None:
+            return pixels[::step, ::step] if step > 1 else pixels
+        x_min, y_min, x_max, y_max = self.roi
+        return pixels[y_min // scale:y_max // scale:step, x_min // scale:x_max // scale:step]
+
+    def __call__(self, frame, gray: bool = False) -> np.ndarray:
+        """
+        :param frame: Jpeg_Frame, Camera_Frame или np.ndarray.
+        :param gray:  Вернуть кадр в оттенках серого (см. to_gray).
+        :return:      Уменьшенный кадр. None, если кадра нет.
+        """
+        if frame is None:
+            return None
+        key = ('VIEW', self.roi, self.step, gray)
+        converted = getattr(frame, 'converted', None)
+        if converted is not None and key in converted:
+            return converted[key]
+
+        if isinstance(frame, Jpeg_Frame):
+            scale = self.step if self.step in JPEG_DECODE_SCALES else 1
+            view = self.__crop(frame.decode(scale=scale, gray=gray), scale)
+        else:
+            view = self.__crop(frame, 1)
+            if gray:
+                view = to_gray(view)
+
+        if converted is not None:
+            converted[key] = view
+        return view
+
+    def to_full(self, points: np.ndarray) -> np.ndarray:
+        """
+        :param points: Массив точек (..., 2) - (x, y) в координатах уменьшенного кадра.
+        :return:       Точки в координатах полного кадра.
+        """
+        points = points * self.step
+        if self.roi is not None:
+            points = points + np.array(self.roi[:2], dtype=points.dtype)
+        return points
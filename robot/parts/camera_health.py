@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Контроль работы камеры: интервалы между кадрами, обнаружение остановки потока кадров,
+расписание переоткрытия устройства с увеличивающейся паузой.
+"""
+
+import time
+import threading
+
+from parts.latency import Latency_Histogram
+
+
+# Корзины времени восстановления камеры, мс
+RECOVERY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Camera_Health(object):
+    """
+    - Поток камеры сообщает о каждом кадре (self.frame_received) и о неудачном чтении (self.read_failed).
+    - Камера считается остановившейся (stalled), если нового кадра нет дольше stall_timeout
+      (по умолчанию - stall_frames интервалов ожидаемого FPS, но не меньше min_stall_timeout).
+      Пока камера остановлена, читатели получают последний кадр с флагом stale.
+    - Переоткрытие устройства: self.reopen_due() разрешает попытку не чаще, чем раз в текущую паузу;
+      пауза удваивается после каждой попытки без кадров (от backoff_min до backoff_max)
+      и сбрасывается, когда кадры пошли снова.
+    - Время восстановления - от последнего кадра до первого кадра после остановки.
+    """
+
+    def __init__(self,
+                 expected_fps: float = 20,
+                 stall_frames: float = 5,
+                 min_stall_timeout: float = 0.5,
+                 backoff_min: float = 0.5,
+                 backoff_max: float = 10.):
+        """
+        :param expected_fps:      Ожидаемая частота кадров.
+        :param stall_frames:      Сколько интервалов ожидаемого FPS без кадров считается остановкой.
+        :param min_stall_timeout: Минимальное время без кадров до остановки, с.
+        :param backoff_min:       Первая пауза между попытками переоткрыть устройство, с.
+        :param backoff_max:       Максимальная пауза между попытками, с.
+        """
+        assert expected_fps > 0, Exception(f"Bad value for argument `expected_fps`. Must be > 0.")
+        assert 0 < backoff_min <= backoff_max, Exception(f"Bad values for arguments `backoff_min`, `backoff_max`.")
+        self.stall_frames = stall_frames
+        self.min_stall_timeout = min_stall_timeout
+        self.set_expected_fps(expected_fps)
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+        self.stalled = False
+        self.frames = 0
+        self.read_failures = 0
+        self.stalls = 0
+        self.reopen_attempts = 0
+        self.reopens = 0
+        self.last_recovery_ms = None
+
+        self.interval = Latency_Histogram()
+        self.recovery = Latency_Histogram(buckets_ms=RECOVERY_BUCKETS_MS)
+
+        self.__last_frame_time = time.monotonic()
+        self.__backoff = backoff_min
+        self.__next_reopen_time = 0.
+        self.__lock = threading.Lock()
+
+    def set_expected_fps(self, expected_fps: float) -> None:
+        """
+        Изменить ожидаемую частоту кадров (камере задана другая частота, см. parts.frame_demand).
+        """
+        assert expected_fps > 0, Exception(f"Bad value for argument `expected_fps`. Must be > 0.")
+        self.expected_fps = expected_fps
+        self.stall_timeout = max(self.stall_frames / expected_fps, self.min_stall_timeout)
+
+    def frame_received(self, now: float = None) -> None:
+        """
+        Вызывается потоком камеры на каждый полученный кадр.
+        :param now: Время по time.monotonic(). None - текущее время.
+        """
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            elapsed = now - self.__last_frame_time
+            if self.frames:
+                self.interval.add(elapsed * 1000)
+            if self.stalled:
+                self.stalled = False
+                self.last_recovery_ms = elapsed * 1000
+                self.recovery.add(self.last_recovery_ms)
+                self.__backoff = self.backoff_min
+            self.frames += 1
+            self.__last_frame_time = now
+
+    def read_failed(self) -> None:
+        self.read_failures += 1
+
+    def check(self, now: float = None) -> bool:
+        """
+        Проверить, не остановился ли поток кадров.
+        :param now: Время по time.monotonic(). None - текущее время.
+        :return:    True, если камера остановлена (кадры устарели).
+        """
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            if not self.stalled and now - self.__last_frame_time > self.stall_timeout:
+                self.stalled = True
+                self.stalls += 1
+                self.__next_reopen_time = now
+            return self.stalled
+
+    def reopen_due(self, now: float = None) -> bool:
+        """
+        Пора ли сделать попытку переоткрыть устройство. Если да, попытка считается сделанной
+        и следующая разрешается после удвоенной паузы.
+        :param now: Время по time.monotonic(). None - текущее время.
+        """
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            if not self.stalled or now < self.__next_reopen_time:
+                return False
+            self.reopen_attempts += 1
+            self.__next_reopen_time = now + self.__backoff
+            self.__backoff = min(self.__backoff * 2, self.backoff_max)
+            return True
+
+    def reopened(self) -> None:
+        """
+        Устройство переоткрыто (кадров после этого может еще не быть).
+        """
+        self.reopens += 1
+
+    def get_stats(self) -> dict:
+        interval = self.interval.get_stats()
+        return {
+            'stalled': self.check(),
+            'fps': 1000 / interval['avg_ms'] if interval['avg_ms'] else None,
+            'frames': self.frames,
+            'read_failures': self.read_failures,
+            'stalls': self.stalls,
+            'reopen_attempts': self.reopen_attempts,
+            'reopens': self.reopens,
+            'last_recovery_ms': self.last_recovery_ms,
+            'recovery': self.recovery.get_stats(),
+            'interval': interval,
+        }
@@ -15,6 +15,14 @@ import random
 
 from donkeycar.parts.cv import CvCam
 
+from parts.frame_buffers import Triple_Frame_Buffer
+from parts.camera_health import Camera_Health
+from parts.frame_demand import Frame_Demand, DEMAND_MODES
+from parts.camera_frame import Camera_Frame, Jpeg_Frame, Frame_View, COLOR_ORDERS, to_bgr
+
+
+logger = logging.getLogger(__name__)
+
 
 class Jetson_CSI_Camera(object):
     def __init__(self,
@@ -24,7 +32,25 @@ class Jetson_CSI_Camera(object):
                  framerate: int = 60,
                  gstreamer_flip: int = 2,
                  image_w: int = None,
-                 image_h: int = None):
+                 image_h: int = None,
+                 color_order: str = 'BGR',
+                 roi: tuple = None,
+                 decimation: int = 1):
+        """
+        :param color_order: Порядок каналов выдаваемых кадров. 'BGR' - как отдает OpenCV, без перевода
+                            (см. parts.camera_frame), 'RGB' - переводить каждый кадр сразу при захвате.
+        :param roi:         Область интереса (x_min, y_min, x_max, y_max) уменьшенного кадра.
+        :param decimation:  Шаг прореживания уменьшенного кадра.
+                            Если задан roi или decimation > 1, часть выдает (полный кадр, уменьшенный кадр),
+                            уменьшенный кадр - срез полного без копирования (см. parts.camera_frame.Frame_View).
+        """
+        self.reduced_view = None
+        if roi is not None or decimation > 1:
+            self.reduced_view = Frame_View(roi=roi, step=decimation)
+        self.health = Camera_Health(expected_fps=framerate)
+        assert color_order in COLOR_ORDERS, Exception(f"Bad value for argument `color_order`. "
+                                                      f"Must be one of {COLOR_ORDERS}.")
+        self.color_order = color_order
         self.sensor_id = sensor_id
         self.capture_width = capture_width
         self.capture_height = capture_height
@@ -43,6 +69,7 @@ class Jetson_CSI_Camera(object):
         # The last captured image from the camera
         self.frame = None
         self.grabbed = False
+        self.frames_captured = 0
 
         self.gstreamer_pipeline = None
         self.video_capture = None
@@ -107,45 +134,432 @@ class Jetson_CSI_Camera(object):
     def shutdown(self):
         self.running = False
         time.sleep(0.2)
-        self.video_capture.release()
+        if self.video_capture is not None:
+            self.video_capture.release()
+        logger.info(f"[Jetson_CSI_Camera]: {self.sensor_id}: {self.health.get_stats()}")
 
     def run(self) -> np.ndarray:
         self.read_frame_from_device()
-        return self.frame
+        return self.run_threaded()
 
     def run_threaded(self) -> np.ndarray:
-        return self.frame
+        frame = self.frame
+        if frame is not None:
+            frame.stale = self.health.check()
+        if self.reduced_view is not None:
+            reduced = self.reduced_view(frame)
+            if reduced is not None:
+                reduced.stale = frame.stale
+            return frame, reduced
+        return frame
 
     def read_frame_from_device(self):
+        if self.video_capture is None:
+            self.health.read_failed()
+            return None
         grabbed, frame = self.video_capture.read()
         if frame is not None:
-            self.grabbed, self.frame = grabbed, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            capture_time_ns = time.monotonic_ns()
+            if self.color_order == 'RGB':
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            self.frames_captured += 1
+            self.grabbed, self.frame = grabbed, Camera_Frame(frame, color_order=self.color_order,
+                                                             seq=self.frames_captured,
+                                                             capture_time_ns=capture_time_ns)
+            self.health.frame_received()
             return self.grabbed, self.frame
+        self.health.read_failed()
+
+    def __reopen(self):
+        logger.warning(f"[Jetson_CSI_Camera]: no frames from CSI camera {self.sensor_id} "
+                       f"for {self.health.stall_timeout:.2f}s, reopening (attempt {self.health.reopen_attempts})")
+        if self.video_capture is not None:
+            self.video_capture.release()
+        try:
+            self.__create_capture_device()
+        except Exception as error:
+            logger.warning(f"[Jetson_CSI_Camera]: {error}")
+            return
+        self.health.reopened()
 
     def update(self):
         if self.video_capture is None:
             self.__create_capture_device()
 
+        # при неисправной камере read() сразу возвращает ошибку: вместо холостого цикла -
+        # пауза в один кадр и переоткрытие с увеличивающейся паузой (см. Camera_Health)
         while self.running:
-            self.read_frame_from_device()
+            if self.read_frame_from_device() is None:
+                time.sleep(1 / self.framerate)
+            if self.health.check() and self.health.reopen_due():
+                self.__reopen()
 
 
 class CV_USB_Camera(CvCam):
+    """
+    - USB камера через cv2.VideoCapture.
+    - По умолчанию (color_order='BGR') кадр читается прямо в буфер записи Triple_Frame_Buffer
+      (cap.read(image=...)) и публикуется в родном порядке каналов OpenCV, без cvtColor и без копирования.
+      Части, которым нужен RGB или оттенки серого, переводят кадр сами (parts.camera_frame.to_rgb / to_gray).
+    - color_order='RGB': кадр читается в отдельный буфер и переводится в RGB в буфер записи
+      (cv2.cvtColor(..., dst=...)), как раньше.
+    - run_threaded отдает последний готовый кадр (Camera_Frame) без копирования (см. Triple_Frame_Buffer)
+      с номером кадра (seq) и временем захвата (capture_time_ns) - временем драйвера V4L2 или временем
+      возврата cap.read().
+    - roi / decimation: дополнительный выход с уменьшенным кадром - срезом полного кадра без копирования
+      (кадр MJPEG декодируется сразу уменьшенным). Части, которым нужна только область интереса
+      (автопилот), читают его вместо полного кадра.
+    - Если кадры перестают приходить (expected_fps, см. Camera_Health), устройство переоткрывается в фоне
+      с увеличивающейся паузой, а читатели получают последний кадр с флагом stale (frame.stale).
+      Устройство закрывает только его поток-читатель, вернувшись из cap.read(); новое устройство открывается
+      после того, как старый читатель завершился (V4L2 не дает открыть занятое устройство - EBUSY).
+      Время cap.read() ограничено (CAP_PROP_READ_TIMEOUT_MSEC, если OpenCV его поддерживает),
+      поэтому зависший читатель возвращается сам.
+    - mjpeg=True: камера переключается в MJPEG (V4L2), и кадры отдаются сжатыми (Jpeg_Frame), без декодирования
+      в потоке камеры. Веб-контроллер пересылает байты как есть, декодируют только части, которым нужны пиксели.
+      Если устройство не поддерживает MJPEG или backend OpenCV все равно декодирует кадры,
+      камера остается в обычном режиме.
+    - demand: захват по потребности цикла управления (см. Frame_Demand). 'grab' - кадры, которые цикл не успеет
+      забрать, снимаются с драйвера cap.grab() без декодирования и копирования, декодируется (cap.retrieve())
+      только последний кадр перед обращением цикла. 'fps' - камере задается частота кадров под частоту цикла.
+    """
+    MJPEG_FOURCC = 'MJPG'
+
     def __init__(self,
                  camera_path:    str = '/dev/cams/usb',
                  capture_width:  int = 640,
                  capture_height: int = 480,
+                 color_order:    str = 'BGR',
+                 mjpeg:          bool = False,
+                 hardware_timestamps: bool = True,
+                 roi:            tuple = None,
+                 decimation:     int = 1,
+                 expected_fps:   float = 20,
+                 demand:         str = None,
                  ):
+        """
+        :param camera_path:    Путь к устройству камеры.
+        :param capture_width:  Ширина кадра.
+        :param capture_height: Высота кадра.
+        :param color_order:    Порядок каналов выдаваемых кадров: 'BGR' (без перевода) или 'RGB'.
+        :param mjpeg:          Получать от камеры MJPEG и отдавать кадры сжатыми (только для color_order='BGR').
+        :param hardware_timestamps: Брать время захвата кадра у драйвера V4L2, если оно доступно.
+        :param roi:            Область интереса (x_min, y_min, x_max, y_max) уменьшенного кадра.
+        :param decimation:     Шаг прореживания уменьшенного кадра.
+                               Если задан roi или decimation > 1, часть выдает (полный кадр, уменьшенный кадр).
+        :param expected_fps:   Ожидаемая частота кадров: по ней определяется остановка камеры (см. Camera_Health).
+        :param demand:         Захват по потребности цикла управления: None (каждый кадр), 'grab' или 'fps'.
+        """
+        assert color_order in COLOR_ORDERS, Exception(f"Bad value for argument `color_order`. "
+                                                      f"Must be one of {COLOR_ORDERS}.")
+        assert not mjpeg or color_order == 'BGR', Exception(f"`mjpeg` frames are decoded to BGR, "
+                                                            f"`color_order` must be 'BGR'.")
+        assert demand in DEMAND_MODES, Exception(f"Bad value for argument `demand`. Must be one of {DEMAND_MODES}.")
+        self.color_order = color_order
+        self.capture_width = capture_width
+        self.capture_height = capture_height
+        self.frames = Triple_Frame_Buffer(shape=(capture_height, capture_width, 3))
+        self.__capture_buffer = None
+        if color_order == 'RGB':
+            self.__capture_buffer = np.empty((capture_height, capture_width, 3), dtype=np.uint8)
+
+        # Выданный кадр и номер его получения: один Camera_Frame на опубликованный кадр,
+        # чтобы переведенные в RGB / серый кадры переиспользовались всеми частями
+        self.__frame = None
+        self.__frame_acquired = None
+
+        self.reduced_view = None
+        if roi is not None or decimation > 1:
+            self.reduced_view = Frame_View(roi=roi, step=decimation)
+
+        # Вызывается в потоке камеры на каждый захваченный кадр (Camera_Frame или Jpeg_Frame) до его публикации.
+        # Кадр Camera_Frame лежит в буфере камеры и действителен только во время вызова (см. parts.frame_sync).
+        self.on_frame = None
+        self.hardware_timestamps = hardware_timestamps
+        self.hardware_timestamps_used = 0
+
+        self.camera_path = camera_path
+        self.expected_fps = expected_fps
+        self.health = Camera_Health(expected_fps=expected_fps)
+        self.demand = None if demand is None else Frame_Demand(mode=demand)
+        # Поколение потока-читателя, увеличивается при каждом переоткрытии устройства
+        self.__generation = 0
+        self.__reader = None
+        # Попытки переоткрытия, отложенные из-за читателя, который еще не вернулся из cap.read()
+        self.reopens_deferred = 0
+
+        # Режим MJPEG включается после прогрева камеры в CvCam.__init__
+        self.mjpeg = False
+        self.__jpeg_frame = None
+        self.jpeg_frames_captured = 0
+
+        # CvCam.__init__ прогревает камеру через self.run(), поэтому буферы создаются до него
         super().__init__(iCam=camera_path,
                          image_w=capture_width,
                          image_h=capture_height,
                          image_d=3)
+        self.__set_read_timeout(self.cap)
+        if mjpeg:
+            self.mjpeg = self.__enable_mjpeg(self.cap)
+
+    def __read_timeout_ms(self) -> int:
+        # зависший cap.read() возвращается примерно тогда, когда сторож камеры решает переоткрыть устройство
+        return int(self.health.stall_timeout * 1000)
+
+    def __set_read_timeout(self, cap) -> None:
+        """
+        Ограничить время cap.read() уже открытого устройства (OpenCV с CAP_PROP_READ_TIMEOUT_MSEC, V4L2).
+        """
+        if hasattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC'):
+            cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, self.__read_timeout_ms())
+
+    def __open_capture(self):
+        """
+        Открыть устройство с ограниченным временем открытия и чтения, если OpenCV это поддерживает.
+        """
+        if hasattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC') and hasattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC'):
+            timeout_ms = self.__read_timeout_ms()
+            return cv2.VideoCapture(self.camera_path, cv2.CAP_ANY,
+                                    [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+                                     cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms])
+        return cv2.VideoCapture(self.camera_path)
+
+    def __enable_mjpeg(self, cap) -> bool:
+        """
+        Переключить камеру в MJPEG и отключить декодирование кадров в OpenCV.
+        :param cap: cv2.VideoCapture.
+        :return:    True, если камера отдает сжатые кадры.
+        """
+        fourcc = cv2.VideoWriter_fourcc(*self.MJPEG_FOURCC)
+        cap.set(cv2.CAP_PROP_FOURCC, fourcc)
+        # после смены формата размер кадра согласуется заново
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.capture_width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.capture_height)
+        if int(cap.get(cv2.CAP_PROP_FOURCC)) != fourcc:
+            logger.warning(f"[CV_USB_Camera]: camera does not support {self.MJPEG_FOURCC}, raw frames are used")
+            return False
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+        ret, data = cap.read()
+        if not ret or data is None or data.ndim != 2 or data.shape[0] != 1:
+            logger.warning(f"[CV_USB_Camera]: OpenCV backend does not return compressed frames, raw frames are used")
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return False
+        logger.info(f"[CV_USB_Camera]: {self.MJPEG_FOURCC} capture enabled")
+        return True
 
     def poll(self):
-        if self.cap.isOpened():
-            ret, frame = self.cap.read()
+        self.__poll(self.cap)
+
+    def __poll(self, cap, generation: int = None) -> bool:
+        """
+        Прочитать и опубликовать кадр.
+        :param cap:        cv2.VideoCapture.
+        :param generation: Поколение потока-читателя. Кадр, прочитанный устаревшим читателем
+                           (устройство уже переоткрыто), не публикуется.
+        :return:           True, если кадр получен.
+        """
+        if not cap.isOpened():
+            self.health.read_failed()
+            return False
+        read = cap.read
+        if self.demand is not None and self.demand.mode == 'grab':
+            if not cap.grab():
+                self.health.read_failed()
+                return False
+            if generation is not None and generation != self.__generation:
+                return False
+            if not self.demand.frame_due():
+                # кадр снят с драйвера без декодирования: устройство работает, но цикл его не заберет
+                self.health.frame_received()
+                return True
+            read = cap.retrieve
+        if self.mjpeg:
+            ret, data = read()
+            if generation is not None and generation != self.__generation:
+                return False
+            if ret and data is not None:
+                self.jpeg_frames_captured += 1
+                jpeg_frame = Jpeg_Frame(data.reshape(-1),
+                                        shape=(self.capture_height, self.capture_width, 3),
+                                        seq=self.jpeg_frames_captured,
+                                        capture_time_ns=self.__capture_time_ns(cap))
+                if self.on_frame is not None:
+                    self.on_frame(jpeg_frame)
+                self.__jpeg_frame = jpeg_frame
+                self.health.frame_received()
+                return True
+        elif self.color_order == 'BGR':
+            back = self.frames.back()
+            ret, frame = read(image=back)
+            if generation is not None and generation != self.__generation:
+                return False
             if frame is not None:
-                self.frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                capture_time_ns = self.__capture_time_ns(cap)
+                if frame is not back:
+                    # камера отдала кадр другого размера - буферы выделяются заново
+                    back = self.frames.back(shape=frame.shape)
+                    np.copyto(back, frame)
+                self.__publish(back, capture_time_ns)
+                return True
+        else:
+            ret, frame = read(image=self.__capture_buffer)
+            if generation is not None and generation != self.__generation:
+                return False
+            if frame is not None:
+                capture_time_ns = self.__capture_time_ns(cap)
+                # камера могла отдать кадр другого размера - тогда дальше читаем в новый буфер
+                self.__capture_buffer = frame
+                back = self.frames.back(shape=frame.shape)
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=back)
+                self.__publish(back, capture_time_ns)
+                return True
+        self.health.read_failed()
+        return False
+
+    def update(self):
+        """
+        Поток камеры. Кадры читает отдельный поток-читатель, этот поток следит за интервалами между кадрами
+        и, если кадры перестали приходить, переоткрывает устройство с увеличивающейся паузой
+        (см. Camera_Health). Читатель устаревшего устройства не публикует кадр, закрывает свое устройство
+        и завершается; новое устройство открывается только после этого.
+        """
+        self.__start_reader(self.cap)
+        while self.running:
+            time.sleep(self.health.stall_timeout / 4)
+            if self.health.check() and self.health.reopen_due():
+                self.__reopen()
+
+    def __start_reader(self, cap) -> None:
+        self.cap = cap
+        self.__reader = threading.Thread(target=self.__read_loop, args=(cap, self.__generation),
+                                         name=f'{self.__class__.__name__}_reader', daemon=True)
+        self.__reader.start()
+
+    def __read_loop(self, cap, generation: int) -> None:
+        while self.running and generation == self.__generation:
+            if not self.__poll(cap, generation):
+                # read() неисправного устройства может сразу возвращать ошибку - не крутимся вхолостую
+                time.sleep(1 / self.health.expected_fps)
+            elif self.demand is not None and self.demand.mode == 'fps':
+                self.__retune_fps(cap)
+        if generation != self.__generation:
+            # устройство переоткрывается: закрывает его только этот поток, никогда во время cap.read()
+            cap.release()
+
+    def __retune_fps(self, cap) -> None:
+        """
+        Задать камере частоту кадров под частоту потребления (режим demand='fps').
+        """
+        fps = self.demand.target_fps(self.expected_fps)
+        if fps is None:
+            return
+        cap.set(cv2.CAP_PROP_FPS, fps)
+        # драйвер выбирает ближайшую поддерживаемую частоту
+        device_fps = cap.get(cv2.CAP_PROP_FPS) or fps
+        self.demand.device_fps = device_fps
+        self.health.set_expected_fps(device_fps)
+        logger.info(f"[CV_USB_Camera]: {self.camera_path}: frame rate set to {device_fps:.1f} fps "
+                    f"(requested {fps:.1f}, loop consumes {1 / self.demand.consume_interval:.1f} fps)")
+
+    def __reopen(self) -> None:
+        logger.warning(f"[CV_USB_Camera]: no frames from {self.camera_path} for {self.health.stall_timeout:.2f}s, "
+                       f"reopening (attempt {self.health.reopen_attempts})")
+        reader = self.__reader
+        if reader is not None:
+            # Старый читатель больше не публикует кадры и, вернувшись из cap.read(), сам закрывает устройство.
+            # Закрывать VideoCapture из другого потока во время cap.read() нельзя.
+            self.__generation += 1
+            reader.join(timeout=self.health.stall_timeout)
+            if reader.is_alive():
+                self.reopens_deferred += 1
+                logger.warning(f"[CV_USB_Camera]: reader of {self.camera_path} is still blocked in read(), "
+                               f"reopen deferred")
+                return
+            self.__reader = None
+        cap = self.__open_capture()
+        if not cap.isOpened():
+            cap.release()
+            logger.warning(f"[CV_USB_Camera]: unable to open {self.camera_path}")
+            return
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.capture_width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.capture_height)
+        if self.mjpeg and not self.__enable_mjpeg(cap):
+            self.mjpeg = False
+        if self.demand is not None and self.demand.device_fps is not None:
+            cap.set(cv2.CAP_PROP_FPS, self.demand.device_fps)
+        self.health.reopened()
+        self.__start_reader(cap)
+
+    def __capture_time_ns(self, cap) -> int:
+        """
+        Время захвата кадра, только что полученного cap.read(), по time.monotonic_ns().
+        V4L2 отдает время заполнения буфера драйвером (CAP_PROP_POS_MSEC, CLOCK_MONOTONIC) - оно не зависит
+        от того, когда поток камеры дошел до кадра. Если время драйвера недоступно или в другой шкале
+        (не попадает в последнюю секунду), используется время возврата cap.read().
+        """
+        now_ns = time.monotonic_ns()
+        if self.hardware_timestamps:
+            driver_time_ns = int(cap.get(cv2.CAP_PROP_POS_MSEC) * 1e6)
+            if 0 <= now_ns - driver_time_ns < 1e9:
+                self.hardware_timestamps_used += 1
+                return driver_time_ns
+        return now_ns
+
+    def __publish(self, back: np.ndarray, capture_time_ns: int) -> None:
+        if self.on_frame is not None:
+            # номер, который получит кадр в self.frames.publish()
+            self.on_frame(Camera_Frame(back, color_order=self.color_order,
+                                       seq=self.frames.frames_published + 1,
+                                       capture_time_ns=capture_time_ns))
+        self.frames.publish(capture_time_ns=capture_time_ns)
+        self.health.frame_received()
+
+    def __acquire(self) -> Camera_Frame or Jpeg_Frame or None:
+        if self.mjpeg:
+            return self.__jpeg_frame
+        buffer = self.frames.acquire()
+        if buffer is None:
+            return None
+        if self.frames.frames_acquired != self.__frame_acquired:
+            self.__frame_acquired = self.frames.frames_acquired
+            self.__frame = Camera_Frame(buffer, color_order=self.color_order,
+                                        seq=self.frames.front_seq,
+                                        capture_time_ns=self.frames.front_capture_time_ns)
+        return self.__frame
+
+    def __outputs(self, frame):
+        if frame is not None:
+            frame.stale = self.health.check()
+        if self.reduced_view is not None:
+            reduced = self.reduced_view(frame)
+            if reduced is not None:
+                reduced.stale = frame.stale
+            return frame, reduced
+        return frame
+
+    def run(self):
+        self.poll()
+        # CvCam.__init__ ждет self.frame при прогреве
+        self.frame = self.__acquire()
+        return self.__outputs(self.frame)
+
+    def run_threaded(self):
+        if self.demand is not None:
+            self.demand.consumed()
+        return self.__outputs(self.__acquire())
+
+    def shutdown(self):
+        # устройство закрывается в CvCam.shutdown - после того, как читатель вышел из cap.read()
+        self.running = False
+        if self.__reader is not None:
+            self.__reader.join(timeout=self.__read_timeout_ms() / 1000 + 1.)
+        super().shutdown()
+        logger.info(f"[CV_USB_Camera]: {self.camera_path}: {self.health.get_stats()}")
+        if self.demand is not None:
+            logger.info(f"[CV_USB_Camera]: {self.camera_path}: {self.demand.get_stats()}")
+        if self.reopens_deferred:
+            logger.info(f"[CV_USB_Camera]: {self.camera_path}: reopens_deferred={self.reopens_deferred}")
 
 
 class CV_Image_Display(object):
@@ -158,7 +572,7 @@ class CV_Image_Display(object):
 
     def run(self, frame: np.ndarray):
         if frame is not None:
-            cv2.imshow(self.window_name, frame)
+            cv2.imshow(self.window_name, to_bgr(frame))
             cv2.waitKey(1)
 
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Переиспользуемые буферы кадров для передачи кадров из потока камеры в цикл управления без копирования.
+"""
+
+import time
+import threading
+
+import numpy as np
+
+
+class Triple_Frame_Buffer(object):
+    """
+    - Три заранее выделенных буфера кадра: запись (back), последний готовый (ready) и выданный читателю (front).
+    - Писатель (поток камеры) заполняет self.back() и публикует его self.publish() - обмен ссылок, без копирования.
+    - Читатель (цикл управления) получает последний готовый кадр self.acquire() - тоже обмен ссылок.
+    - Выданный кадр не перезаписывается, пока читатель не вызовет self.acquire() снова
+      и писатель не опубликует после этого еще один кадр. Частям, которые хранят кадр дольше
+      одного такта (или рисуют на нем), нужна своя копия.
+    - Вместе с кадром передаются его номер и время захвата: после self.acquire()
+      они лежат в self.front_seq и self.front_capture_time_ns.
+    """
+
+    def __init__(self, shape: tuple = None, dtype=np.uint8):
+        """
+        :param shape: Размер кадра (высота, ширина, каналы). None - выделить при первом кадре.
+        :param dtype: Тип элементов кадра.
+        """
+        self.dtype = dtype
+        self.shape = None
+        self.__back = self.__ready = self.__front = None
+        self.__fresh = False
+        self.__lock = threading.Lock()
+
+        # (номер кадра, время захвата по time.monotonic_ns()) опубликованного и выданного кадров
+        self.__ready_info = None
+        self.front_seq = None
+        self.front_capture_time_ns = None
+
+        self.frames_published = 0
+        self.frames_acquired = 0
+        # Кадры, замененные более новым кадром до того, как их получил читатель
+        self.frames_skipped = 0
+
+        if shape is not None:
+            self.__allocate(shape)
+
+    def __allocate(self, shape: tuple) -> None:
+        with self.__lock:
+            self.shape = tuple(shape)
+            self.__back = np.empty(self.shape, dtype=self.dtype)
+            self.__ready = np.empty(self.shape, dtype=self.dtype)
+            self.__front = None
+            self.__fresh = False
+
+    def back(self, shape: tuple = None) -> np.ndarray:
+        """
+        Буфер для записи следующего кадра. Вызывается только писателем.
+        :param shape: Ожидаемый размер кадра. Если отличается от текущего, буферы выделяются заново.
+        :return:      Буфер кадра.
+        """
+        if shape is not None and tuple(shape) != self.shape:
+            self.__allocate(shape)
+        return self.__back
+
+    def publish(self, capture_time_ns: int = None) -> None:
+        """
+        Опубликовать заполненный self.back() как последний готовый кадр.
+        :param capture_time_ns: Время захвата кадра по time.monotonic_ns(). None - текущее время.
+        """
+        if capture_time_ns is None:
+            capture_time_ns = time.monotonic_ns()
+        with self.__lock:
+            self.__back, self.__ready = self.__ready, self.__back
+            if self.__fresh:
+                self.frames_skipped += 1
+            self.__fresh = True
+            self.frames_published += 1
+            self.__ready_info = (self.frames_published, capture_time_ns)
+        # Буфер, который держит читатель, писатель не получает: он лежит в self.__front
+        if self.__back is None:
+            self.__back = np.empty(self.shape, dtype=self.dtype)
+
+    def acquire(self) -> np.ndarray or None:
+        """
+        Получить последний готовый кадр. Если нового кадра нет, возвращается тот же кадр, что и в прошлый раз.
+        :return: Кадр или None, если еще ни одного кадра не опубликовано.
+        """
+        with self.__lock:
+            if self.__fresh:
+                self.__front, self.__ready = self.__ready, self.__front
+                self.__fresh = False
+                self.frames_acquired += 1
+                self.front_seq, self.front_capture_time_ns = self.__ready_info
+            return self.__front
+
+    def get_stats(self) -> dict:
+        return {
+            'frames_published': self.frames_published,
+            'frames_acquired': self.frames_acquired,
+            'frames_skipped': self.frames_skipped,
+        }
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Шина кадров в общей памяти (multiprocessing.shared_memory): цикл управления публикует кадры камеры,
+обработчики (ArUco, автопилот, кодирование MJPEG) работают в отдельных процессах со своим GIL
+и читают кадры без копирования.
+"""
+
+import gc
+import time
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from parts.camera_frame import Camera_Frame, Jpeg_Frame, COLOR_ORDERS
+from parts.latency import Latency_Histogram
+
+
+logger = logging.getLogger(__name__)
+
+
+class Shared_Frame_Ring(object):
+    """
+    - Кольцо из `slots` слотов кадра в одном блоке общей памяти. Пишет один процесс (self.publish),
+      читают процессы, подключенные по имени блока и блокировкам слотов
+      (Shared_Frame_Ring(shape, slots, name=ring.name, locks=ring.locks), блокировки передаются при запуске процесса).
+    - Заголовок блока: количество публикаций и для каждого слота номер публикации (счетчик кольца, 0 - слот пуст),
+      номер кадра (seq), время захвата, размер JPEG (0 - в слоте пиксели) и порядок каналов.
+    - self.latest() отдает последний кадр как Camera_Frame / Jpeg_Frame поверх слота, без копирования,
+      с атрибутами ring_slot и ring_publication (слот и номер публикации кадра).
+      Слот перезаписывается через `slots` публикаций: читатель, который обрабатывает кадр дольше,
+      проверяет self.is_current(frame) после обработки и отбрасывает результат, если кадр уже перезаписан.
+      Проверяется номер публикации в слоте кадра, а не seq: seq задает камера, и он не уникален
+      (после переоткрытия камеры, при переходе с MJPEG на обычные кадры).
+    - Согласованность обеспечивают только блокировки слотов (multiprocessing.Lock, семафор с барьерами памяти):
+      писатель держит блокировку слота, пока пишет пиксели и заголовок слота, читатель берет ее, чтобы прочитать
+      заголовок слота (self.latest) и чтобы проверить номер публикации после обработки (self.is_current).
+      Обычные записи numpy в общую память сами по себе не упорядочены между процессами (ARM переставляет их),
+      поэтому порядок записи полей заголовка ничего не гарантирует. Если номер публикации слота под блокировкой
+      после обработки тот же, что и до нее, писатель не начинал перезапись слота между двумя взятиями
+      блокировки, и все прочитанные пиксели относятся к этому кадру. Счетчик публикаций - только подсказка,
+      с какого слота начинать поиск.
+    """
+
+    def __init__(self, shape: tuple, slots: int = 4, name: str = None, locks: list = None):
+        """
+        :param shape: Размер кадра (высота, ширина, каналы), uint8.
+        :param slots: Количество слотов кольца.
+        :param name:  Имя существующего блока общей памяти. None - создать новый блок (процесс-писатель).
+        :param locks: Блокировки слотов существующего кольца (ring.locks). Только вместе с name.
+        """
+        assert slots >= 2, Exception(f"Bad value for argument `slots`. Must be >= 2.")
+        assert (name is None) == (locks is None), Exception(f"Arguments `name` and `locks` are passed together.")
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = name is None
+        self.frame_nbytes = int(np.prod(self.shape))
+
+        # [публикаций] + по слоту: номер публикации, seq, время захвата, размер JPEG, порядок каналов
+        header_items = 1 + 5 * slots
+        header_nbytes = -(-header_items * 8 // 64) * 64
+        size = header_nbytes + slots * self.frame_nbytes
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.memory.name
+
+        self.__header = np.ndarray((header_items,), dtype=np.int64, buffer=self.memory.buf)
+        self.__slot_publication = self.__header[1:1 + slots]
+        self.__slot_seq = self.__header[1 + slots:1 + 2 * slots]
+        self.__slot_time = self.__header[1 + 2 * slots:1 + 3 * slots]
+        self.__slot_jpeg_nbytes = self.__header[1 + 3 * slots:1 + 4 * slots]
+        self.__slot_color_order = self.__header[1 + 4 * slots:]
+        data = np.ndarray((slots, self.frame_nbytes), dtype=np.uint8, buffer=self.memory.buf, offset=header_nbytes)
+        self.__bytes = [data[slot] for slot in range(slots)]
+        self.__frames = [data[slot].reshape(self.shape) for slot in range(slots)]
+        if self.owner:
+            self.__header[:] = 0
+            # spawn: блокировки передаются процессам-обработчикам Frame_Bus_Worker
+            context = multiprocessing.get_context('spawn')
+            locks = [context.Lock() for _ in range(slots)]
+        self.locks = locks
+
+    def publish(self, frame) -> bool:
+        """
+        Скопировать кадр в следующий слот. Вызывается только процессом-писателем.
+        :param frame: Camera_Frame / np.ndarray размера shape или Jpeg_Frame.
+        :return:      False, если кадр не подходит по размеру.
+        """
+        if isinstance(frame, Jpeg_Frame):
+            jpeg_nbytes = frame.jpeg.size
+            if jpeg_nbytes > self.frame_nbytes:
+                return False
+        elif frame.shape != self.shape:
+            return False
+
+        published = int(self.__header[0])
+        slot = published % self.slots
+        seq = getattr(frame, 'seq', None)
+        capture_time_ns = getattr(frame, 'capture_time_ns', None)
+
+        with self.locks[slot]:
+            if isinstance(frame, Jpeg_Frame):
+                self.__bytes[slot][:jpeg_nbytes] = frame.jpeg
+            else:
+                np.copyto(self.__frames[slot], frame)
+                jpeg_nbytes = 0
+            self.__slot_time[slot] = time.monotonic_ns() if capture_time_ns is None else capture_time_ns
+            self.__slot_jpeg_nbytes[slot] = jpeg_nbytes
+            self.__slot_color_order[slot] = COLOR_ORDERS.index(getattr(frame, 'color_order', 'RGB'))
+            self.__slot_seq[slot] = published + 1 if seq is None else seq
+            self.__slot_publication[slot] = published + 1
+            self.__header[0] = published + 1
+        return True
+
+    def latest(self) -> Camera_Frame or Jpeg_Frame or None:
+        """
+        :return: Последний опубликованный кадр поверх слота (без копирования) или None, если кадров нет.
+        """
+        published = int(self.__header[0])
+        # слот последнего кадра или, если он пуст, предыдущий
+        for back in range(min(published, self.slots)):
+            slot = (published - 1 - back) % self.slots
+            with self.locks[slot]:
+                publication = int(self.__slot_publication[slot])
+                seq = int(self.__slot_seq[slot])
+                capture_time_ns = int(self.__slot_time[slot])
+                jpeg_nbytes = int(self.__slot_jpeg_nbytes[slot])
+                color_order = COLOR_ORDERS[int(self.__slot_color_order[slot])]
+            if publication == 0:
+                continue
+            if jpeg_nbytes:
+                frame = Jpeg_Frame(self.__bytes[slot][:jpeg_nbytes], shape=self.shape,
+                                   seq=seq, capture_time_ns=capture_time_ns)
+            else:
+                frame = Camera_Frame(self.__frames[slot], color_order=color_order,
+                                     seq=seq, capture_time_ns=capture_time_ns)
+            frame.ring_slot = slot
+            frame.ring_publication = publication
+            return frame
+        return None
+
+    def is_current(self, frame) -> bool:
+        """
+        :param frame: Кадр, полученный self.latest().
+        :return:      True, если слот кадра еще не перезаписан (и писатель не начал его перезапись).
+        """
+        with self.locks[frame.ring_slot]:
+            return int(self.__slot_publication[frame.ring_slot]) == frame.ring_publication
+
+    def close(self) -> None:
+        # представления слотов держат буфер блока - их нужно отпустить до закрытия
+        self.__header = self.__slot_publication = self.__slot_seq = self.__slot_time = None
+        self.__slot_jpeg_nbytes = self.__slot_color_order = None
+        self.__bytes = self.__frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class Frame_Bus_Publisher(object):
+    """
+    Часть Vehicle: публикует кадр из памяти Vehicle в Shared_Frame_Ring (один раз на кадр камеры)
+    и освобождает общую память при остановке.
+    """
+
+    def __init__(self, ring: Shared_Frame_Ring):
+        self.ring = ring
+        self.frames_published = 0
+        self.frames_rejected = 0
+        self.__last_seq = None
+
+    def run(self, frame) -> None:
+        if frame is None:
+            return
+        seq = getattr(frame, 'seq', None)
+        if seq is not None and seq == self.__last_seq:
+            return
+        self.__last_seq = seq
+        if self.ring.publish(frame):
+            self.frames_published += 1
+        else:
+            self.frames_rejected += 1
+
+    def shutdown(self) -> None:
+        logger.info(f"[Frame_Bus_Publisher]: {self.ring.name}: published={self.frames_published} "
+                    f"rejected={self.frames_rejected}")
+        self.ring.close()
+
+
+def _worker_main(ring_name: str, shape: tuple, slots: int, locks: list,
+                 factory, kwargs: dict, method: str,
+                 conn, poll_interval: float) -> None:
+    """
+    Процесс-обработчик: подключается к кольцу, создает обработчик factory(**kwargs)
+    и отправляет в conn (seq, capture_time_ns, отброшено результатов, результат) на каждый новый кадр
+    (seq None - результат отброшен).
+    Сообщение None из conn останавливает процесс.
+    """
+    ring = Shared_Frame_Ring(shape, slots=slots, name=ring_name, locks=locks)
+    process = getattr(factory(**kwargs), method)
+    last_publication = None
+    discarded = 0
+    frame = result = None
+    try:
+        while not conn.poll():
+            frame = ring.latest()
+            if frame is None or frame.ring_publication == last_publication:
+                time.sleep(poll_interval)
+                continue
+            last_publication = frame.ring_publication
+            result = process(frame)
+            if not ring.is_current(frame):
+                # слот перезаписан во время обработки - результат мог быть посчитан по смеси двух кадров
+                discarded += 1
+                conn.send((None, None, discarded, None))
+                continue
+            conn.send((frame.seq, frame.capture_time_ns, discarded, result))
+    finally:
+        # кадры и их переведенные представления (frame.converted) держат буфер общей памяти
+        frame = result = None
+        gc.collect()
+        ring.close()
+
+
+class Frame_Bus_Worker(object):
+    """
+    - Часть Vehicle: обработчик кадров в отдельном процессе. Процесс (start method 'spawn' - без копии потоков
+      родителя) создает обработчик factory(**kwargs) и вызывает его метод `method` для каждого нового кадра
+      кольца. Обработчик создается в процессе, поэтому объекты OpenCV / модели не нужно передавать между процессами.
+    - self.run() не ждет процесс: возвращает последний полученный результат (default, пока результатов нет
+      или если процесс завершился). Результат относится к кадру одного из прошлых тактов.
+    - Статистика: задержка результата от захвата кадра, количество результатов и отброшенных результатов
+      (кадр перезаписан во время обработки - кольцу нужно больше слотов).
+    """
+
+    def __init__(self,
+                 ring: Shared_Frame_Ring,
+                 factory,
+                 kwargs: dict = None,
+                 method: str = 'run',
+                 default=None,
+                 poll_interval: float = 0.002):
+        """
+        :param ring:          Кольцо кадров (созданное этим процессом).
+        :param factory:       Класс или функция верхнего уровня модуля, создающая обработчик (передается по имени).
+        :param kwargs:        Аргументы factory (должны сериализоваться pickle).
+        :param method:        Метод обработчика: принимает кадр, возвращает результат (должен сериализоваться pickle).
+        :param default:       Результат до первого результата процесса.
+        :param poll_interval: Пауза процесса-обработчика, когда нового кадра нет, с.
+        """
+        self.name = f'{getattr(factory, "__name__", "worker")}.{method}'
+        self.default = default
+        self.result = default
+        self.results = 0
+        self.discarded = 0
+        self.latency = Latency_Histogram()
+
+        context = multiprocessing.get_context('spawn')
+        self.__conn, worker_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, name=f'Frame_Bus_Worker_{self.name}', daemon=True,
+                                       args=(ring.name, ring.shape, ring.slots, ring.locks,
+                                             factory, kwargs or {}, method, worker_conn, poll_interval))
+        self.process.start()
+        self.__alive = True
+
+    def run(self):
+        if not self.__alive:
+            return self.result
+        try:
+            while self.__conn.poll():
+                seq, capture_time_ns, self.discarded, result = self.__conn.recv()
+                if seq is None:
+                    continue
+                self.result = result
+                self.results += 1
+                self.latency.add((time.monotonic_ns() - capture_time_ns) / 1e6)
+        except (EOFError, OSError):
+            pass
+        if not self.process.is_alive():
+            logger.error(f"[Frame_Bus_Worker]: {self.name}: worker process exited with code {self.process.exitcode}")
+            self.__alive = False
+            self.result = self.default
+        return self.result
+
+    def get_stats(self) -> dict:
+        return dict(results=self.results, discarded=self.discarded, **self.latency.get_stats())
+
+    def shutdown(self) -> None:
+        if self.process.is_alive():
+            try:
+                self.__conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout=2.)
+            if self.process.is_alive():
+                self.process.terminate()
+        logger.info(f"[Frame_Bus_Worker]: {self.name}: {self.get_stats()}")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Захват кадров по потребности цикла управления: камера не декодирует и не копирует кадры,
+которые цикл все равно не успеет забрать.
+"""
+
+import time
+import math
+
+import numpy as np
+
+
+# Режимы захвата камеры
+DEMAND_MODES = [None, 'grab', 'fps']
+
+
+class Frame_Demand(object):
+    """
+    - Потребитель (цикл управления) отмечает каждое обращение за кадром (self.consumed),
+      по интервалам между обращениями оценивается частота потребления (скользящее среднее).
+    - Режим 'grab': поток камеры забирает каждый кадр из драйвера (cap.grab() - без декодирования и копирования,
+      очередь драйвера не копит старые кадры), а декодирует (cap.retrieve()) только кадр, нужный к следующему
+      обращению потребителя: последний кадр, который придет до него (self.frame_due).
+    - Режим 'fps': камере задается частота кадров под частоту потребления с запасом (self.target_fps).
+    - Пока частота потребления неизвестна (первые обращения), нужен каждый кадр.
+    """
+
+    def __init__(self,
+                 mode: str = 'grab',
+                 smoothing: float = 0.2,
+                 headroom: float = 1.5,
+                 min_fps: float = 5.,
+                 retune_interval: float = 2.):
+        """
+        :param mode:            'grab' - пропускать ненужные кадры без декодирования, 'fps' - снижать частоту кадров камеры.
+        :param smoothing:       Вес нового интервала в скользящем среднем (0..1].
+        :param headroom:        Во сколько раз частота кадров камеры в режиме 'fps' выше частоты потребления.
+        :param min_fps:         Минимальная частота кадров камеры в режиме 'fps'.
+        :param retune_interval: Как часто пересчитывать частоту кадров в режиме 'fps', с.
+        """
+        assert mode in DEMAND_MODES[1:], Exception(f"Bad value for argument `mode`. Must be one of {DEMAND_MODES[1:]}.")
+        assert 0 < smoothing <= 1, Exception(f"Bad value for argument `smoothing`. Must be in (0, 1].")
+        assert headroom >= 1, Exception(f"Bad value for argument `headroom`. Must be >= 1.")
+        self.mode = mode
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.min_fps = min_fps
+        self.retune_interval = retune_interval
+
+        # Средние интервалы между обращениями потребителя и между кадрами камеры, с
+        self.consume_interval = None
+        self.frame_interval = None
+
+        self.frames_retrieved = 0
+        self.frames_skipped = 0
+        self.device_fps = None
+
+        self.__last_consume_time = None
+        self.__last_frame_time = None
+        self.__last_retrieve_time = None
+        self.__retrieved_since_consume = False
+        self.__last_retune_time = time.monotonic()
+
+    def __average(self, average: float or None, value: float) -> float:
+        return value if average is None else average + self.smoothing * (value - average)
+
+    def consumed(self, now: float = None) -> None:
+        """
+        Потребитель обратился за кадром. Вызывается из цикла управления (run / run_threaded камеры).
+        :param now: Время по time.monotonic(). None - текущее время.
+        """
+        now = time.monotonic() if now is None else now
+        if self.__last_consume_time is not None:
+            self.consume_interval = self.__average(self.consume_interval, now - self.__last_consume_time)
+        self.__last_consume_time = now
+        self.__retrieved_since_consume = False
+
+    def frame_due(self, now: float = None) -> bool:
+        """
+        Вызывается потоком камеры после cap.grab() на каждый кадр.
+        :param now: Время по time.monotonic(). None - текущее время.
+        :return:    True - кадр нужно декодировать и опубликовать, False - пропустить.
+        """
+        now = time.monotonic() if now is None else now
+        if self.__last_frame_time is not None:
+            self.frame_interval = self.__average(self.frame_interval, now - self.__last_frame_time)
+        self.__last_frame_time = now
+
+        due = self.__frame_due(now)
+        if due:
+            self.frames_retrieved += 1
+            self.__last_retrieve_time = now
+            self.__retrieved_since_consume = True
+        else:
+            self.frames_skipped += 1
+        return due
+
+    def __frame_due(self, now: float) -> bool:
+        if self.consume_interval is None or self.frame_interval is None:
+            return True
+        # потребитель не обращался дольше своего интервала (остановлен или не успевает) -
+        # кадры обновляются не реже, чем раз в этот интервал
+        if now - self.__last_retrieve_time >= self.consume_interval:
+            return True
+        if self.__retrieved_since_consume:
+            return False
+        # следующий кадр придет уже после обращения потребителя - нужен этот
+        next_consume_time = self.__last_consume_time + self.consume_interval
+        return now + self.frame_interval >= next_consume_time
+
+    def target_fps(self, max_fps: float, now: float = None) -> float or None:
+        """
+        Частота кадров камеры под частоту потребления (режим 'fps'). Пересчитывается не чаще retune_interval.
+        :param max_fps: Частота кадров камеры без ограничения.
+        :param now:     Время по time.monotonic(). None - текущее время.
+        :return:        Новая частота кадров или None, если менять ее не нужно
+                        (смена частоты перезапускает поток V4L2, поэтому мелкие изменения пропускаются).
+        """
+        now = time.monotonic() if now is None else now
+        if self.consume_interval is None or now - self.__last_retune_time < self.retune_interval:
+            return None
+        self.__last_retune_time = now
+        fps = float(np.clip(math.ceil(self.headroom / self.consume_interval), self.min_fps, max_fps))
+        current = max_fps if self.device_fps is None else self.device_fps
+        if abs(fps - current) < 0.25 * current:
+            return None
+        return fps
+
+    def get_stats(self) -> dict:
+        return {
+            'mode': self.mode,
+            'consume_fps': 1 / self.consume_interval if self.consume_interval else None,
+            'frame_fps': 1 / self.frame_interval if self.frame_interval else None,
+            'device_fps': self.device_fps,
+            'frames_retrieved': self.frames_retrieved,
+            'frames_skipped': self.frames_skipped,
+        }
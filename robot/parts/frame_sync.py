@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Синхронизация кадров двух камер: пары кадров подбираются по времени захвата, а не по тому,
+что каждая камера успела сохранить к такту цикла управления.
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+from parts.camera_frame import Camera_Frame, Jpeg_Frame
+from parts.latency import Latency_Histogram
+
+
+logger = logging.getLogger(__name__)
+
+
+class Frame_History(object):
+    """
+    - Последние `capacity` кадров одной камеры со временем захвата. Пополняется из потока камеры
+      (CV_USB_Camera.on_frame) на каждый захваченный кадр, а не раз за такт.
+    - Буфер камеры переиспользуется, поэтому пиксели копируются в свои заранее выделенные слоты
+      (Jpeg_Frame не изменяется и хранится как есть).
+    - Слоты кадров, выданных читателю (self.pin), не перезаписываются, пока читатель не выберет другие.
+    """
+
+    def __init__(self, capacity: int = 4):
+        """
+        :param capacity: Количество хранимых кадров (кроме выданных читателю).
+        """
+        assert capacity > 0, Exception(f"Bad value for argument `capacity`. Must be > 0.")
+        # +2 слота: выданный читателю кадр и кадр, который пишется сейчас
+        self.size = capacity + 2
+        self.__buffers = [None] * self.size
+        self.__frames = [None] * self.size
+        self.__pinned = None
+        self.__lock = threading.Lock()
+
+    def put(self, frame) -> None:
+        """
+        Сохранить кадр. Вызывается из потока камеры.
+        :param frame: Camera_Frame (с seq и capture_time_ns) или Jpeg_Frame.
+        """
+        with self.__lock:
+            # самый старый слот, кроме выданного читателю
+            free = [idx for idx in range(self.size) if idx != self.__pinned]
+            slot = min(free, key=lambda idx: -1 if self.__frames[idx] is None else self.__frames[idx].capture_time_ns)
+            # слот не участвует в выборе пары, пока в него пишется кадр
+            self.__frames[slot] = None
+
+        if isinstance(frame, Jpeg_Frame):
+            stored = frame
+        else:
+            buffer = self.__buffers[slot]
+            if buffer is None or buffer.shape != frame.shape:
+                buffer = self.__buffers[slot] = np.empty(frame.shape, dtype=frame.dtype)
+            np.copyto(buffer, frame)
+            stored = Camera_Frame(buffer, color_order=frame.color_order,
+                                  seq=frame.seq, capture_time_ns=frame.capture_time_ns)
+
+        with self.__lock:
+            self.__frames[slot] = stored
+
+    def snapshot(self) -> list:
+        """
+        :return: Сохраненные кадры от новых к старым.
+        """
+        with self.__lock:
+            frames = [frame for frame in self.__frames if frame is not None]
+        return sorted(frames, key=lambda frame: frame.capture_time_ns, reverse=True)
+
+    def pin(self, frame) -> bool:
+        """
+        Запретить перезапись слота кадра, выданного читателю (снимает запрет с предыдущего).
+        :return: False, если слот кадра уже перезаписан и кадр нужно выбрать заново.
+        """
+        with self.__lock:
+            for idx, stored in enumerate(self.__frames):
+                if stored is frame:
+                    self.__pinned = idx
+                    return True
+            return False
+
+
+class Dual_Camera_Synchronizer(object):
+    """
+    - Часть Vehicle: выдает пару кадров двух камер, снятых с разницей не больше tolerance_ms.
+      Из истории кадров обеих камер выбирается самая свежая такая пара.
+    - Если подходящей пары нет, выдается самая свежая пара (последние кадры обеих камер) с matched=False.
+    - Камеры подключаются через CV_USB_Camera.on_frame (см. self.attach), поэтому в паре может оказаться
+      кадр, который цикл управления иначе пропустил бы.
+    - Статистика: разница времени захвата в парах (skew), количество подобранных и неподобранных пар,
+      повторно выданных пар.
+    """
+
+    def __init__(self, tolerance_ms: float = 15., history_size: int = 4):
+        """
+        :param tolerance_ms: Максимальная разница времени захвата кадров пары в миллисекундах.
+        :param history_size: Количество хранимых кадров каждой камеры.
+        """
+        self.tolerance_ns = int(tolerance_ms * 1e6)
+        self.first = Frame_History(capacity=history_size)
+        self.second = Frame_History(capacity=history_size)
+
+        self.skew = Latency_Histogram()
+        self.pairs_matched = 0
+        self.pairs_unmatched = 0
+        self.pairs_repeated = 0
+        self.__last_pair = None
+
+    def attach(self, first_camera, second_camera) -> None:
+        """
+        Подключить камеры: каждый захваченный кадр попадает в историю кадров синхронизатора.
+        :param first_camera:  Камера с атрибутом on_frame (CV_USB_Camera).
+        :param second_camera: Камера с атрибутом on_frame (CV_USB_Camera).
+        """
+        first_camera.on_frame = self.first.put
+        second_camera.on_frame = self.second.put
+
+    def __select_pair(self, first_frames: list, second_frames: list) -> (object, object, bool):
+        best_pair, best_time = None, None
+        for first_frame in first_frames:
+            for second_frame in second_frames:
+                if abs(first_frame.capture_time_ns - second_frame.capture_time_ns) > self.tolerance_ns:
+                    continue
+                # свежесть пары - время захвата ее более старого кадра
+                pair_time = min(first_frame.capture_time_ns, second_frame.capture_time_ns)
+                if best_time is None or pair_time > best_time:
+                    best_pair, best_time = (first_frame, second_frame), pair_time
+        if best_pair is None:
+            return first_frames[0], second_frames[0], False
+        return best_pair[0], best_pair[1], True
+
+    def run(self) -> (object, object, bool, float):
+        """
+        :return: (кадр первой камеры, кадр второй камеры, пара подобрана, разница времени захвата в мс).
+                 Пока у одной из камер нет кадров - (None, None, False, None).
+        """
+        while True:
+            first_frames = self.first.snapshot()
+            second_frames = self.second.snapshot()
+            if not first_frames or not second_frames:
+                return None, None, False, None
+
+            first_frame, second_frame, matched = self.__select_pair(first_frames, second_frames)
+            # поток камеры мог перезаписать слот между snapshot() и pin() - тогда пара выбирается заново
+            if self.first.pin(first_frame) and self.second.pin(second_frame):
+                break
+
+        skew_ms = (first_frame.capture_time_ns - second_frame.capture_time_ns) / 1e6
+        pair = (first_frame.seq, second_frame.seq)
+        if pair == self.__last_pair:
+            self.pairs_repeated += 1
+        else:
+            self.__last_pair = pair
+            self.skew.add(abs(skew_ms))
+            if matched:
+                self.pairs_matched += 1
+            else:
+                self.pairs_unmatched += 1
+        return first_frame, second_frame, matched, skew_ms
+
+    def get_stats(self) -> dict:
+        return {
+            'pairs_matched': self.pairs_matched,
+            'pairs_unmatched': self.pairs_unmatched,
+            'pairs_repeated': self.pairs_repeated,
+            'skew': self.skew.get_stats(),
+        }
+
+    def shutdown(self) -> None:
+        logger.info(f"[Dual_Camera_Synchronizer]: {self.get_stats()}")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Трассировка задержек кадров через цикл управления: от захвата кадра камерой до каждой стадии
+(детектор ArUco, автопилот, DriveMode, отправка команды колес).
+"""
+
+import time
+import logging
+import threading
+
+from parts.latency import Latency_Histogram
+
+
+logger = logging.getLogger(__name__)
+
+
+class Frame_Latency_Tracer(object):
+    """
+    - Стадия отмечает кадр (Camera_Frame с seq и capture_time_ns), который через нее прошел:
+      задержка от захвата до отметки добавляется в гистограмму стадии.
+    - По номерам кадров стадия считает пропущенные кадры (номер вырос больше чем на 1)
+      и повторы (тот же кадр еще раз - цикл управления быстрее камеры).
+    - Отчет (p50 / p99 по стадиям) пишется в лог раз в log_interval секунд и по self.log_stats().
+    """
+
+    def __init__(self, stages: list = None, log_interval: float = 10.):
+        """
+        :param stages:       Порядок стадий в отчете. Стадии не из списка добавляются в конец.
+        :param log_interval: Интервал записи отчета в лог в секундах. None - только по self.log_stats().
+        """
+        self.log_interval = log_interval
+        self.__stages = {}
+        self.__lock = threading.Lock()
+        self.__last_log_time = time.monotonic()
+        for stage in ([] if stages is None else stages):
+            self.__get_stage(stage)
+
+    def __get_stage(self, stage: str) -> dict:
+        stats = self.__stages.get(stage)
+        if stats is None:
+            with self.__lock:
+                stats = self.__stages.setdefault(stage, {
+                    'latency': Latency_Histogram(),
+                    'frames': 0,
+                    'dropped': 0,
+                    'duplicates': 0,
+                    'last_seq': None,
+                })
+        return stats
+
+    def stamp(self, stage: str, frame, now_ns: int = None) -> None:
+        """
+        Отметить прохождение кадра через стадию.
+        :param stage:  Имя стадии.
+        :param frame:  Camera_Frame. Кадры без seq / capture_time_ns и None не учитываются.
+        :param now_ns: Время отметки по time.monotonic_ns(). None - текущее время.
+        """
+        seq = getattr(frame, 'seq', None)
+        capture_time_ns = getattr(frame, 'capture_time_ns', None)
+        if seq is None or capture_time_ns is None:
+            return
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+
+        stats = self.__get_stage(stage)
+        last_seq = stats['last_seq']
+        if last_seq is not None:
+            if seq == last_seq:
+                stats['duplicates'] += 1
+                return
+            if seq > last_seq + 1:
+                stats['dropped'] += seq - last_seq - 1
+        stats['last_seq'] = seq
+        stats['frames'] += 1
+        stats['latency'].add((now_ns - capture_time_ns) / 1e6)
+
+    def get_stats(self) -> dict:
+        """
+        :return: Стадия -> {'frames', 'dropped', 'duplicates', 'count', 'avg_ms', 'p50_ms', 'p99_ms', 'max_ms'}.
+        """
+        return {stage: dict(frames=stats['frames'],
+                            dropped=stats['dropped'],
+                            duplicates=stats['duplicates'],
+                            **stats['latency'].get_stats())
+                for stage, stats in list(self.__stages.items())}
+
+    def log_stats(self) -> None:
+        self.__last_log_time = time.monotonic()
+        for stage, stats in self.get_stats().items():
+            if not stats['count']:
+                continue
+            logger.info(f"[Frame_Latency_Tracer]: {stage:<10} frames={stats['frames']} "
+                        f"dropped={stats['dropped']} duplicates={stats['duplicates']} "
+                        f"p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms max={stats['max_ms']:.1f}ms")
+
+    def maybe_log_stats(self) -> None:
+        if self.log_interval is not None and time.monotonic() - self.__last_log_time >= self.log_interval:
+            self.log_stats()
+
+
+class Frame_Trace_Stamp(object):
+    """
+    Часть Vehicle: отмечает кадр из памяти Vehicle в Frame_Latency_Tracer.
+    Добавляется сразу после части стадии (с тем же run_condition), поэтому время отметки -
+    время окончания стадии на этом такте.
+    Кадр берется из памяти Vehicle: если стадия добавлена раньше камеры (AutoBot_Actuator),
+    в памяти лежит кадр прошлого такта - тот, по которому посчитана отправляемая команда.
+    """
+
+    def __init__(self, tracer: Frame_Latency_Tracer, stage: str, report: bool = False):
+        """
+        :param tracer: Общий Frame_Latency_Tracer.
+        :param stage:  Имя стадии.
+        :param report: Эта часть пишет отчет в лог (одна на Vehicle, обычно последняя стадия).
+        """
+        self.tracer = tracer
+        self.stage = stage
+        self.report = report
+
+    def run(self, frame) -> None:
+        self.tracer.stamp(self.stage, frame)
+        if self.report:
+            self.tracer.maybe_log_stats()
+
+    def shutdown(self) -> None:
+        if self.report:
+            self.tracer.log_stats()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Гистограммы задержек с фиксированными корзинами для статистики p50 / p99 без хранения всех значений.
+"""
+
+import bisect
+import threading
+
+
+# Верхние границы корзин в миллисекундах. Последняя корзина - все, что больше.
+DEFAULT_BUCKETS_MS = (0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+class Latency_Histogram(object):
+    """
+    - Гистограмма задержек в миллисекундах.
+    - Добавление значения - O(log корзин), память не растет.
+    - Перцентили считаются по верхней границе корзины.
+    """
+
+    def __init__(self, buckets_ms: tuple = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.
+        self.max_ms = 0.
+        self.__lock = threading.Lock()
+
+    def add(self, latency_ms: float) -> None:
+        with self.__lock:
+            self.counts[bisect.bisect_left(self.buckets_ms, latency_ms)] += 1
+            self.count += 1
+            self.total_ms += latency_ms
+            if latency_ms > self.max_ms:
+                self.max_ms = latency_ms
+
+    def percentile(self, q: float) -> float or None:
+        """
+        :param q: Перцентиль от 0 до 100.
+        :return:  Верхняя граница корзины, в которую попадает перцентиль (для последней корзины - максимум).
+        """
+        with self.__lock:
+            if not self.count:
+                return None
+            threshold = q / 100 * self.count
+            accumulated = 0
+            for bucket_idx, bucket_count in enumerate(self.counts):
+                accumulated += bucket_count
+                if accumulated >= threshold and bucket_count:
+                    if bucket_idx < len(self.buckets_ms):
+                        return min(self.buckets_ms[bucket_idx], self.max_ms)
+                    return self.max_ms
+            return self.max_ms
+
+    def get_stats(self) -> dict:
+        return {
+            'count': self.count,
+            'avg_ms': self.total_ms / self.count if self.count else None,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max_ms if self.count else None,
+        }
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Управление несколькими контроллерами MegaBot из одного процесса.
+"""
+
+import os
+import time
+import logging
+import selectors
+import threading
+from typing import Dict
+
+import numpy as np
+
+from parts.actuators import Robot, RobotHardware
+
+
+logger = logging.getLogger(__name__)
+
+
+class RobotHub(threading.Thread):
+    """
+    - Владеет несколькими RobotHardware и обслуживает их в одном потоке ввода-вывода на selectors (epoll).
+    - Потоки чтения и записи RobotHardware не запускаются: чтение идет по готовности fd порта
+      (RobotHardware.process_available), запись - из очередей Serial_Writer с тем же интервалом
+      между командами (Serial_Writer.write_pending). Количество потоков не растет с количеством роботов.
+    - Роботы доступны по имени как обычные Robot: hub.robots['bench1'].wheels_set(...).
+    - Порт должен иметь fileno() (serial.Serial, pty); Simulated_Serial не поддерживается.
+    """
+
+    def __init__(self,
+                 devices: Dict[str, str] = None,
+                 daemon: bool = True,
+                 **hardware_kwargs):
+        """
+        :param devices:         Имя робота -> путь к serial устройству контроллера.
+        :param daemon:          Запустить поток как daemon.
+        :param hardware_kwargs: Общие аргументы RobotHardware для всех роботов (baudrate, write_interval, ...).
+        """
+        threading.Thread.__init__(self, daemon=daemon)
+        self.hardware_kwargs = hardware_kwargs
+
+        self.robots = {}
+        self.errors = {}
+        self.__selector = selectors.DefaultSelector()
+        self.__lock = threading.Lock()
+
+        # Пара pipe, чтобы разбудить select() при новой команде или изменении списка роботов
+        self.__wakeup_read_fd, self.__wakeup_write_fd = os.pipe()
+        os.set_blocking(self.__wakeup_read_fd, False)
+        os.set_blocking(self.__wakeup_write_fd, False)
+        self.__selector.register(self.__wakeup_read_fd, selectors.EVENT_READ, data=None)
+        self.__wakeup_pending = False
+
+        self.is_active = True
+
+        for name, device in ({} if devices is None else devices).items():
+            self.add_robot(name=name, device=device)
+
+    def __wakeup(self) -> None:
+        if self.__wakeup_pending:
+            return
+        self.__wakeup_pending = True
+        try:
+            os.write(self.__wakeup_write_fd, b'\0')
+        except BlockingIOError:
+            pass
+
+    def add_robot(self, name: str, device: str = None, serial_port=None, **kwargs) -> Robot:
+        """
+        Подключить контроллер. Можно вызывать, когда поток уже запущен.
+        :param name:        Имя робота.
+        :param device:      Путь к serial устройству контроллера.
+        :param serial_port: Уже открытый порт с интерфейсом serial.Serial и fileno().
+        :param kwargs:      Аргументы RobotHardware для этого робота (дополняют общие).
+        :return:            Robot.
+        """
+        assert name not in self.robots, Exception(f"Robot `{name}` already exists.")
+        hardware_kwargs = dict(self.hardware_kwargs, **kwargs)
+        hardware = RobotHardware(device=device, serial_port=serial_port, autostart=False, **hardware_kwargs)
+        hardware.writer.on_put = self.__wakeup
+        robot = Robot(hardware=hardware)
+
+        with self.__lock:
+            self.robots[name] = robot
+            self.__selector.register(hardware.fileno(), selectors.EVENT_READ, data=name)
+        self.__wakeup()
+        return robot
+
+    def remove_robot(self, name: str) -> None:
+        """
+        Отключить контроллер и закрыть его порт.
+        :param name: Имя робота.
+        :return:     None.
+        """
+        with self.__lock:
+            robot = self.robots.pop(name, None)
+            if robot is None:
+                return
+            self.__selector.unregister(robot.hardware.fileno())
+        robot.hardware.writer.on_put = None
+        robot.hardware.stop()
+        robot.hardware.serial.close()
+        self.__wakeup()
+
+    def get_telemetry(self) -> Dict[str, np.ndarray]:
+        """
+        Получить снимки телеметрии всех роботов.
+        :return: Имя робота -> [ir1..ir5, us1..us5, battery, time_ns].
+        """
+        return {name: robot.telemetry_get() for name, robot in list(self.robots.items())}
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        Получить статистику чтения и записи всех роботов.
+        :return: Имя робота -> {'read': ..., 'writer': ..., 'error': ...}.
+        """
+        return {name: {'read': robot.hardware.get_read_stats(),
+                       'writer': robot.hardware.get_writer_stats(),
+                       'error': self.errors.get(name)}
+                for name, robot in list(self.robots.items())}
+
+    def __disconnect(self, name: str, error: Exception) -> None:
+        logger.error(f"[RobotHub]: robot `{name}` disconnected: {error}")
+        self.errors[name] = repr(error)
+        with self.__lock:
+            robot = self.robots.pop(name, None)
+            if robot is not None:
+                self.__selector.unregister(robot.hardware.fileno())
+
+    def stop(self) -> None:
+        self.is_active = False
+        self.__wakeup()
+
+    def close(self) -> None:
+        """
+        Остановить поток и закрыть порты всех роботов.
+        """
+        self.stop()
+        if self.is_alive():
+            self.join(timeout=1.)
+        for name in list(self.robots.keys()):
+            self.remove_robot(name)
+        self.__selector.close()
+        os.close(self.__wakeup_read_fd)
+        os.close(self.__wakeup_write_fd)
+
+    def run(self) -> None:
+        """
+        Один цикл для всех роботов: ждет готовности портов или времени следующей команды,
+        читает и разбирает входящие сообщения, пишет команды из очередей.
+        """
+        timeout = None
+        while self.is_active:
+            events = self.__selector.select(timeout)
+
+            for key, _ in events:
+                name = key.data
+                if name is None:
+                    try:
+                        os.read(self.__wakeup_read_fd, 4096)
+                    except BlockingIOError:
+                        pass
+                    self.__wakeup_pending = False
+                    continue
+                robot = self.robots.get(name)
+                if robot is None:
+                    continue
+                try:
+                    robot.hardware.process_available()
+                except OSError as error:
+                    self.__disconnect(name, error)
+
+            timeout = None
+            for name, robot in list(self.robots.items()):
+                try:
+                    delay = robot.hardware.writer.write_pending()
+                except OSError as error:
+                    self.__disconnect(name, error)
+                    continue
+                if delay is not None and (timeout is None or delay < timeout):
+                    timeout = delay
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Аварийная остановка перед препятствием по ИК и УЗ сенсорам прямо в потоке чтения serial,
+без ожидания цикла управления.
+"""
+
+from typing import Dict
+
+from parts.latency import Latency_Histogram
+
+
+class Obstacle_Stop_Interlock(object):
+    """
+    - Проверяет каждое сообщение SU / SI: если расстояние хотя бы на одном из каналов меньше порога,
+      блокировка срабатывает и RobotHardware сразу отправляет команду остановки колес.
+    - Пока блокировка активна, команды колес с движением вперед заменяются остановкой
+      (назад ехать можно, если allow_reverse).
+    - Блокировка снимается, когда все каналы сенсора дальше порога на release_margin.
+    - Значения меньше min_valid_value считаются ошибкой сенсора и не учитываются.
+    - Задержки: decision - от приема сообщения до постановки команды остановки в очередь,
+      stop_write - от приема сообщения до записи команды остановки в порт.
+    """
+
+    SENSOR_NAMES = ('US', 'IR')
+
+    def __init__(self,
+                 us_stop_distance: int = None,
+                 ir_stop_distance: int = None,
+                 release_margin: int = 5,
+                 us_channels: tuple = None,
+                 ir_channels: tuple = None,
+                 min_valid_value: int = 1,
+                 allow_reverse: bool = True):
+        """
+        :param us_stop_distance: Порог УЗ сенсоров. None - не проверять УЗ сенсоры.
+        :param ir_stop_distance: Порог ИК сенсоров. None - не проверять ИК сенсоры.
+        :param release_margin:   На сколько дальше порога должны быть все каналы, чтобы снять блокировку.
+        :param us_channels:      Номера проверяемых каналов УЗ сенсоров (0..4). None - все.
+        :param ir_channels:      Номера проверяемых каналов ИК сенсоров (0..4). None - все.
+        :param min_valid_value:  Значения меньше этого не учитываются.
+        :param allow_reverse:    Разрешать движение назад (обе мощности <= 0), пока блокировка активна.
+        """
+        assert us_stop_distance is not None or ir_stop_distance is not None, \
+            Exception(f"At least one of `us_stop_distance`, `ir_stop_distance` must be set.")
+        assert release_margin >= 0, Exception(f"Bad value for argument `release_margin`. Must be >= 0.")
+        self.stop_distances = {'US': us_stop_distance, 'IR': ir_stop_distance}
+        self.channels = {'US': tuple(range(5)) if us_channels is None else tuple(us_channels),
+                         'IR': tuple(range(5)) if ir_channels is None else tuple(ir_channels)}
+        self.release_margin = release_margin
+        self.min_valid_value = min_valid_value
+        self.allow_reverse = allow_reverse
+
+        self.__blocked = {'US': False, 'IR': False}
+        self.tripped = False
+
+        self.trips = 0
+        self.blocked_commands = 0
+        self.last_trip = None
+        self.decision_latency = Latency_Histogram()
+        self.stop_write_latency = Latency_Histogram()
+
+    def check(self, sensor_name: str, values) -> bool:
+        """
+        Проверить значения сенсора. Вызывается из потока чтения serial на каждое сообщение SU / SI.
+        :param sensor_name: 'US' или 'IR'.
+        :param values:      5 значений каналов сенсора.
+        :return:            True, если блокировка сработала на этом сообщении (нужно остановить колеса).
+        """
+        stop_distance = self.stop_distances[sensor_name]
+        if stop_distance is None:
+            return False
+
+        nearest = None
+        for channel in self.channels[sensor_name]:
+            value = values[channel]
+            if value >= self.min_valid_value and (nearest is None or value < nearest):
+                nearest = value
+        if nearest is None:
+            return False
+
+        was_tripped = self.tripped
+        if nearest < stop_distance:
+            self.__blocked[sensor_name] = True
+        elif nearest >= stop_distance + self.release_margin:
+            self.__blocked[sensor_name] = False
+        self.tripped = self.__blocked['US'] or self.__blocked['IR']
+
+        if self.tripped and not was_tripped:
+            self.trips += 1
+            self.last_trip = {'sensor': sensor_name, 'distance': nearest}
+            return True
+        return False
+
+    def allows(self, wheels: Dict[str, int]) -> bool:
+        """
+        Можно ли отправить команду колес при текущем состоянии блокировки.
+        :param wheels: {'left': int, 'right': int}.
+        :return:       True, если команду можно отправить без изменений.
+        """
+        if not self.tripped:
+            return True
+        if wheels['left'] == 0 and wheels['right'] == 0:
+            return True
+        return self.allow_reverse and wheels['left'] <= 0 and wheels['right'] <= 0
+
+    def get_stats(self) -> dict:
+        return {
+            'tripped': self.tripped,
+            'trips': self.trips,
+            'blocked_commands': self.blocked_commands,
+            'last_trip': self.last_trip,
+            'decision_latency': self.decision_latency.get_stats(),
+            'stop_write_latency': self.stop_write_latency.get_stats(),
+        }
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+История значений ИК и УЗ сенсоров в кольцевых буферах numpy и фильтрация значений
+(медиана, отбрасывание выбросов, экспоненциальное сглаживание) по мере поступления сообщений.
+"""
+
+import numpy as np
+
+
+class Sensor_History(object):
+    """
+    - Кольцевой буфер последних `capacity` значений всех каналов сенсора и времени их приема.
+    - Фильтры считаются при добавлении каждого значения за O(1) (окно медианы фиксированного размера),
+      сразу для всех каналов:
+        1. медиана последних `median_window` значений;
+        2. значение, отличающееся от медианы предыдущего окна больше чем на `outlier_threshold`,
+           считается выбросом и заменяется этой медианой;
+        3. экспоненциальное сглаживание (EMA) значений без выбросов с коэффициентом `ema_alpha`.
+    - Пишет только поток чтения serial. Читатели получают отфильтрованные значения
+      через parts.telemetry.Seqlock_Array (см. RobotHardware.parse_message).
+    """
+
+    def __init__(self,
+                 channels: int = 5,
+                 capacity: int = 256,
+                 median_window: int = 5,
+                 outlier_threshold: float = 50,
+                 ema_alpha: float = 0.3):
+        """
+        :param channels:          Количество каналов сенсора.
+        :param capacity:          Количество хранимых значений каждого канала.
+        :param median_window:     Размер окна медианы.
+        :param outlier_threshold: Порог отклонения от медианы, выше которого значение считается выбросом.
+                                  None - не отбрасывать выбросы.
+        :param ema_alpha:         Коэффициент экспоненциального сглаживания от 0 до 1 (1 - без сглаживания).
+        """
+        assert capacity > 0, Exception(f"Bad value for argument `capacity`. Must be > 0.")
+        assert 0 < median_window <= capacity, Exception(f"Bad value for argument `median_window`. "
+                                                        f"Must be from 1 to `capacity`.")
+        assert 0 < ema_alpha <= 1, Exception(f"Bad value for argument `ema_alpha`. Must be in (0, 1].")
+        self.channels = channels
+        self.capacity = capacity
+        self.median_window = median_window
+        self.outlier_threshold = outlier_threshold
+        self.ema_alpha = ema_alpha
+
+        self.values = np.zeros((capacity, channels), dtype=np.int16)
+        self.times_ns = np.zeros(capacity, dtype=np.int64)
+        # Количество добавленных значений за все время. Последнее значение лежит в строке (count - 1) % capacity.
+        self.count = 0
+
+        self.median = np.zeros(channels, dtype=np.float64)
+        self.filtered = np.zeros(channels, dtype=np.float64)
+        self.outliers = 0
+
+        # Смещения строк окна медианы относительно последнего значения
+        self.__window_offsets = np.arange(median_window)
+
+    def push(self, values, time_ns: int) -> np.ndarray:
+        """
+        Добавить значения всех каналов и обновить фильтры.
+        :param values:  Значения каналов (array, list или np.ndarray).
+        :param time_ns: Время приема по time.monotonic_ns().
+        :return:        Отфильтрованные значения (self.filtered).
+        """
+        row = self.count % self.capacity
+        self.values[row] = values
+        self.times_ns[row] = time_ns
+        self.count += 1
+        sample = self.values[row]
+
+        if self.count == 1:
+            self.median[:] = sample
+            self.filtered[:] = sample
+            return self.filtered
+
+        if self.outlier_threshold is not None:
+            is_outlier = np.abs(sample - self.median) > self.outlier_threshold
+            clean_sample = np.where(is_outlier, self.median, sample)
+            self.outliers += int(np.count_nonzero(is_outlier))
+        else:
+            clean_sample = sample
+
+        window_size = min(self.count, self.median_window)
+        window_rows = (row - self.__window_offsets[:window_size]) % self.capacity
+        # np.sort по маленькому окну в несколько раз быстрее np.median
+        window = np.sort(self.values[window_rows], axis=0)
+        middle = window_size // 2
+        if window_size % 2:
+            self.median[:] = window[middle]
+        else:
+            self.median[:] = (window[middle - 1] + window[middle].astype(np.float64)) / 2
+
+        self.filtered += self.ema_alpha * (clean_sample - self.filtered)
+        return self.filtered
+
+    def get_window(self, size: int = None) -> (np.ndarray, np.ndarray):
+        """
+        Получить копию последних значений в хронологическом порядке.
+        Вызывается из потока-писателя или при остановленном потоке чтения.
+        :param size: Количество значений (не больше capacity). None - все хранимые.
+        :return:     (значения формы (size, channels), время приема формы (size,)).
+        """
+        stored = min(self.count, self.capacity)
+        size = stored if size is None else min(size, stored)
+        rows = (self.count - size + np.arange(size)) % self.capacity
+        return self.values[rows], self.times_ns[rows]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сопоставление отправленных на контроллер команд с ответами (эхо или подтверждение)
+и учет задержки подтверждения по типам устройств.
+"""
+
+import threading
+import collections
+from concurrent.futures import Future, InvalidStateError
+
+from parts.latency import Latency_Histogram
+
+
+COMMAND_PREFIX_SIZE = 3
+
+
+class _Pending_Command(object):
+    __slots__ = ('device_name', 'frame', 'future', 'write_time_ns')
+
+    def __init__(self, device_name: str, frame: bytes, future: Future or None, write_time_ns: int = None):
+        self.device_name = device_name
+        self.frame = frame
+        self.future = future
+        self.write_time_ns = write_time_ns
+
+
+class Command_Ack_Tracker(object):
+    """
+    - Учитывается каждая записанная в порт команда, в том числе синхронная (без future):
+      иначе эхо синхронной команды подтвердило бы более позднюю асинхронную команду.
+    - Ответ контроллера сопоставляется с самой старой записанной командой с теми же байтами (эхо),
+      а если такой нет - с самой старой записанной командой с тем же префиксом (ZST, ZSU, ZSS).
+      Более старые команды с тем же префиксом считаются оставшимися без ответа (контроллер отвечает по порядку).
+    - Future команды получает задержку от записи в порт до ответа в миллисекундах.
+    - Команда, замененная в очереди записи до записи в порт (более новой командой того же устройства,
+      аварийной остановкой или вытеснением из очереди, см. self.discard), отменяется (future.cancel()).
+    """
+
+    def __init__(self, max_in_flight: int = 256):
+        """
+        :param max_in_flight: Сколько записанных команд без ответа хранить (более старые считаются без ответа).
+        """
+        self.__lock = threading.Lock()
+        # зарегистрированные команды, еще не записанные в порт
+        self.__unwritten = collections.deque()
+        # записанные команды без ответа, от старых к новым
+        self.__in_flight = collections.deque()
+        self.max_in_flight = max_in_flight
+        self.histograms = {}
+
+        self.acknowledged = 0
+        self.timeouts = 0
+        self.superseded = 0
+        self.unexpected_acks = 0
+        self.unanswered = 0
+
+    def register(self, device_name: str, frame: bytes, future: Future) -> None:
+        """
+        Зарегистрировать команду, для которой ждем подтверждения. Вызывается до постановки команды в очередь записи.
+        :param device_name: Имя устройства.
+        :param frame:       Команда в байтах.
+        :param future:      concurrent.futures.Future, который получит задержку подтверждения в мс.
+        :return:            None.
+        """
+        with self.__lock:
+            for pending in [p for p in self.__unwritten if p.device_name == device_name]:
+                self.__unwritten.remove(pending)
+                pending.future.cancel()
+                self.superseded += 1
+            self.__unwritten.append(_Pending_Command(device_name=device_name, frame=frame, future=future))
+
+    def discard(self, device_name: str, frame: bytes) -> None:
+        """
+        Команда не будет записана в порт (заменена в очереди записи). Передается в Serial_Writer как on_discard.
+        """
+        with self.__lock:
+            for pending in self.__unwritten:
+                if pending.device_name == device_name and pending.frame == frame:
+                    self.__unwritten.remove(pending)
+                    pending.future.cancel()
+                    self.superseded += 1
+                    return
+
+    def on_written(self, device_name: str, frame: bytes, write_time_ns: int) -> None:
+        """
+        Отметить запись команды в порт. Передается в Serial_Writer как on_write.
+        """
+        with self.__lock:
+            written = None
+            for pending in self.__unwritten:
+                if pending.device_name == device_name and pending.frame == frame:
+                    written = pending
+                    self.__unwritten.remove(pending)
+                    break
+            if written is None:
+                written = _Pending_Command(device_name=device_name, frame=frame, future=None)
+            written.write_time_ns = write_time_ns
+            self.__in_flight.append(written)
+            if len(self.__in_flight) > self.max_in_flight:
+                self.__in_flight.popleft()
+                self.unanswered += 1
+
+    def on_ack(self, frame: bytes or memoryview, receive_time_ns: int) -> bool:
+        """
+        Обработать ответ контроллера на команду.
+        :param frame:           Принятое сообщение.
+        :param receive_time_ns: Время приема по time.monotonic_ns().
+        :return:                True, если ответ сопоставлен с командой.
+        """
+        frame = bytes(frame)
+        prefix = frame[:COMMAND_PREFIX_SIZE]
+        with self.__lock:
+            matched = next((p for p in self.__in_flight if p.frame == frame), None)
+            if matched is None:
+                matched = next((p for p in self.__in_flight if p.frame[:COMMAND_PREFIX_SIZE] == prefix), None)
+            if matched is None:
+                self.unexpected_acks += 1
+                return False
+
+            # команды того же типа, записанные раньше, остались без ответа
+            for pending in list(self.__in_flight):
+                if pending is matched:
+                    break
+                if pending.frame[:COMMAND_PREFIX_SIZE] == prefix:
+                    self.__in_flight.remove(pending)
+                    self.unanswered += 1
+            self.__in_flight.remove(matched)
+
+            latency_ms = (receive_time_ns - matched.write_time_ns) / 1e6
+            histogram = self.histograms.get(matched.device_name)
+            if histogram is None:
+                histogram = self.histograms[matched.device_name] = Latency_Histogram()
+            self.acknowledged += 1
+
+        histogram.add(latency_ms)
+        if matched.future is not None and not matched.future.done():
+            try:
+                matched.future.set_result(latency_ms)
+            except InvalidStateError:
+                # future отменили из другого потока (таймаут ожидания, отмена в asyncio) после проверки done()
+                pass
+        return True
+
+    def expire(self, future: Future) -> None:
+        """
+        Снять команду с ожидания по истечении времени ожидания.
+        """
+        with self.__lock:
+            self.timeouts += 1
+            for queue in (self.__unwritten, self.__in_flight):
+                for pending in queue:
+                    if pending.future is future:
+                        queue.remove(pending)
+                        return
+
+    def get_stats(self) -> dict:
+        """
+        :return: Счетчики и статистика задержек подтверждения по устройствам.
+        """
+        with self.__lock:
+            stats = {
+                'acknowledged': self.acknowledged,
+                'timeouts': self.timeouts,
+                'superseded': self.superseded,
+                'unexpected_acks': self.unexpected_acks,
+                'unanswered': self.unanswered,
+                'pending': len(self.__unwritten) + sum(1 for p in self.__in_flight if p.future is not None),
+                'in_flight': len(self.__in_flight),
+            }
+            histograms = dict(self.histograms)
+        stats['latency'] = {device_name: histogram.get_stats() for device_name, histogram in histograms.items()}
+        return stats
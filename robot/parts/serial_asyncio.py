@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Обслуживание RobotHardware в цикле событий asyncio вместо потоков чтения и записи.
+"""
+
+import asyncio
+import logging
+
+from parts.actuators import RobotHardware
+
+
+logger = logging.getLogger(__name__)
+
+
+class Asyncio_Serial_Transport(object):
+    """
+    - Чтение порта по готовности fd (loop.add_reader -> RobotHardware.process_available),
+      запись команд из очереди Serial_Writer таймерами цикла (loop.call_later -> Serial_Writer.write_pending)
+      с тем же интервалом между командами.
+    - RobotHardware создается с autostart=False: его потоки чтения и записи не запускаются.
+    - Команды можно ставить из любого потока: Serial_Writer.on_put будит цикл через call_soon_threadsafe.
+    - Порт должен иметь fileno() (serial.Serial, pty).
+    """
+
+    def __init__(self, hardware: RobotHardware):
+        """
+        :param hardware: RobotHardware, созданный с autostart=False.
+        """
+        self.hardware = hardware
+        self.loop = None
+        self.error = None
+        self.__write_handle = None
+        self.__write_scheduled = False
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        """
+        Начать обслуживание порта в цикле событий.
+        :param loop: Цикл событий. None - текущий цикл потока.
+        :return:     None.
+        """
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.loop.add_reader(self.hardware.fileno(), self.__on_readable)
+        self.hardware.writer.on_put = self.__on_put
+        self.__on_put()
+
+    def stop(self) -> None:
+        """
+        Прекратить обслуживание порта. Вызывается из потока цикла событий.
+        """
+        if self.loop is None:
+            return
+        self.hardware.writer.on_put = None
+        self.loop.remove_reader(self.hardware.fileno())
+        if self.__write_handle is not None:
+            self.__write_handle.cancel()
+            self.__write_handle = None
+        self.loop = None
+
+    def __on_readable(self) -> None:
+        try:
+            self.hardware.process_available()
+        except OSError as error:
+            logger.error(f"[Asyncio_Serial_Transport]: read failed, transport stopped: {error}")
+            self.error = repr(error)
+            self.stop()
+
+    def __on_put(self) -> None:
+        """
+        Вызывается Serial_Writer после постановки команды в очередь (из любого потока).
+        """
+        loop = self.loop
+        if loop is None or self.__write_scheduled:
+            return
+        self.__write_scheduled = True
+        loop.call_soon_threadsafe(self.__write_pending)
+
+    def __write_pending(self) -> None:
+        self.__write_scheduled = False
+        if self.__write_handle is not None:
+            self.__write_handle.cancel()
+            self.__write_handle = None
+        try:
+            delay = self.hardware.writer.write_pending()
+        except OSError as error:
+            logger.error(f"[Asyncio_Serial_Transport]: write failed, transport stopped: {error}")
+            self.error = repr(error)
+            self.stop()
+            return
+        if delay is not None and self.loop is not None:
+            self.__write_handle = self.loop.call_later(delay, self.__write_pending)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Запись трафика serial в компактный бинарный журнал с метками времени.
+
+Журнал - это набор файлов фиксированного размера `serial_<номер>.bin` в одной папке.
+Файл отображается в память (mmap) и заполняется записями только на добавление:
+
+    заголовок файла (32 байта):  magic b'ABSL', версия u16, резерв u16, время первой записи i64,
+                                 номер запуска i64, time.time_ns() - time.monotonic_ns() при открытии журнала i64
+    заголовок записи (12 байт):  время time.monotonic_ns() i64, направление u8, резерв u8, длина u16
+    данные записи:               `длина` байт сообщения
+
+Запись с нулевым временем означает конец данных в файле. Когда место в файле заканчивается,
+открывается следующий файл, самые старые файлы сверх max_files удаляются.
+
+Время записи берется под блокировкой журнала в момент добавления, поэтому внутри файла и внутри запуска
+записи упорядочены по времени. time.monotonic_ns() сбрасывается при перезагрузке, поэтому каждый
+Serial_Traffic_Log начинает новый файл со своим номером запуска: время сравнимо только внутри запуска.
+"""
+
+import os
+import re
+import mmap
+import glob
+import time
+import bisect
+import struct
+import threading
+
+
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+
+FILE_MAGIC = b'ABSL'
+FILE_VERSION = 2
+FILE_HEADER = struct.Struct('<4sHHqqq')
+RECORD_HEADER = struct.Struct('<qBxH')
+MAX_RECORD_SIZE = 0xFFFF
+
+_LOG_FILE_NAME = re.compile(r'serial_(\d+)\.bin')
+
+
+def _log_file_path(log_dir: str, file_idx: int) -> str:
+    return os.path.join(log_dir, f'serial_{file_idx:06d}.bin')
+
+
+def _log_file_index(path: str) -> int or None:
+    match = _LOG_FILE_NAME.fullmatch(os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+
+def _list_log_files(log_dir: str) -> list:
+    """
+    :return: Файлы журнала по возрастанию номера (номер может быть длиннее 6 цифр).
+    """
+    paths = [path for path in glob.glob(os.path.join(log_dir, 'serial_*.bin')) if _log_file_index(path) is not None]
+    return sorted(paths, key=_log_file_index)
+
+
+class Serial_Traffic_Log(object):
+    """
+    - Запись входящих и исходящих сообщений serial в ротируемый бинарный журнал.
+    - Запись - это копирование заголовка и данных в отображенный в память файл,
+      без системных вызовов и без форматирования строк.
+    - Время записи - время добавления (time.monotonic_ns() под блокировкой журнала), а не время события:
+      записи из потоков чтения и записи serial не перемешиваются по времени.
+    """
+
+    def __init__(self,
+                 log_dir: str,
+                 file_size: int = 4 * 1024 * 1024,
+                 max_files: int = 8):
+        """
+        :param log_dir:   Папка журнала.
+        :param file_size: Размер одного файла журнала в байтах.
+        :param max_files: Максимальное количество файлов журнала.
+        """
+        assert file_size > FILE_HEADER.size + RECORD_HEADER.size, Exception(f"Bad value for argument `file_size`.")
+        assert max_files > 0, Exception(f"Bad value for argument `max_files`. Must be > 0.")
+        self.log_dir = log_dir
+        self.file_size = file_size
+        self.max_files = max_files
+
+        self.records = 0
+        self.dropped_records = 0
+
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__mmap = None
+        self.__offset = 0
+        self.__has_records = False
+
+        # Номер запуска и привязка time.monotonic_ns() к часам: время записей разных запусков не сравнимо
+        self.run_id = int.from_bytes(os.urandom(8), 'little') >> 1
+        self.wall_clock_offset_ns = time.time_ns() - time.monotonic_ns()
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        existing_files = _list_log_files(self.log_dir)
+        self.__file_idx = _log_file_index(existing_files[-1]) + 1 if len(existing_files) else 0
+        self.__open_next_file()
+
+    def __open_next_file(self) -> None:
+        self.__close_file()
+
+        path = _log_file_path(self.log_dir, self.__file_idx)
+        self.__file_idx += 1
+        self.__file = open(path, 'w+b')
+        self.__file.truncate(self.file_size)
+        self.__mmap = mmap.mmap(self.__file.fileno(), self.file_size)
+        FILE_HEADER.pack_into(self.__mmap, 0, FILE_MAGIC, FILE_VERSION, 0, 0, self.run_id, self.wall_clock_offset_ns)
+        self.__offset = FILE_HEADER.size
+        self.__has_records = False
+
+        log_files = _list_log_files(self.log_dir)
+        for old_path in log_files[:max(0, len(log_files) - self.max_files)]:
+            os.remove(old_path)
+
+    def __close_file(self) -> None:
+        if self.__mmap is not None:
+            self.__mmap.flush()
+            self.__mmap.close()
+            self.__mmap = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def record(self, direction: int, data: bytes or memoryview) -> None:
+        """
+        Добавить сообщение в журнал. Время записи - текущее time.monotonic_ns().
+        :param direction: DIRECTION_IN или DIRECTION_OUT.
+        :param data:      Сообщение.
+        :return:          None.
+        """
+        length = len(data)
+        record_size = RECORD_HEADER.size + length
+        if length > MAX_RECORD_SIZE or FILE_HEADER.size + record_size > self.file_size:
+            self.dropped_records += 1
+            return
+
+        with self.__lock:
+            if self.__mmap is None:
+                self.dropped_records += 1
+                return
+            # оставляем место под нулевой заголовок - признак конца данных
+            if self.__offset + record_size + RECORD_HEADER.size > self.file_size:
+                self.__open_next_file()
+            timestamp_ns = time.monotonic_ns()
+            if not self.__has_records:
+                FILE_HEADER.pack_into(self.__mmap, 0, FILE_MAGIC, FILE_VERSION, 0, timestamp_ns,
+                                      self.run_id, self.wall_clock_offset_ns)
+                self.__has_records = True
+
+            offset = self.__offset
+            RECORD_HEADER.pack_into(self.__mmap, offset, timestamp_ns, direction, length)
+            offset += RECORD_HEADER.size
+            self.__mmap[offset:offset + length] = data
+            self.__offset = offset + length
+            self.records += 1
+
+    def flush(self) -> None:
+        with self.__lock:
+            if self.__mmap is not None:
+                self.__mmap.flush()
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__close_file()
+
+
+class _Log_Run(object):
+    __slots__ = ('run_id', 'wall_clock_offset_ns', 'files', 'files_start_ns')
+
+    def __init__(self, run_id: int, wall_clock_offset_ns: int):
+        self.run_id = run_id
+        self.wall_clock_offset_ns = wall_clock_offset_ns
+        self.files = []
+        self.files_start_ns = []
+
+
+class Serial_Traffic_Log_Reader(object):
+    """
+    - Чтение журнала Serial_Traffic_Log с поиском по времени.
+    - Файлы группируются по запускам (self.runs, в порядке номеров файлов). Время time.monotonic_ns()
+      сравнимо только внутри запуска: внутри запуска файл выбирается по времени первой записи из заголовка файла,
+      внутри файла поиск идет по индексу (время, смещение) записей.
+    - Если записи файла все же не упорядочены по времени, файл просматривается целиком.
+    - В памяти держится только текущий читаемый файл и его индекс.
+    """
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        self.runs = []
+        for path in _list_log_files(log_dir):
+            with open(path, 'rb') as log_file:
+                header = log_file.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                continue
+            magic, version, _, start_ns, run_id, wall_clock_offset_ns = FILE_HEADER.unpack(header)
+            if magic != FILE_MAGIC or version != FILE_VERSION or start_ns == 0:
+                continue
+            run = self.runs[-1] if len(self.runs) else None
+            # новый запуск или время пошло назад - файлы не сравниваются по времени с предыдущими
+            if run is None or run.run_id != run_id or start_ns < run.files_start_ns[-1]:
+                run = _Log_Run(run_id=run_id, wall_clock_offset_ns=wall_clock_offset_ns)
+                self.runs.append(run)
+            run.files.append(path)
+            run.files_start_ns.append(start_ns)
+        self.__indexes = {}
+
+    def __load_index(self, path: str) -> (bytes, list, list, bool):
+        if path not in self.__indexes:
+            with open(path, 'rb') as log_file:
+                data = log_file.read()
+            timestamps, offsets = [], []
+            offset = FILE_HEADER.size
+            while offset + RECORD_HEADER.size <= len(data):
+                timestamp_ns, _, length = RECORD_HEADER.unpack_from(data, offset)
+                if timestamp_ns == 0:
+                    break
+                timestamps.append(timestamp_ns)
+                offsets.append(offset)
+                offset += RECORD_HEADER.size + length
+            is_sorted = all(timestamps[idx] <= timestamps[idx + 1] for idx in range(len(timestamps) - 1))
+            self.__indexes = {path: (data, timestamps, offsets, is_sorted)}
+        return self.__indexes[path]
+
+    def iter_records(self,
+                     start_ns: int = None,
+                     end_ns: int = None,
+                     direction: int = None,
+                     run: int = None):
+        """
+        Прочитать записи журнала по порядку.
+        :param start_ns:  Начать с первой записи не раньше этого времени (time.monotonic_ns() запуска).
+        :param end_ns:    Закончить на последней записи раньше этого времени.
+        :param direction: Только записи с этим направлением (DIRECTION_IN или DIRECTION_OUT).
+        :param run:       Индекс запуска в self.runs (-1 - последний). None - все запуски по порядку,
+                          start_ns / end_ns тогда применяются к каждому запуску.
+        :return:          Генератор (время в нс, направление, сообщение в байтах).
+        """
+        runs = self.runs if run is None else [self.runs[run]]
+        for log_run in runs:
+            yield from self.__iter_run_records(log_run, start_ns=start_ns, end_ns=end_ns, direction=direction)
+
+    def __iter_run_records(self, log_run: _Log_Run, start_ns: int, end_ns: int, direction: int):
+        file_idx = 0
+        if start_ns is not None:
+            file_idx = max(0, bisect.bisect_right(log_run.files_start_ns, start_ns) - 1)
+
+        for path in log_run.files[file_idx:]:
+            data, timestamps, offsets, is_sorted = self.__load_index(path)
+            record_idx = 0 if start_ns is None or not is_sorted else bisect.bisect_left(timestamps, start_ns)
+            for timestamp_ns, offset in zip(timestamps[record_idx:], offsets[record_idx:]):
+                if start_ns is not None and timestamp_ns < start_ns:
+                    continue
+                if end_ns is not None and timestamp_ns >= end_ns:
+                    if is_sorted:
+                        return
+                    continue
+                _, record_direction, length = RECORD_HEADER.unpack_from(data, offset)
+                if direction is None or direction == record_direction:
+                    payload_offset = offset + RECORD_HEADER.size
+                    yield timestamp_ns, record_direction, data[payload_offset:payload_offset + length]
+
+    def replay_records(self, start_ns: int = None, end_ns: int = None, run: int = None):
+        """
+        Входящие сообщения в формате MegaBot_Pty_Simulator.replay.
+        :return: Генератор (время в секундах, сообщение с '\\r\\n').
+        """
+        for timestamp_ns, _, payload in self.iter_records(start_ns=start_ns, end_ns=end_ns,
+                                                          direction=DIRECTION_IN, run=run):
+            yield timestamp_ns / 1e9, payload + b'\r\n'
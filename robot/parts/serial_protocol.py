@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Протокол обмена сообщениями с контроллером MegaBot по serial.
+
+Сообщения сенсоров:
+    SI 014 012 012 013 013 E    - ИК сенсоры (5 полей по 3 цифры)
+    SU 175 065 023 048 047 E    - УЗ сенсоры (5 полей по 3 цифры)
+    SA 087 E                    - аккумулятор
+    SF <tag> E                  - RFID
+
+Команды устройств:
+    ZSU ++ <uv> <fl> 00000 E               - УФ фонарик и фонарик (0..100), одна команда на оба канала
+    ZSS <angle> 0000000000 E               - сервопривод камеры
+    ZST 0 <l_dir> 00 <l_val> <r_dir> 00 <r_val> E  - колеса (направление '+'/'-', мощность 0..100)
+"""
+
+from array import array
+from typing import Dict
+
+
+SENSORS_COUNT = 5
+FIELD_WIDTH = 3
+
+SENSOR_PREFIXES = {
+    'IR': b'SI',
+    'US': b'SU',
+    'BATTERY': b'SA',
+    'RFID': b'SF',
+}
+
+# Таблица байт -> цифра. Для всех байт, кроме '0'..'9', значение отрицательное.
+_DIGITS = [-1000] * 256
+for _digit in range(10):
+    _DIGITS[ord('0') + _digit] = _digit
+
+
+def _prefix_key(prefix: bytes) -> int:
+    return prefix[0] << 8 | prefix[1]
+
+
+class Sensor_Frame_Parser(object):
+    """
+    - Табличный разборщик сообщений сенсоров.
+    - Обработчик сообщения выбирается по двухбайтовому префиксу.
+    - Значения декодируются напрямую из принятых байт в заранее выделенные буферы,
+      без промежуточных строк и словарей.
+    """
+
+    def __init__(self, default_value: int = 0):
+        """
+        :param default_value: Значение ИК и УЗ сенсоров в буферах, пока сообщения от них не приняты.
+        """
+        self.ir = array('h', [default_value] * SENSORS_COUNT)
+        self.us = array('h', [default_value] * SENSORS_COUNT)
+        self.battery = None
+        self.rfid = None
+
+        # Количество принятых сообщений по каждому сенсору
+        self.frames = {sensor_name: 0 for sensor_name in SENSOR_PREFIXES.keys()}
+        self.malformed_frames = 0
+        self.unknown_frames = 0
+
+        # Изменилось ли значение сенсора после последнего успешного разбора
+        self.changed = False
+
+        self.__fields_buffer = array('h', [0] * SENSORS_COUNT)
+        self.__handlers = {
+            _prefix_key(SENSOR_PREFIXES['IR']): ('IR', self.__parse_ir),
+            _prefix_key(SENSOR_PREFIXES['US']): ('US', self.__parse_us),
+            _prefix_key(SENSOR_PREFIXES['BATTERY']): ('BATTERY', self.__parse_battery),
+            _prefix_key(SENSOR_PREFIXES['RFID']): ('RFID', self.__parse_rfid),
+        }
+
+    def parse(self, line: bytes) -> str or None:
+        """
+        Разобрать сообщение с serial и обновить буфер соответствующего сенсора.
+        :param line: Сообщение в байтах (bytes или memoryview).
+        :return:     Имя обновленного сенсора или None, если сообщение не распознано.
+        """
+        if len(line) < 2:
+            return None
+        handler = self.__handlers.get(line[0] << 8 | line[1])
+        if handler is None:
+            self.unknown_frames += 1
+            return None
+
+        sensor_name, parse_function = handler
+        changed = parse_function(line)
+        if changed is None:
+            self.malformed_frames += 1
+            return None
+
+        # первое принятое значение всегда считается изменением
+        self.changed = changed or not self.frames[sensor_name]
+        self.frames[sensor_name] += 1
+        return sensor_name
+
+    def get_value(self, sensor_name: str) -> None or str or int or Dict[int, None or int]:
+        """
+        Получить значение сенсора в формате RobotHardware.get_sensor_value.
+        :param sensor_name: Имя сенсора из SENSOR_PREFIXES.
+        :return:            Значение сенсора.
+        """
+        if sensor_name == 'IR':
+            return self.__fields_to_dict(self.ir, received=self.frames['IR'] > 0)
+        if sensor_name == 'US':
+            return self.__fields_to_dict(self.us, received=self.frames['US'] > 0)
+        if sensor_name == 'BATTERY':
+            return self.battery
+        return self.rfid
+
+    @staticmethod
+    def __fields_to_dict(buffer: array, received: bool) -> Dict[int, None or int]:
+        if not received:
+            return {sensor_idx: None for sensor_idx in range(SENSORS_COUNT)}
+        return {sensor_idx: buffer[sensor_idx] for sensor_idx in range(SENSORS_COUNT)}
+
+    def __decode_fields(self, line: bytes, buffer: array) -> bool or None:
+        """
+        Декодировать 5 полей по 3 цифры, начиная со второго байта, в buffer.
+        :return: Изменилось ли значение, или None, если сообщение повреждено.
+        """
+        if len(line) < 2 + SENSORS_COUNT * FIELD_WIDTH:
+            return None
+        fields = self.__fields_buffer
+        digits = _DIGITS
+        position = 2
+        for sensor_idx in range(SENSORS_COUNT):
+            value = digits[line[position]] * 100 + digits[line[position + 1]] * 10 + digits[line[position + 2]]
+            if value < 0:
+                return None
+            fields[sensor_idx] = value
+            position += FIELD_WIDTH
+
+        if fields == buffer:
+            return False
+        buffer[:] = fields
+        return True
+
+    def __parse_ir(self, line: bytes) -> bool or None:
+        return self.__decode_fields(line, self.ir)
+
+    def __parse_us(self, line: bytes) -> bool or None:
+        return self.__decode_fields(line, self.us)
+
+    def __parse_battery(self, line: bytes) -> bool or None:
+        digits = _DIGITS
+        value = 0
+        position = 2
+        line_length = len(line)
+        while position < line_length:
+            digit = digits[line[position]]
+            if digit < 0:
+                break
+            value = value * 10 + digit
+            position += 1
+        if position == 2:
+            return None
+
+        changed = value != self.battery
+        self.battery = value
+        return changed
+
+    def __parse_rfid(self, line: bytes) -> bool or None:
+        payload = bytes(line[2:]).rstrip(b'\r\n')
+        if payload.endswith(b'E'):
+            payload = payload[:-1]
+        value = payload.decode(encoding='utf-8', errors='ignore')
+
+        changed = value != self.rfid
+        self.rfid = value
+        return changed
+
+
+class Serial_Frame_Splitter(object):
+    """
+    - Инкрементальное разбиение потока байт с serial на сообщения.
+    - Принимает данные любыми порциями (например, все, что накопилось в порту за один вызов read),
+      и передает готовые сообщения в обработчик без копирования (memoryview на внутренний буфер).
+    - Сообщение заканчивается переводом строки, перед которым должен стоять терминатор 'E'.
+    """
+
+    def __init__(self, max_frame_size: int = 64):
+        """
+        :param max_frame_size: Максимальная длина сообщения. Более длинные данные без перевода строки отбрасываются.
+        """
+        self.max_frame_size = max_frame_size
+        self.__buffer = bytearray()
+        # Позиция, с которой продолжать поиск перевода строки
+        self.__scan_position = 0
+
+        self.frames = 0
+        self.malformed_frames = 0
+        self.dropped_frames = 0
+
+    def feed(self, data: bytes, on_frame) -> int:
+        """
+        Добавить принятые данные и передать все готовые сообщения в on_frame.
+        :param data:     Принятые с serial байты.
+        :param on_frame: Обработчик сообщения. Принимает memoryview сообщения без '\\r\\n',
+                         которым можно пользоваться только до возврата из обработчика.
+        :return:         Количество переданных в обработчик сообщений.
+        """
+        buffer = self.__buffer
+        buffer += data
+
+        frames = 0
+        frame_start = 0
+        with memoryview(buffer) as view:
+            frame_end = buffer.find(b'\n', self.__scan_position)
+            while frame_end >= 0:
+                end = frame_end
+                if end > frame_start and buffer[end - 1] == 0x0D:  # '\r'
+                    end -= 1
+                if end > frame_start and buffer[end - 1] == 0x45:  # 'E'
+                    on_frame(view[frame_start:end])
+                    frames += 1
+                elif end > frame_start:
+                    self.malformed_frames += 1
+                frame_start = frame_end + 1
+                frame_end = buffer.find(b'\n', frame_start)
+
+        if frame_start:
+            del buffer[:frame_start]
+        if len(buffer) > self.max_frame_size:
+            buffer.clear()
+            self.dropped_frames += 1
+        self.__scan_position = len(buffer)
+
+        self.frames += frames
+        return frames
+
+
+# Таблица число -> 3 цифры в байтах: 7 -> b'007'
+_FIELDS = [b'%03d' % _value for _value in range(1000)]
+# Таблица мощность колеса -> направление, '00' и 3 цифры: -7 -> b'-00007'. Индекс: мощность + 100.
+_WHEEL_FIELDS = [(b'+' if _value >= 0 else b'-') + b'00' + _FIELDS[abs(_value)] for _value in range(-100, 101)]
+
+
+class Command_Frame_Encoder(object):
+    """
+    - Кодирование команд устройств в готовые для отправки байты.
+    - Все изменяемые части команд (3 цифры значения, направление и мощность колеса)
+      вычислены заранее, поэтому кодирование - это выбор по индексу и одна склейка байт.
+    """
+
+    FLASHLIGHT_PREFIX = b'ZSU++000'
+    FLASHLIGHT_SUFFIX = b'00000E'
+    UV_FLASHLIGHT_PREFIX = b'ZSU++'
+    UV_FLASHLIGHT_SUFFIX = b'00000000E'
+    FLASHLIGHTS_PREFIX = b'ZSU++'
+    FLASHLIGHTS_SUFFIX = b'00000E'
+    CAMERA_SERVO_PREFIX = b'ZSS'
+    CAMERA_SERVO_SUFFIX = b'0000000000E'
+    WHEELS_PREFIX = b'ZST0'
+    WHEELS_SUFFIX = b'E'
+
+    def __init__(self):
+        self.__encoders = {
+            'FLASHLIGHT': self.encode_flashlight,
+            'UV_FLASHLIGHT': self.encode_uv_flashlight,
+            'CAMERA_SERVO': self.encode_camera_servo,
+        }
+
+    def encode(self, device_name: str, value) -> bytes:
+        """
+        Закодировать команду устройства.
+        :param device_name: Имя устройства [`FLASHLIGHT`, `UV_FLASHLIGHT`, `CAMERA_SERVO`, `WHEELS`].
+        :param value:       Значение устройства. Для WHEELS - словарь {'left': int, 'right': int}.
+        :return:            Команда в байтах.
+        """
+        if device_name == 'WHEELS':
+            return self.encode_wheels(left=value['left'], right=value['right'])
+        return self.__encoders[device_name](value)
+
+    def encode_flashlight(self, value: int) -> bytes:
+        return b''.join((self.FLASHLIGHT_PREFIX, _FIELDS[value], self.FLASHLIGHT_SUFFIX))
+
+    def encode_uv_flashlight(self, value: int) -> bytes:
+        return b''.join((self.UV_FLASHLIGHT_PREFIX, _FIELDS[value], self.UV_FLASHLIGHT_SUFFIX))
+
+    def encode_flashlights(self, flashlight: int, uv_flashlight: int) -> bytes:
+        """
+        Одна команда ZSU для фонарика и УФ фонарика
+        (encode_flashlight и encode_uv_flashlight обнуляют второй канал).
+        """
+        return b''.join((self.FLASHLIGHTS_PREFIX, _FIELDS[uv_flashlight], _FIELDS[flashlight], self.FLASHLIGHTS_SUFFIX))
+
+    def encode_camera_servo(self, value: int) -> bytes:
+        return b''.join((self.CAMERA_SERVO_PREFIX, _FIELDS[value], self.CAMERA_SERVO_SUFFIX))
+
+    def encode_wheels(self, left: int, right: int) -> bytes:
+        return b''.join((self.WHEELS_PREFIX, _WHEEL_FIELDS[left + 100], _WHEEL_FIELDS[right + 100], self.WHEELS_SUFFIX))
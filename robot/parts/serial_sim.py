@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Симуляция контроллера MegaBot для работы без подключенного железа.
+"""
+
+import os
+import tty
+import time
+import random
+import select
+import threading
+import collections
+
+
+def generate_sensor_frame(sensor_mask: bytes, rng: random.Random) -> bytes:
+    """
+    Сгенерировать правдоподобное сообщение сенсора.
+    :param sensor_mask: Префикс сообщения [b'SI', b'SU', b'SA', b'SF'].
+    :param rng:         Генератор случайных чисел.
+    :return:            Сообщение с терминатором 'E' и '\\r\\n'.
+    """
+    if sensor_mask == b'SI':
+        payload = b''.join(b'%03d' % rng.randint(10, 20) for _ in range(5))
+    elif sensor_mask == b'SU':
+        payload = b''.join(b'%03d' % rng.randint(20, 200) for _ in range(5))
+    elif sensor_mask == b'SA':
+        payload = b'%03d' % rng.randint(85, 90)
+    else:
+        payload = b'%08X' % rng.getrandbits(32)
+    return sensor_mask + payload + b'E\r\n'
+
+
+class Simulated_Serial(object):
+    """
+    - Заглушка serial порта с интерфейсом serial.Serial, нужным Base_Serial.
+    - Отдает сообщения ИК, УЗ сенсоров и аккумулятора с частотой rate_hz.
+    - Принятые команды сохраняет в self.written.
+    """
+
+    def __init__(self,
+                 rate_hz: float = 50,
+                 sensor_masks: tuple = (b'SI', b'SU', b'SA'),
+                 seed: int = None,
+                 written_history: int = 1024,
+                 echo_commands: bool = False):
+        """
+        :param rate_hz:         Частота сообщений сенсоров.
+        :param sensor_masks:    Префиксы сообщений, которые отдаются по очереди.
+        :param seed:            Начальное значение генератора случайных чисел.
+        :param written_history: Сколько последних принятых команд хранить в self.written.
+        :param echo_commands:   Отвечать на каждую команду ее эхом, как подтверждением.
+        """
+        self.echo_commands = echo_commands
+        self.port = 'sim'
+        self.baudrate = 115200
+        self.timeout = None
+        self.rate_hz = rate_hz
+        self.sensor_masks = sensor_masks
+
+        self.written = collections.deque(maxlen=written_history)
+
+        self.__rng = random.Random(seed)
+        self.__pending = bytearray()
+        self.__frame_idx = 0
+        self.__next_frame_time = time.monotonic()
+        self.__lock = threading.Lock()
+        self.is_open = True
+
+    def __generate_due_frames(self) -> None:
+        now = time.monotonic()
+        while self.__next_frame_time <= now:
+            sensor_mask = self.sensor_masks[self.__frame_idx % len(self.sensor_masks)]
+            self.__pending += generate_sensor_frame(sensor_mask, self.__rng)
+            self.__frame_idx += 1
+            self.__next_frame_time += 1. / self.rate_hz
+
+    @property
+    def in_waiting(self) -> int:
+        with self.__lock:
+            self.__generate_due_frames()
+            return len(self.__pending)
+
+    def read(self, size: int = 1) -> bytes:
+        """
+        Прочитать до size байт. Если данных нет, ждет следующее сообщение сенсора.
+        """
+        while True:
+            with self.__lock:
+                self.__generate_due_frames()
+                if len(self.__pending):
+                    data = bytes(self.__pending[:size])
+                    del self.__pending[:size]
+                    return data
+                delay = self.__next_frame_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def readline(self) -> bytes:
+        line = bytearray()
+        while not line.endswith(b'\n'):
+            line += self.read(1)
+        return bytes(line)
+
+    def write(self, data: bytes) -> int:
+        self.written.append((time.monotonic(), bytes(data)))
+        if self.echo_commands:
+            # пакет команд (put_batch) - одна запись из нескольких команд: контроллер отвечает на каждую отдельно
+            echo = b''.join(frame + b'E\r\n' for frame in bytes(data).split(b'E')[:-1])
+            with self.__lock:
+                self.__pending += echo
+        return len(data)
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+def parse_command_frame(frame: bytes) -> (str, object) or None:
+    """
+    Разобрать команду, отправленную на контроллер.
+    :param frame: Команда с терминатором 'E' (например, b'ZST0+00050-00020E').
+    :return:      (имя устройства, значение) или None, если команда не распознана.
+    """
+    try:
+        if frame.startswith(b'ZST'):
+            left = int(frame[7:10]) * (-1 if frame[4:5] == b'-' else 1)
+            right = int(frame[13:16]) * (-1 if frame[10:11] == b'-' else 1)
+            return 'WHEELS', {'left': left, 'right': right}
+        if frame.startswith(b'ZSU'):
+            return 'ZSU', {'UV_FLASHLIGHT': int(frame[5:8]), 'FLASHLIGHT': int(frame[8:11])}
+        if frame.startswith(b'ZSS'):
+            return 'CAMERA_SERVO', int(frame[3:6])
+    except ValueError:
+        pass
+    return None
+
+
+def load_text_capture(path: str) -> list:
+    """
+    Загрузить текстовую запись трафика serial для MegaBot_Pty_Simulator.replay.
+    Формат строки: `<время в секундах>\\t<сообщение>` или только `<сообщение>`.
+    :param path: Путь к файлу записи.
+    :return:     Список (время в секундах или None, сообщение в байтах).
+    """
+    records = []
+    with open(path, 'rb') as capture_file:
+        for line in capture_file:
+            line = line.strip()
+            if not len(line):
+                continue
+            timestamp = None
+            if b'\t' in line:
+                raw_timestamp, line = line.split(b'\t', 1)
+                timestamp = float(raw_timestamp)
+            records.append((timestamp, line + b'\r\n'))
+    return records
+
+
+class MegaBot_Pty_Simulator(threading.Thread):
+    """
+    - Симулятор контроллера MegaBot на паре псевдотерминалов (pty).
+    - RobotHardware открывает self.slave_name как обычный serial порт.
+    - Отдает сообщения SI / SU / SA / SF с заданной частотой для каждого сенсора,
+      принимает и разбирает команды ZST / ZSU / ZSS.
+    - Может воспроизводить записанный трафик в реальном времени или с максимальной скоростью.
+    """
+
+    def __init__(self,
+                 rates_hz: dict = None,
+                 seed: int = None,
+                 commands_history: int = 4096,
+                 daemon: bool = True,
+                 echo_commands: bool = False):
+        """
+        :param rates_hz:         Частота сообщений по префиксам, например {b'SI': 50, b'SU': 20, b'SA': 1}.
+                                 Нулевая частота отключает генерацию сообщений сенсора.
+        :param seed:             Начальное значение генератора случайных чисел.
+        :param commands_history: Сколько последних принятых команд хранить в self.commands.
+        :param daemon:           Запустить поток как daemon.
+        :param echo_commands:    Отвечать на каждую принятую команду ее эхом, как подтверждением.
+        """
+        threading.Thread.__init__(self, daemon=daemon)
+        self.echo_commands = echo_commands
+        if rates_hz is None:
+            rates_hz = {b'SI': 50, b'SU': 20, b'SA': 1}
+        self.rates_hz = {sensor_mask: rate for sensor_mask, rate in rates_hz.items() if rate}
+
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.slave_name = os.ttyname(self.slave_fd)
+
+        self.commands = collections.deque(maxlen=commands_history)
+        self.state = {'WHEELS': None, 'FLASHLIGHT': None, 'UV_FLASHLIGHT': None, 'CAMERA_SERVO': None}
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.unknown_commands = 0
+
+        self.__rng = random.Random(seed)
+        self.__write_lock = threading.Lock()
+        self.__command_buffer = bytearray()
+        self.__generating = True
+        self.is_active = True
+
+    def write_frame(self, frame: bytes, block: bool = False) -> bool:
+        """
+        Отправить сообщение в порт, как если бы его прислал контроллер.
+        :param frame: Сообщение.
+        :param block: Ждать освобождения буфера pty, если он заполнен. Иначе сообщение отбрасывается.
+        :return:      True, если сообщение отправлено.
+        """
+        view = memoryview(frame)
+        with self.__write_lock:
+            while len(view):
+                try:
+                    written = os.write(self.master_fd, view)
+                    view = view[written:]
+                except BlockingIOError:
+                    if not block and len(view) == len(frame):
+                        self.frames_dropped += 1
+                        return False
+                    select.select([], [self.master_fd], [], 0.1)
+            self.frames_sent += 1
+        return True
+
+    def replay(self, records, speed: float or None = 1.) -> int:
+        """
+        Воспроизвести записанный трафик. Генерация сообщений сенсоров на время воспроизведения останавливается.
+        :param records: Итерируемый объект (время в секундах или None, сообщение в байтах).
+        :param speed:   Множитель скорости (1. - в реальном времени) или None - с максимальной скоростью.
+        :return:        Количество отправленных сообщений.
+        """
+        self.__generating = False
+        sent = 0
+        first_record_time = None
+        replay_start_time = time.monotonic()
+        try:
+            for timestamp, frame in records:
+                if speed is not None and timestamp is not None:
+                    if first_record_time is None:
+                        first_record_time = timestamp
+                    delay = replay_start_time + (timestamp - first_record_time) / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                sent += self.write_frame(frame, block=True)
+        finally:
+            self.__generating = True
+        return sent
+
+    def __read_commands(self) -> None:
+        try:
+            data = os.read(self.master_fd, 4096)
+        except (BlockingIOError, OSError):
+            return
+        receive_time = time.monotonic()
+        buffer = self.__command_buffer
+        buffer += data
+        frame_end = buffer.find(b'E')
+        while frame_end >= 0:
+            frame = bytes(buffer[:frame_end + 1])
+            del buffer[:frame_end + 1]
+            self.commands.append((receive_time, frame))
+            if self.echo_commands:
+                self.write_frame(frame + b'\r\n', block=True)
+            command = parse_command_frame(frame)
+            if command is None:
+                self.unknown_commands += 1
+            elif command[0] == 'ZSU':
+                self.state.update(command[1])
+            else:
+                self.state[command[0]] = command[1]
+            frame_end = buffer.find(b'E')
+
+    def stop(self) -> None:
+        self.is_active = False
+
+    def close(self) -> None:
+        self.stop()
+        if self.is_alive():
+            self.join(timeout=1.)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def run(self) -> None:
+        now = time.monotonic()
+        next_frame_times = {sensor_mask: now for sensor_mask in self.rates_hz.keys()}
+        while self.is_active:
+            now = time.monotonic()
+            if self.__generating:
+                for sensor_mask, rate_hz in self.rates_hz.items():
+                    if next_frame_times[sensor_mask] <= now:
+                        self.write_frame(generate_sensor_frame(sensor_mask, self.__rng))
+                        next_frame_times[sensor_mask] = max(next_frame_times[sensor_mask] + 1. / rate_hz, now)
+                timeout = max(0., min(next_frame_times.values(), default=now + 0.05) - time.monotonic())
+            else:
+                timeout = 0.05
+            readable, _, _ = select.select([self.master_fd], [], [], min(timeout, 0.05))
+            if readable:
+                self.__read_commands()
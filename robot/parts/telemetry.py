@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий снимок телеметрии MegaBot (ИК + УЗ + аккумулятор) для передачи
+из потока чтения serial в цикл управления без блокировок.
+"""
+
+import time
+import numpy as np
+
+
+SENSORS_COUNT = 5
+
+# Раскладка значений в снимке
+IR_SLICE = slice(0, SENSORS_COUNT)
+US_SLICE = slice(SENSORS_COUNT, 2 * SENSORS_COUNT)
+BATTERY_IDX = 2 * SENSORS_COUNT
+TIME_NS_IDX = BATTERY_IDX + 1
+SNAPSHOT_SIZE = TIME_NS_IDX + 1
+
+# Количество значений телеметрии в снимке (без времени)
+TELEMETRY_VALUES_COUNT = BATTERY_IDX + 1
+
+# Раскладка отфильтрованных значений (см. parts.sensor_history.Sensor_History)
+FILTERED_IR_SLICE = IR_SLICE
+FILTERED_US_SLICE = US_SLICE
+FILTERED_SIZE = 2 * SENSORS_COUNT
+
+# Значения по умолчанию, пока с контроллера ничего не принято
+DEFAULT_RANGE_VALUE = 255
+DEFAULT_BATTERY_VALUE = 0
+
+
+class Seqlock_Array(object):
+    """
+    - Двойной буфер со счетчиком последовательности (seqlock).
+    - Писатель (один поток) всегда пишет в неактивный буфер и затем
+      публикует его одним присваиванием номера последовательности, поэтому никогда не ждет.
+    - Читатель копирует активный буфер и повторяет чтение только в том случае,
+      если за время копирования писатель успел начать запись в этот же буфер.
+    """
+
+    def __init__(self, size: int, dtype=np.int64, fill_value=0):
+        self.__buffers = np.full((2, size), fill_value, dtype=dtype)
+
+        # Номер последнего опубликованного снимка. Снимок n лежит в буфере n & 1.
+        self.__sequence = 0
+        # Номер снимка, запись которого начата писателем.
+        self.__writing_sequence = 0
+
+        self.read_retries = 0
+
+    @property
+    def sequence(self) -> int:
+        return self.__sequence
+
+    def _begin_write(self) -> np.ndarray:
+        """
+        Начать запись следующего снимка.
+        :return: Буфер, который нужно заполнить до вызова self._end_write().
+        """
+        self.__writing_sequence = self.__sequence + 1
+        return self.__buffers[self.__writing_sequence & 1]
+
+    def _end_write(self) -> None:
+        self.__sequence = self.__writing_sequence
+
+    def publish_array(self, values) -> None:
+        """
+        Опубликовать снимок целиком. Вызывается только из одного потока-писателя.
+        :param values: Значения снимка (размер - как у буфера).
+        :return:       None.
+        """
+        self._begin_write()[:] = values
+        self._end_write()
+
+    def read(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Прочитать согласованный снимок.
+        :param out: Массив того же размера и типа для записи снимка. Если не задан, создается новый.
+        :return:    Снимок.
+        """
+        if out is None:
+            out = np.empty_like(self.__buffers[0])
+        while True:
+            sequence = self.__sequence
+            np.copyto(out, self.__buffers[sequence & 1])
+            # Буфер снимка `sequence` перезаписывается только снимком `sequence + 2`
+            if self.__writing_sequence - sequence < 2:
+                return out
+            self.read_retries += 1
+
+
+class Telemetry_Snapshot(Seqlock_Array):
+    """
+    - Снимок телеметрии [ir1..ir5, us1..us5, battery, time_ns] в Seqlock_Array.
+    - Писатель - поток чтения serial, читатели - части цикла управления.
+    """
+
+    def __init__(self):
+        Seqlock_Array.__init__(self, size=SNAPSHOT_SIZE, dtype=np.int64, fill_value=DEFAULT_RANGE_VALUE)
+        buffer = self._begin_write()
+        buffer[BATTERY_IDX] = DEFAULT_BATTERY_VALUE
+        buffer[TIME_NS_IDX] = time.monotonic_ns()
+        self._end_write()
+
+    def publish(self, ir, us, battery: int or None, time_ns: int) -> None:
+        """
+        Опубликовать новый снимок телеметрии. Вызывается только из одного потока-писателя.
+        :param ir:      5 значений ИК сенсоров (array, list или np.ndarray).
+        :param us:      5 значений УЗ сенсоров (array, list или np.ndarray).
+        :param battery: Значение аккумулятора или None.
+        :param time_ns: Время обновления по time.monotonic_ns().
+        :return:        None.
+        """
+        buffer = self._begin_write()
+        buffer[IR_SLICE] = ir
+        buffer[US_SLICE] = us
+        buffer[BATTERY_IDX] = DEFAULT_BATTERY_VALUE if battery is None else battery
+        buffer[TIME_NS_IDX] = time_ns
+        self._end_write()
@@ -21,6 +21,9 @@ from typing import List, Any, Tuple, Union
 
 from PIL import Image
 import numpy as np
+import cv2
+
+from parts.camera_frame import Jpeg_Frame, color_order_of
 
 logger = logging.getLogger(__name__)
 
@@ -74,7 +77,16 @@ def arr_to_binary(arr):
     '''
     accepts: numpy array with shape (Hight, Width, Channels)
     returns: binary stream (used to save to database)
+    BGR camera frames (parts.camera_frame.Camera_Frame) are encoded by OpenCV as is,
+    without converting them to RGB first. MJPEG camera frames (parts.camera_frame.Jpeg_Frame)
+    are returned as is, without decoding and encoding again.
     '''
+    if isinstance(arr, Jpeg_Frame):
+        return arr.tobytes()
+    if color_order_of(arr) == 'BGR':
+        ok, buffer = cv2.imencode('.jpg', arr)
+        assert ok, Exception(f"Failed to encode frame with shape {arr.shape} to jpeg.")
+        return buffer.tobytes()
     img = arr_to_img(arr)
     return img_to_binary(img)
 
@@ -15,7 +15,7 @@ import time
 import asyncio
 
 import requests
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.web import Application, RedirectHandler, StaticFileHandler, \
     RequestHandler
 from tornado.httpserver import HTTPServer
@@ -25,10 +25,28 @@ from socket import gethostname
 
 # from ... import utils
 from parts.web_controller import utils
+from parts.camera_frame import Jpeg_Frame
 
 logger = logging.getLogger(__name__)
 
 
+def hold_frame(frame, held=None):
+    '''
+    Frame the MJPEG handlers can encode later on the tornado thread.
+    Camera frames live in reused buffers (Triple_Frame_Buffer, Shared_Frame_Ring)
+    that the camera overwrites after the loop moves on, so raw frames are copied
+    once per camera frame (a frame with the same seq as `held` reuses `held`).
+    Jpeg_Frame bytes are never written again and pass through as is.
+    '''
+    if frame is None or isinstance(frame, Jpeg_Frame):
+        return frame
+    seq = getattr(frame, 'seq', None)
+    if held is not None and seq is not None and getattr(held, 'seq', None) == seq \
+            and getattr(held, 'shape', None) == frame.shape:
+        return held
+    return frame.copy()
+
+
 class RemoteWebServer():
     '''
     A controller that repeatedly polls a remote webserver and expects
@@ -102,10 +120,15 @@ class RemoteWebServer():
 
 class LocalWebController(tornado.web.Application):
 
-    def __init__(self, port=8887, mode='user'):
+    def __init__(self, port=8887, mode='user', loop_services=None, telemetry_source=None, telemetry_interval=0.2):
         '''
         Create and publish variables needed on many of
         the web handlers.
+
+        loop_services: objects with start(loop), started on the server's asyncio
+            loop (e.g. parts.serial_asyncio.Asyncio_Serial_Transport)
+        telemetry_source: callable returning a json-serializable dict, pushed to
+            websocket clients as {"telemetry": ...} every telemetry_interval seconds
         '''
 
         print('Starting Donkey Server...', end='')
@@ -125,6 +148,9 @@ class LocalWebController(tornado.web.Application):
         self.num_records = 0
         self.wsclients = []
         self.loop = None
+        self.loop_services = [] if loop_services is None else list(loop_services)
+        self.telemetry_source = telemetry_source
+        self.telemetry_interval = telemetry_interval
 
 
         handlers = [
@@ -151,8 +177,16 @@ class LocalWebController(tornado.web.Application):
         asyncio.set_event_loop(asyncio.new_event_loop())
         self.listen(self.port)
         self.loop = IOLoop.instance()
+        for service in self.loop_services:
+            service.start(asyncio.get_event_loop())
+        if self.telemetry_source is not None:
+            PeriodicCallback(self.push_telemetry, self.telemetry_interval * 1000).start()
         self.loop.start()
 
+    def push_telemetry(self):
+        if self.wsclients:
+            self.update_wsclients({'telemetry': self.telemetry_source()})
+
     def update_wsclients(self, data):
         if data:
             for wsclient in self.wsclients:
@@ -173,9 +207,9 @@ class LocalWebController(tornado.web.Application):
         :param recording: default recording mode
         """
         # self.img_arr = img_arr
-        self.img_arr_top = img_arr_top
-        self.img_arr_bot = img_arr_bot
-        self.img_arr_aruco = img_arr_aruco
+        self.img_arr_top = hold_frame(img_arr_top, getattr(self, 'img_arr_top', None))
+        self.img_arr_bot = hold_frame(img_arr_bot, getattr(self, 'img_arr_bot', None))
+        self.img_arr_aruco = hold_frame(img_arr_aruco, getattr(self, 'img_arr_aruco', None))
         self.num_records = num_records
 
         #
@@ -490,10 +524,10 @@ class WebFpv(Application):
         IOLoop.instance().start()
 
     def run_threaded(self, img_arr=None):
-        self.img_arr = img_arr
+        self.img_arr = hold_frame(img_arr, getattr(self, 'img_arr', None))
 
     def run(self, img_arr=None):
-        self.img_arr = img_arr
+        self.run_threaded(img_arr)
 
     def shutdown(self):
         pass
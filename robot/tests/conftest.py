@@ -0,0 +1,5 @@
+import os
+import sys
+
+# модули робота импортируются как `parts.*` из папки robot
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
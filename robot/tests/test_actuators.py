@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь записи команд: пакеты команд (put_batch) и сборка пакета в RobotHardware.batch().
+"""
+
+from parts.actuators import Robot, Serial_Writer
+from parts.serial_sim import Simulated_Serial
+
+
+SERVO_10 = b'ZSS0100000000000E'
+SERVO_20 = b'ZSS0200000000000E'
+STOP = b'ZST0+00000+00000E'
+FORWARD = b'ZST0+00060+00060E'
+FLASHLIGHT = b'ZSU++00004000000E'
+
+
+def make_writer(**kwargs) -> tuple:
+    writes, discarded = [], []
+    writer = Serial_Writer(write_function=writes.append, frame_interval=0.,
+                           on_discard=lambda key, message: discarded.append((key, message)), **kwargs)
+    return writer, writes, discarded
+
+
+def write_all(writer: Serial_Writer) -> None:
+    while writer.write_pending() is not None:
+        pass
+
+
+def test_batch_is_written_as_one_write():
+    writer, writes, _ = make_writer()
+    writer.put_batch([('CAMERA_SERVO', SERVO_10), ('WHEELS', STOP), ('FLASHLIGHT', FLASHLIGHT)])
+    assert writer.get_queue_depth() == 1
+    write_all(writer)
+    assert writes == [SERVO_10 + STOP + FLASHLIGHT]
+    assert writer.frames_written == 1
+
+
+def test_batch_replaces_pending_commands_for_same_device():
+    writer, writes, discarded = make_writer()
+    writer.put('CAMERA_SERVO', SERVO_10)
+    writer.put('WHEELS', FORWARD)
+    writer.put_batch([('CAMERA_SERVO', SERVO_20), ('FLASHLIGHT', FLASHLIGHT)])
+
+    # одиночная команда того же устройства заменена командой пакета, остальные не тронуты
+    assert discarded == [('CAMERA_SERVO', SERVO_10)]
+    assert writer.frames_coalesced == 1
+    write_all(writer)
+    assert writes == [FORWARD, SERVO_20 + FLASHLIGHT]
+
+
+def test_batch_with_same_devices_replaces_pending_batch():
+    writer, writes, discarded = make_writer()
+    writer.put_batch([('CAMERA_SERVO', SERVO_10), ('WHEELS', FORWARD)])
+    writer.put_batch([('CAMERA_SERVO', SERVO_20), ('WHEELS', STOP)])
+    assert writer.get_queue_depth() == 1
+    assert discarded == [('CAMERA_SERVO', SERVO_10), ('WHEELS', FORWARD)]
+    write_all(writer)
+    assert writes == [SERVO_20 + STOP]
+
+
+def test_urgent_command_is_removed_from_pending_batch():
+    writer, writes, discarded = make_writer()
+    writer.put_batch([('CAMERA_SERVO', SERVO_10), ('WHEELS', FORWARD)])
+    writer.put_urgent('WHEELS', STOP)
+    assert discarded == [('WHEELS', FORWARD)]
+
+    # пока срочная команда ждет записи, пакет не может ее заменить
+    writer.put_batch([('WHEELS', FORWARD)])
+    assert discarded[-1] == ('WHEELS', FORWARD)
+    write_all(writer)
+    assert writes == [STOP, SERVO_10]
+
+
+def test_robot_batch_sends_last_value_per_device():
+    serial_port = Simulated_Serial(rate_hz=50, sensor_masks=(b'SA',), seed=0)
+    robot = Robot(serial_port=serial_port, autostart=False)
+    writes = []
+    robot.hardware.writer.write_function = writes.append
+
+    with robot.batch():
+        robot.camera_servo_set(angle=10)
+        robot.flashlight_set(value=40)
+        with robot.batch():
+            robot.uv_flashlight_set(value=7)
+        robot.camera_servo_set(angle=20)
+    write_all(robot.hardware.writer)
+
+    # фонарик и УФ фонарик - одна команда ZSU, от сервопривода камеры - только последнее значение
+    assert writes == [b'ZSU++00704000000E' + SERVO_20]
+    assert robot.hardware.devices['CAMERA_SERVO']['value'] == 20
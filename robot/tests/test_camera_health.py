@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Контроль работы камеры: обнаружение остановки потока кадров и пауза между попытками переоткрыть устройство.
+"""
+
+from parts.camera_health import Camera_Health
+
+
+def test_stall_timeout_from_expected_fps():
+    health = Camera_Health(expected_fps=20, stall_frames=5, min_stall_timeout=0.1)
+    assert health.stall_timeout == 0.25
+    # при низком FPS таймаут растет, при высоком - не меньше min_stall_timeout
+    health.set_expected_fps(2)
+    assert health.stall_timeout == 2.5
+    health.set_expected_fps(100)
+    assert health.stall_timeout == 0.1
+
+
+def test_stall_detected_after_timeout():
+    health = Camera_Health(expected_fps=10, stall_frames=5, min_stall_timeout=0.1)
+    health.frame_received(now=100.)
+    health.frame_received(now=100.1)
+    assert not health.check(now=100.5)
+    assert health.check(now=100.7)
+    # остановка считается один раз, пока кадры не пошли снова
+    assert health.check(now=101.)
+    assert health.stalls == 1
+    assert abs(health.interval.get_stats()['avg_ms'] - 100) < 1e-6
+
+
+def test_reopen_backoff_doubles_until_max():
+    health = Camera_Health(expected_fps=10, stall_frames=5, min_stall_timeout=0.1, backoff_min=1., backoff_max=4.)
+    health.frame_received(now=100.)
+    assert not health.reopen_due(now=101.)
+    assert health.check(now=101.)
+
+    # первая попытка сразу, затем паузы 1, 2, 4, 4 с
+    attempts = [now for now in [x / 10 for x in range(1010, 1140)] if health.reopen_due(now=now)]
+    assert attempts == [101., 102., 104., 108., 112.]
+    assert health.reopen_attempts == 5
+
+
+def test_frame_after_stall_resets_backoff_and_records_recovery():
+    health = Camera_Health(expected_fps=10, stall_frames=5, min_stall_timeout=0.1, backoff_min=1., backoff_max=8.)
+    health.frame_received(now=100.)
+    health.check(now=101.)
+    assert health.reopen_due(now=101.)
+    assert health.reopen_due(now=102.)
+    health.reopened()
+
+    health.frame_received(now=102.5)
+    assert not health.stalled
+    assert health.last_recovery_ms == 2500.
+    assert health.recovery.get_stats()['count'] == 1
+    assert not health.reopen_due(now=103.)
+
+    # новая остановка начинается с минимальной паузы
+    assert health.check(now=104.)
+    assert health.reopen_due(now=104.)
+    assert not health.reopen_due(now=104.9)
+    assert health.reopen_due(now=105.)
+    assert health.stalls == 2
+    assert health.reopens == 1
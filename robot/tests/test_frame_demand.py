@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Захват кадров по потребности цикла управления: какие кадры декодировать и какую частоту кадров задать камере.
+"""
+
+import time
+
+from parts.frame_demand import Frame_Demand
+
+
+FRAME_INTERVAL = 1 / 32
+CONSUME_INTERVAL = 1 / 8
+
+
+def simulate(demand: Frame_Demand, frames: int, consumes: int) -> list:
+    """
+    Камера 32 FPS, цикл управления 8 Гц (обращается за кадром чуть позже кадра).
+    :return: Время кадров, которые нужно декодировать.
+    """
+    events = sorted([(idx * FRAME_INTERVAL, False) for idx in range(frames)] +
+                    [(idx * CONSUME_INTERVAL + FRAME_INTERVAL / 2, True) for idx in range(consumes)])
+    due = []
+    for now, is_consume in events:
+        if is_consume:
+            demand.consumed(now=now)
+        elif demand.frame_due(now=now):
+            due.append(now)
+    return due
+
+
+def test_every_frame_due_until_consume_rate_known():
+    demand = Frame_Demand(smoothing=1.)
+    assert all(demand.frame_due(now=idx * FRAME_INTERVAL) for idx in range(5))
+    demand.consumed(now=0.2)
+    # одного обращения мало для оценки частоты потребления
+    assert demand.frame_due(now=0.21)
+    assert demand.frames_skipped == 0
+
+
+def test_only_last_frame_before_consume_is_due():
+    demand = Frame_Demand(smoothing=1.)
+    due = simulate(demand, frames=64, consumes=16)
+    # после оценки частоты - по одному кадру на обращение, последний кадр перед обращением
+    steady = [now for now in due if now > 2 * CONSUME_INTERVAL]
+    assert steady == [idx * CONSUME_INTERVAL for idx in range(3, 16)]
+    stats = demand.get_stats()
+    assert stats['consume_fps'] == 8.
+    assert stats['frame_fps'] == 32.
+    assert stats['frames_retrieved'] + stats['frames_skipped'] == 64
+
+
+def test_frames_refreshed_when_consumer_stops():
+    demand = Frame_Demand(smoothing=1.)
+    simulate(demand, frames=16, consumes=4)
+    # потребитель больше не обращается: кадр обновляется раз в интервал потребления
+    due = [idx * FRAME_INTERVAL for idx in range(16, 48) if demand.frame_due(now=idx * FRAME_INTERVAL)]
+    assert due == [idx * CONSUME_INTERVAL for idx in range(4, 12)]
+
+
+def test_target_fps_follows_consume_rate():
+    demand = Frame_Demand(mode='fps', smoothing=1., headroom=1.5, min_fps=5., retune_interval=2.)
+    start = time.monotonic() + 10.
+    assert demand.target_fps(max_fps=30., now=start) is None
+
+    demand.consumed(now=0.)
+    demand.consumed(now=CONSUME_INTERVAL)
+    assert demand.target_fps(max_fps=30., now=start) == 12.
+    demand.device_fps = 12.
+    # не чаще retune_interval
+    demand.consumed(now=CONSUME_INTERVAL + 1 / 64)
+    assert demand.target_fps(max_fps=30., now=start + 1.) is None
+
+    # небольшое изменение частоты не перезапускает поток камеры
+    demand.consumed(now=CONSUME_INTERVAL + 1 / 64 + 7 / 64)
+    assert demand.target_fps(max_fps=30., now=start + 3.) is None
+
+    demand.consumed(now=10.)
+    demand.consumed(now=10.5)
+    assert demand.target_fps(max_fps=30., now=start + 6.) == 5.
+    demand.device_fps = 5.
+    demand.consumed(now=10.5 + 1 / 64)
+    assert demand.target_fps(max_fps=30., now=start + 9.) == 30.
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Синхронизация кадров двух камер: выбор пары по времени захвата и история кадров камеры.
+"""
+
+import numpy as np
+
+from parts.camera_frame import Camera_Frame
+from parts.frame_sync import Dual_Camera_Synchronizer, Frame_History
+
+
+MS = 1000000
+
+
+def make_frame(seq: int, capture_time_ms: float, value: int = 0) -> Camera_Frame:
+    return Camera_Frame(np.full((2, 2, 3), value, dtype=np.uint8), seq=seq, capture_time_ns=int(capture_time_ms * MS))
+
+
+def test_freshest_pair_within_tolerance():
+    synchronizer = Dual_Camera_Synchronizer(tolerance_ms=15., history_size=4)
+    assert synchronizer.run() == (None, None, False, None)
+
+    for seq, capture_time_ms in enumerate([0, 33, 66]):
+        synchronizer.first.put(make_frame(seq, capture_time_ms))
+    for seq, capture_time_ms in enumerate([5, 40, 70]):
+        synchronizer.second.put(make_frame(seq, capture_time_ms))
+    # у последнего кадра первой камеры нет пары
+    synchronizer.first.put(make_frame(3, 100))
+
+    first_frame, second_frame, matched, skew_ms = synchronizer.run()
+    assert matched
+    assert (first_frame.seq, second_frame.seq) == (2, 2)
+    assert skew_ms == -4.
+    assert synchronizer.pairs_matched == 1
+
+
+def test_latest_frames_when_no_pair_matches():
+    synchronizer = Dual_Camera_Synchronizer(tolerance_ms=5.)
+    synchronizer.first.put(make_frame(0, 0))
+    synchronizer.first.put(make_frame(1, 30))
+    synchronizer.second.put(make_frame(0, 15))
+    synchronizer.second.put(make_frame(1, 50))
+
+    first_frame, second_frame, matched, skew_ms = synchronizer.run()
+    assert not matched
+    assert (first_frame.seq, second_frame.seq) == (1, 1)
+    assert skew_ms == -20.
+    assert synchronizer.pairs_unmatched == 1
+
+
+def test_repeated_pair_is_counted_once():
+    synchronizer = Dual_Camera_Synchronizer()
+    synchronizer.first.put(make_frame(0, 0))
+    synchronizer.second.put(make_frame(0, 1))
+    synchronizer.run()
+    synchronizer.run()
+    stats = synchronizer.get_stats()
+    assert stats['pairs_matched'] == 1
+    assert stats['pairs_repeated'] == 1
+    assert stats['skew']['count'] == 1
+
+
+def test_history_copies_reused_camera_buffer():
+    history = Frame_History(capacity=2)
+    camera_buffer = make_frame(0, 0, value=1)
+    history.put(camera_buffer)
+    # камера пишет следующий кадр в тот же буфер
+    camera_buffer[:] = 2
+    stored = history.snapshot()[0]
+    assert stored.seq == 0
+    assert int(stored[0, 0, 0]) == 1
+    assert stored.color_order == 'BGR'
+
+
+def test_pinned_frame_is_not_overwritten():
+    synchronizer = Dual_Camera_Synchronizer(history_size=1)
+    synchronizer.first.put(make_frame(0, 0, value=10))
+    synchronizer.second.put(make_frame(0, 0, value=20))
+    first_frame, second_frame, _, _ = synchronizer.run()
+
+    for seq in range(1, 10):
+        synchronizer.first.put(make_frame(seq, seq * 100, value=seq))
+    assert first_frame.seq == 0
+    assert int(first_frame[0, 0, 0]) == 10
+    assert [frame.seq for frame in synchronizer.first.snapshot()] == [9, 8, 0]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Аварийная остановка перед препятствием не должна теряться из-за команды колес,
+поставленной в очередь записи одновременно со срабатыванием блокировки.
+"""
+
+import threading
+
+from parts.actuators import Robot
+from parts.safety import Obstacle_Stop_Interlock
+from parts.serial_sim import Simulated_Serial, parse_command_frame
+
+
+STOP = {'left': 0, 'right': 0}
+FORWARD = {'left': 60, 'right': 60}
+OBSTACLE = b'SU005005005005005E'
+CLEAR = b'SU100100100100100E'
+
+
+class Racing_Interlock(Obstacle_Stop_Interlock):
+    """
+    Блокировка, которая срабатывает в потоке чтения сразу после того, как разрешила команду колес
+    (самое неудачное время для цикла управления).
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.trip = None
+
+    def allows(self, wheels) -> bool:
+        allowed = super().allows(wheels)
+        trip, self.trip = self.trip, None
+        if allowed and trip is not None:
+            trip()
+        return allowed
+
+
+def written_wheels(serial_port: Simulated_Serial, start: int) -> list:
+    wheels = []
+    for _, data in list(serial_port.written)[start:]:
+        command = parse_command_frame(data)
+        if command is not None and command[0] == 'WHEELS':
+            wheels.append(command[1])
+    return wheels
+
+
+def test_stop_frame_survives_concurrent_wheels_set():
+    # симулятор отдает только аккумулятор - блокировку включают и снимают только сообщения теста
+    serial_port = Simulated_Serial(rate_hz=50, sensor_masks=(b'SA',), seed=0, written_history=100000)
+    interlock = Racing_Interlock(us_stop_distance=10, release_margin=5)
+    robot = Robot(serial_port=serial_port, safety_interlock=interlock)
+    hardware = robot.hardware
+
+    def trip_from_reader_thread():
+        reader = threading.Thread(target=hardware.parse_message, args=(OBSTACLE,))
+        reader.start()
+        # поток чтения ждет, пока команда колес не встанет в очередь
+        reader.join(timeout=0.05)
+        trip_from_reader_thread.reader = reader
+
+    try:
+        for _ in range(20):
+            start = len(serial_port.written)
+            interlock.trip = trip_from_reader_thread
+            robot.wheels_set(**FORWARD)
+            trip_from_reader_thread.reader.join()
+            assert hardware.writer.flush(timeout=2.)
+
+            wheels = written_wheels(serial_port, start)
+            assert STOP in wheels
+            # последней записана остановка: команда вперед, разрешенная до срабатывания, ее не заменила
+            assert wheels[-1] == STOP
+            assert hardware.get_device_value('WHEELS') == STOP
+
+            # пока блокировка активна, команда вперед заменяется остановкой
+            assert robot.wheels_set(**FORWARD) == STOP
+            assert hardware.writer.flush(timeout=2.)
+            assert FORWARD not in written_wheels(serial_port, start)[wheels.index(STOP):]
+
+            hardware.parse_message(CLEAR)
+            assert not interlock.tripped
+    finally:
+        hardware.stop()
+    assert interlock.trips == 20
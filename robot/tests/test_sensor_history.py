@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+История значений сенсоров: медиана окна, отбрасывание выбросов и экспоненциальное сглаживание.
+"""
+
+from parts.sensor_history import Sensor_History
+
+
+def test_median_of_window_per_channel():
+    history = Sensor_History(channels=2, capacity=8, median_window=3, outlier_threshold=None, ema_alpha=1)
+    history.push([1, 10], time_ns=1)
+    assert list(history.median) == [1, 10]
+    # окно еще не заполнено: медиана двух значений
+    history.push([5, 20], time_ns=2)
+    assert list(history.median) == [3, 15]
+    history.push([3, 30], time_ns=3)
+    assert list(history.median) == [3, 20]
+    # самое старое значение выходит из окна
+    filtered = history.push([100, 0], time_ns=4)
+    assert list(history.median) == [5, 20]
+    assert list(filtered) == [100, 0]
+
+
+def test_outlier_is_replaced_by_median():
+    history = Sensor_History(channels=2, median_window=3, outlier_threshold=50, ema_alpha=1)
+    for time_ns in range(3):
+        history.push([100, 100], time_ns=time_ns)
+
+    # выброс только в первом канале
+    filtered = history.push([300, 120], time_ns=3)
+    assert list(filtered) == [100, 120]
+    assert history.outliers == 1
+    # в истории хранится исходное значение
+    assert list(history.get_window(1)[0][0]) == [300, 120]
+
+    filtered = history.push([130, 90], time_ns=4)
+    assert list(filtered) == [130, 90]
+    assert history.outliers == 1
+
+
+def test_ema_smooths_values():
+    history = Sensor_History(channels=1, outlier_threshold=None, ema_alpha=0.5)
+    assert list(history.push([0], time_ns=0)) == [0]
+    assert list(history.push([10], time_ns=1)) == [5]
+    assert list(history.push([10], time_ns=2)) == [7.5]
+    assert list(history.push([0], time_ns=3)) == [3.75]
+
+
+def test_window_is_chronological_after_wraparound():
+    history = Sensor_History(channels=1, capacity=4, median_window=3)
+    for idx in range(6):
+        history.push([idx], time_ns=idx * 10)
+    values, times_ns = history.get_window()
+    assert list(values[:, 0]) == [2, 3, 4, 5]
+    assert list(times_ns) == [20, 30, 40, 50]
+    values, times_ns = history.get_window(size=2)
+    assert list(values[:, 0]) == [4, 5]
+    assert list(times_ns) == [40, 50]
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сопоставление ответов контроллера с записанными командами и гистограммы задержек.
+"""
+
+import time
+import asyncio
+from concurrent.futures import Future
+
+from parts.actuators import Robot
+from parts.latency import Latency_Histogram
+from parts.serial_ack import Command_Ack_Tracker
+from parts.serial_sim import Simulated_Serial
+
+
+SERVO_10 = b'ZSS0100000000000E'
+SERVO_20 = b'ZSS0200000000000E'
+STOP = b'ZST0+00000+00000E'
+FORWARD = b'ZST0+00060+00060E'
+MS = 1000000
+
+
+def written(tracker: Command_Ack_Tracker, device_name: str, frame: bytes, write_time_ns: int,
+            register: bool = True) -> Future or None:
+    future = None
+    if register:
+        future = Future()
+        tracker.register(device_name=device_name, frame=frame, future=future)
+    tracker.on_written(device_name, frame, write_time_ns)
+    return future
+
+
+def test_ack_resolves_future_with_latency():
+    tracker = Command_Ack_Tracker()
+    future = written(tracker, 'CAMERA_SERVO', SERVO_10, write_time_ns=10 * MS)
+    assert tracker.on_ack(SERVO_10, receive_time_ns=13 * MS)
+    assert future.result(timeout=0) == 3.
+    stats = tracker.get_stats()
+    assert stats['acknowledged'] == 1
+    assert stats['pending'] == 0
+    assert stats['latency']['CAMERA_SERVO']['count'] == 1
+
+
+def test_echo_of_sync_command_does_not_resolve_async_command():
+    tracker = Command_Ack_Tracker()
+    # синхронная команда (без future) записана раньше асинхронной команды того же типа
+    written(tracker, 'WHEELS', STOP, write_time_ns=1 * MS, register=False)
+    future = written(tracker, 'WHEELS', FORWARD, write_time_ns=2 * MS)
+
+    assert tracker.on_ack(STOP, receive_time_ns=5 * MS)
+    assert not future.done()
+    assert tracker.on_ack(FORWARD, receive_time_ns=6 * MS)
+    assert future.result(timeout=0) == 4.
+    assert tracker.get_stats()['latency']['WHEELS']['count'] == 2
+
+
+def test_ack_matches_oldest_command_by_prefix():
+    tracker = Command_Ack_Tracker()
+    first = written(tracker, 'CAMERA_SERVO', SERVO_10, write_time_ns=1 * MS)
+    second = written(tracker, 'CAMERA_SERVO', SERVO_20, write_time_ns=2 * MS)
+
+    # подтверждение без эха: по префиксу, самой старой команде
+    assert tracker.on_ack(b'ZSSOKE', receive_time_ns=4 * MS)
+    assert first.result(timeout=0) == 3.
+    assert not second.done()
+
+
+def test_older_commands_of_same_type_stay_unanswered():
+    tracker = Command_Ack_Tracker()
+    first = written(tracker, 'CAMERA_SERVO', SERVO_10, write_time_ns=1 * MS)
+    second = written(tracker, 'CAMERA_SERVO', SERVO_20, write_time_ns=2 * MS)
+    wheels = written(tracker, 'WHEELS', STOP, write_time_ns=3 * MS)
+
+    assert tracker.on_ack(SERVO_20, receive_time_ns=4 * MS)
+    assert second.done()
+    assert not first.done()
+    assert tracker.unanswered == 1
+    # команды другого типа не затронуты
+    assert tracker.on_ack(STOP, receive_time_ns=5 * MS)
+    assert wheels.done()
+    assert not tracker.on_ack(SERVO_10, receive_time_ns=6 * MS)
+    assert tracker.unexpected_acks == 1
+
+
+def test_replaced_commands_are_cancelled():
+    tracker = Command_Ack_Tracker()
+    first = Future()
+    tracker.register(device_name='CAMERA_SERVO', frame=SERVO_10, future=first)
+    second = Future()
+    tracker.register(device_name='CAMERA_SERVO', frame=SERVO_20, future=second)
+    assert first.cancelled()
+
+    # команда заменена в очереди записи (Serial_Writer.on_discard)
+    tracker.discard('CAMERA_SERVO', SERVO_20)
+    assert second.cancelled()
+    assert tracker.superseded == 2
+    assert tracker.get_stats()['pending'] == 0
+
+
+def test_expired_command_is_not_acknowledged_later():
+    tracker = Command_Ack_Tracker()
+    future = written(tracker, 'CAMERA_SERVO', SERVO_10, write_time_ns=1 * MS)
+    tracker.expire(future)
+    assert tracker.timeouts == 1
+    assert tracker.get_stats()['pending'] == 0
+    assert not tracker.on_ack(SERVO_10, receive_time_ns=2 * MS)
+    assert not future.done()
+
+
+def test_ack_survives_concurrent_cancel():
+    tracker = Command_Ack_Tracker()
+    future = written(tracker, 'CAMERA_SERVO', SERVO_10, write_time_ns=1 * MS)
+    # отмена из цикла asyncio между проверкой done() и set_result()
+    future.cancel()
+    future.done = lambda: False
+    assert tracker.on_ack(SERVO_10, receive_time_ns=2 * MS)
+    assert future.cancelled()
+
+
+def test_in_flight_overflow_counts_unanswered():
+    tracker = Command_Ack_Tracker(max_in_flight=2)
+    for idx in range(3):
+        written(tracker, 'CAMERA_SERVO', b'ZSS%03d0000000000E' % idx, write_time_ns=idx * MS, register=False)
+    assert tracker.unanswered == 1
+    assert tracker.get_stats()['in_flight'] == 2
+
+
+def test_latency_histogram_percentiles():
+    histogram = Latency_Histogram(buckets_ms=(1, 2, 5, 10))
+    assert histogram.percentile(50) is None
+    assert histogram.get_stats()['avg_ms'] is None
+
+    for latency_ms in [0.5] * 50 + [1.5] * 40 + [4] * 9 + [30]:
+        histogram.add(latency_ms)
+    stats = histogram.get_stats()
+    assert stats['count'] == 100
+    assert stats['p50_ms'] == 1
+    assert histogram.percentile(90) == 2
+    assert stats['p99_ms'] == 5
+    # последняя корзина - все, что больше последней границы: перцентиль по максимуму
+    assert histogram.percentile(100) == 30
+    assert stats['max_ms'] == 30
+    assert abs(stats['avg_ms'] - (25 + 60 + 36 + 30) / 100) < 1e-9
+
+
+def test_async_command_is_acknowledged_by_echo():
+    serial_port = Simulated_Serial(rate_hz=50, sensor_masks=(b'SA',), seed=0, echo_commands=True)
+    robot = Robot(serial_port=serial_port)
+    try:
+        latency_ms = asyncio.run(robot.camera_servo_set_async(angle=40, timeout=2.))
+        assert latency_ms >= 0
+        assert robot.hardware.ack_tracker.get_stats()['latency']['CAMERA_SERVO']['count'] == 1
+    finally:
+        robot.hardware.stop()
+
+
+def test_reader_thread_survives_parse_errors(monkeypatch):
+    serial_port = Simulated_Serial(rate_hz=50, sensor_masks=(b'SA',), seed=0, echo_commands=True)
+    robot = Robot(serial_port=serial_port)
+    hardware = robot.hardware
+    try:
+        def failing_on_ack(frame, receive_time_ns):
+            raise RuntimeError('ack handler failed')
+
+        monkeypatch.setattr(hardware.ack_tracker, 'on_ack', failing_on_ack)
+        robot.camera_servo_set(angle=40)
+        deadline = time.monotonic() + 2.
+        while not hardware.parse_errors and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert hardware.get_read_stats()['parse_errors'] >= 1
+
+        # поток чтения продолжает разбирать телеметрию
+        frames = hardware.get_read_stats()['frames']
+        time.sleep(0.2)
+        assert hardware.is_alive()
+        assert hardware.get_read_stats()['frames'] > frames
+    finally:
+        hardware.stop()
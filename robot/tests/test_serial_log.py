@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Журнал трафика serial: поиск по времени через несколько файлов и запусков.
+"""
+
+import os
+
+import parts.serial_log as serial_log
+from parts.serial_log import Serial_Traffic_Log, Serial_Traffic_Log_Reader, DIRECTION_IN, DIRECTION_OUT
+
+
+def write_run(log_dir: str, count: int, file_size: int = 512) -> None:
+    log = Serial_Traffic_Log(log_dir=log_dir, file_size=file_size, max_files=100)
+    for idx in range(count):
+        log.record(DIRECTION_IN if idx % 2 else DIRECTION_OUT, b'SA%03dE' % idx)
+    log.close()
+
+
+def test_reader_groups_files_by_run(tmp_path):
+    write_run(str(tmp_path), count=100)
+    write_run(str(tmp_path), count=10)
+    reader = Serial_Traffic_Log_Reader(str(tmp_path))
+
+    assert len(reader.runs) == 2
+    assert len(reader.runs[0].files) > 1
+    assert reader.runs[0].run_id != reader.runs[1].run_id
+
+    records = list(reader.iter_records())
+    assert [payload for _, _, payload in records] == \
+        [b'SA%03dE' % idx for idx in range(100)] + [b'SA%03dE' % idx for idx in range(10)]
+    for run in range(2):
+        timestamps = [timestamp_ns for timestamp_ns, _, _ in reader.iter_records(run=run)]
+        assert timestamps == sorted(timestamps)
+
+
+def test_reader_seeks_across_files(tmp_path):
+    write_run(str(tmp_path), count=10)
+    write_run(str(tmp_path), count=100)
+    reader = Serial_Traffic_Log_Reader(str(tmp_path))
+    records = list(reader.iter_records(run=-1))
+    assert len(reader.runs[-1].files) > 2
+
+    # с середины второго файла до середины последнего
+    start_idx = len(records) // 3
+    end_idx = len(records) - 5
+    start_ns, end_ns = records[start_idx][0], records[end_idx][0]
+    window = list(reader.iter_records(start_ns=start_ns, end_ns=end_ns, run=-1))
+    expected = [record for record in records if start_ns <= record[0] < end_ns]
+    assert window == expected
+    assert window[0][2] == records[start_idx][2]
+
+    outbound = list(reader.iter_records(direction=DIRECTION_OUT, run=-1))
+    assert [payload for _, _, payload in outbound] == [b'SA%03dE' % idx for idx in range(0, 100, 2)]
+
+    replayed = list(reader.replay_records(run=-1))
+    assert replayed[0] == (records[1][0] / 1e9, b'SA001E\r\n')
+    assert len(replayed) == 50
+
+
+def test_file_index_past_six_digits(tmp_path):
+    for file_idx in (999998, 999999):
+        open(os.path.join(str(tmp_path), f'serial_{file_idx:06d}.bin'), 'wb').close()
+    write_run(str(tmp_path), count=100)
+    reader = Serial_Traffic_Log_Reader(str(tmp_path))
+    assert len(reader.runs) == 1
+    assert os.path.basename(reader.runs[0].files[0]) == 'serial_1000000.bin'
+    assert len(list(reader.iter_records())) == 100
+
+
+def test_runs_after_reboot_are_not_compared_by_time(tmp_path, monkeypatch):
+    clock = [10 ** 12]
+
+    def monotonic_ns():
+        clock[0] += 1000
+        return clock[0]
+
+    monkeypatch.setattr(serial_log.time, 'monotonic_ns', monotonic_ns)
+    write_run(str(tmp_path), count=30)
+    # перезагрузка: time.monotonic_ns() начинается заново, номера файлов продолжаются
+    clock[0] = 0
+    write_run(str(tmp_path), count=30)
+    reader = Serial_Traffic_Log_Reader(str(tmp_path))
+
+    assert len(reader.runs) == 2
+    assert reader.runs[1].files_start_ns[0] < reader.runs[0].files_start_ns[0]
+    last_run = list(reader.iter_records(run=-1))
+    start_ns = last_run[10][0]
+    assert list(reader.iter_records(start_ns=start_ns, run=-1)) == last_run[10:]
+    assert list(reader.iter_records(start_ns=start_ns, run=0)) == list(reader.iter_records(run=0))
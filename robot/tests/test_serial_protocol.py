@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Разбор сообщений сенсоров и кодирование команд протокола MegaBot.
+"""
+
+from parts.serial_protocol import Sensor_Frame_Parser, Serial_Frame_Splitter, Command_Frame_Encoder
+
+
+def test_parser_decodes_sensor_frames():
+    parser = Sensor_Frame_Parser()
+    assert parser.parse(b'SI014012012013013E') == 'IR'
+    assert parser.parse(b'SU175065023048047E') == 'US'
+    assert parser.parse(b'SA087E') == 'BATTERY'
+    assert parser.parse(b'SF04A1B2C3E') == 'RFID'
+
+    assert parser.get_value('IR') == {0: 14, 1: 12, 2: 12, 3: 13, 4: 13}
+    assert parser.get_value('US') == {0: 175, 1: 65, 2: 23, 3: 48, 4: 47}
+    assert parser.get_value('BATTERY') == 87
+    assert parser.get_value('RFID') == '04A1B2C3'
+    assert parser.frames == {'IR': 1, 'US': 1, 'BATTERY': 1, 'RFID': 1}
+    assert parser.malformed_frames == 0
+    assert parser.unknown_frames == 0
+
+
+def test_parser_counts_malformed_frames():
+    parser = Sensor_Frame_Parser()
+    parser.parse(b'SU175065023048047E')
+
+    # не цифра в поле, слишком короткое сообщение, аккумулятор без значения
+    assert parser.parse(b'SU17x065023048047E') is None
+    assert parser.parse(b'SU175065E') is None
+    assert parser.parse(b'SI01401201201301E') is None
+    assert parser.parse(b'SAE') is None
+    assert parser.malformed_frames == 4
+
+    # поврежденное сообщение не портит последнее значение и не считается принятым
+    assert parser.get_value('US') == {0: 175, 1: 65, 2: 23, 3: 48, 4: 47}
+    assert parser.get_value('IR') == {sensor_idx: None for sensor_idx in range(5)}
+    assert parser.frames['US'] == 1
+    assert parser.frames['IR'] == 0
+    assert parser.frames['BATTERY'] == 0
+
+
+def test_parser_counts_unknown_frames_separately():
+    parser = Sensor_Frame_Parser()
+    assert parser.parse(b'XX123E') is None
+    assert parser.parse(b'S') is None
+    assert parser.unknown_frames == 1
+    assert parser.malformed_frames == 0
+
+
+def test_parser_reports_changes():
+    parser = Sensor_Frame_Parser()
+    parser.parse(b'SA087E')
+    assert parser.changed
+    parser.parse(b'SA087E')
+    assert not parser.changed
+    parser.parse(b'SA086E')
+    assert parser.changed
+
+
+def split(splitter: Serial_Frame_Splitter, *chunks) -> list:
+    frames = []
+    for chunk in chunks:
+        splitter.feed(chunk, lambda frame: frames.append(bytes(frame)))
+    return frames
+
+
+def test_splitter_joins_partial_chunks():
+    splitter = Serial_Frame_Splitter()
+    assert split(splitter, b'SI0140', b'12012013', b'013E\r', b'\n') == [b'SI014012012013013E']
+    assert splitter.frames == 1
+
+
+def test_splitter_splits_merged_chunk():
+    splitter = Serial_Frame_Splitter()
+    frames = split(splitter, b'SA087E\r\nSU175065023048047E\r\nSA0')
+    assert frames == [b'SA087E', b'SU175065023048047E']
+    # хвост следующего сообщения ждет продолжения
+    assert split(splitter, b'86E\n') == [b'SA086E']
+    assert splitter.frames == 3
+    assert splitter.malformed_frames == 0
+
+
+def test_splitter_skips_garbage():
+    splitter = Serial_Frame_Splitter()
+    # строка без терминатора 'E' и пустые строки
+    assert split(splitter, b'\x00\xffnoise\r\n\r\n\n') == []
+    assert splitter.malformed_frames == 1
+
+    # мусор без перевода строки длиннее max_frame_size отбрасывается, следующее сообщение не страдает
+    splitter = Serial_Frame_Splitter(max_frame_size=16)
+    assert split(splitter, b'x' * 40) == []
+    assert splitter.dropped_frames == 1
+    assert split(splitter, b'SA087E\r\n') == [b'SA087E']
+    assert splitter.frames == 1
+
+
+# Маски команд и подстановка значений, как их делал RobotHardware.set_device_value до Command_Frame_Encoder
+BASELINE_MASKS = {
+    'FLASHLIGHT': 'ZSU++000{value}00000E',
+    'UV_FLASHLIGHT': 'ZSU++{value}00000000E',
+    'CAMERA_SERVO': 'ZSS{value}0000000000E',
+}
+
+
+def baseline_encode(device_name: str, value) -> bytes:
+    if device_name == 'WHEELS':
+        return ('ZST0' + ('+' if value['left'] >= 0 else '-') + '00' + str(1000 + abs(value['left']))[1:]
+                + ('+' if value['right'] >= 0 else '-') + '00' + str(1000 + abs(value['right']))[1:]
+                + 'E').encode('utf-8')
+    return BASELINE_MASKS[device_name].replace('{value}', str(1000 + value)[1:]).encode('utf-8')
+
+
+def test_encoder_matches_baseline_string_encoder():
+    encoder = Command_Frame_Encoder()
+    for device_name in BASELINE_MASKS.keys():
+        for value in range(0, 101):
+            assert encoder.encode(device_name, value) == baseline_encode(device_name, value)
+    for left in range(-100, 101):
+        for right in (-100, -7, 0, 7, 100):
+            wheels = {'left': left, 'right': right}
+            assert encoder.encode('WHEELS', wheels) == baseline_encode('WHEELS', wheels)
+
+
+def test_encoder_combines_flashlights():
+    encoder = Command_Frame_Encoder()
+    assert encoder.encode_flashlights(flashlight=40, uv_flashlight=7) == b'ZSU++00704000000E'
+    assert encoder.encode_flashlights(flashlight=40, uv_flashlight=0) == encoder.encode_flashlight(40)
+    assert encoder.encode_flashlights(flashlight=0, uv_flashlight=7) == encoder.encode_uv_flashlight(7)
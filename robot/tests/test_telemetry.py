@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Снимок телеметрии на seqlock: чтение согласованного снимка и повтор чтения,
+если писатель начал перезапись читаемого буфера.
+"""
+
+import numpy as np
+
+import parts.telemetry as telemetry
+from parts.telemetry import Seqlock_Array, Telemetry_Snapshot
+
+
+def test_read_returns_last_published_snapshot():
+    array = Seqlock_Array(size=3, fill_value=-1)
+    assert list(array.read()) == [-1, -1, -1]
+
+    array.publish_array([1, 2, 3])
+    array.publish_array([4, 5, 6])
+    out = np.empty(3, dtype=np.int64)
+    assert array.read(out) is out
+    assert list(out) == [4, 5, 6]
+    assert array.sequence == 2
+    assert array.read_retries == 0
+
+
+def test_read_retries_when_writer_reuses_buffer(monkeypatch):
+    array = Seqlock_Array(size=3)
+    array.publish_array([1, 1, 1])
+    copyto = np.copyto
+    copies = []
+
+    def racing_copyto(dst, src):
+        copyto(dst, src)
+        if not copies:
+            # во время первого чтения писатель публикует снимок 2 и начинает снимок 3 в буфере снимка 1
+            array.publish_array([2, 2, 2])
+            array._begin_write()[:] = [9, 9, 9]
+        copies.append(list(dst))
+
+    monkeypatch.setattr(telemetry.np, 'copyto', racing_copyto)
+    snapshot = array.read()
+    assert array.read_retries == 1
+    assert list(snapshot) == [2, 2, 2]
+    assert len(copies) == 2
+
+
+def test_telemetry_snapshot_layout():
+    snapshot = Telemetry_Snapshot()
+    values = snapshot.read()
+    assert list(values[telemetry.IR_SLICE]) == [telemetry.DEFAULT_RANGE_VALUE] * 5
+    assert values[telemetry.BATTERY_IDX] == telemetry.DEFAULT_BATTERY_VALUE
+
+    snapshot.publish(ir=[1, 2, 3, 4, 5], us=[10, 20, 30, 40, 50], battery=None, time_ns=123)
+    values = snapshot.read()
+    assert list(values[telemetry.IR_SLICE]) == [1, 2, 3, 4, 5]
+    assert list(values[telemetry.US_SLICE]) == [10, 20, 30, 40, 50]
+    assert values[telemetry.BATTERY_IDX] == telemetry.DEFAULT_BATTERY_VALUE
+    assert values[telemetry.TIME_NS_IDX] == 123
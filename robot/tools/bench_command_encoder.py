@@ -0,0 +1,76 @@
+'''
+Usage:
+    cd robot && python3 tools/bench_command_encoder.py [--commands=200000]
+
+
+Note:
+    Compares the cost of encoding WHEELS / FLASHLIGHT / CAMERA_SERVO commands
+    with the legacy str.replace based path of RobotHardware.set_device_value
+    and with Command_Frame_Encoder.
+'''
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from parts.serial_protocol import Command_Frame_Encoder
+
+
+LEGACY_PLACEHOLDER = '@'
+LEGACY_MASKS = {
+    'FLASHLIGHT': f'ZSU{"++"}000{LEGACY_PLACEHOLDER}00000E',
+    'CAMERA_SERVO': f'ZSS{LEGACY_PLACEHOLDER}0000000000E',
+    'WHEELS': f'ZST0{"lwdir"}00{"lwval"}{"rwdir"}00{"rwval"}E',
+}
+
+
+def legacy_encode(device_name: str, value) -> bytes:
+    '''
+    Copy of the command encoding used by RobotHardware.set_device_value before Command_Frame_Encoder.
+    '''
+    if device_name == 'WHEELS':
+        left_wheel_value = str(1000 + abs(value["left"]))[1:]
+        right_wheel_value = str(1000 + abs(value["right"]))[1:]
+        command_for_serial = LEGACY_MASKS[device_name]. \
+            replace("lwdir", '+' if value["left"] >= 0 else '-'). \
+            replace("lwval", left_wheel_value). \
+            replace("rwdir", '+' if value["right"] >= 0 else '-'). \
+            replace("rwval", right_wheel_value)
+    else:
+        command_for_serial = LEGACY_MASKS[device_name].replace(LEGACY_PLACEHOLDER, str(1000 + value)[1:])
+    return command_for_serial.encode('utf-8')
+
+
+def measure(encode_function, commands: list) -> float:
+    start = time.perf_counter()
+    for device_name, value in commands:
+        encode_function(device_name, value)
+    return (time.perf_counter() - start) / len(commands) * 1e9
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--commands', type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    commands = []
+    for idx in range(args.commands):
+        if idx % 10 == 8:
+            commands.append(('FLASHLIGHT', idx % 101))
+        elif idx % 10 == 9:
+            commands.append(('CAMERA_SERVO', idx % 180))
+        else:
+            commands.append(('WHEELS', {'left': idx % 201 - 100, 'right': 100 - idx % 201}))
+
+    encoder = Command_Frame_Encoder()
+    for device_name, value in commands[:1000]:
+        assert encoder.encode(device_name, value) == legacy_encode(device_name, value), (device_name, value)
+
+    legacy_cost = measure(legacy_encode, commands)
+    encoder_cost = measure(encoder.encode, commands)
+
+    print(f'legacy str.replace encode: {legacy_cost:8.0f} ns/command')
+    print(f'Command_Frame_Encoder:     {encoder_cost:8.0f} ns/command')
+    print(f'speedup:                   {legacy_cost / encoder_cost:8.2f}x')
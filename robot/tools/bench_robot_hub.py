@@ -0,0 +1,65 @@
+'''
+Usage:
+    cd robot && python3 tools/bench_robot_hub.py [--robots=8] [--rate=100] [--seconds=5]
+
+
+Note:
+    Runs N MegaBot_Pty_Simulator controllers (Linux only) with SI / SU / SA frames at --rate Hz each
+    and a WHEELS command to every robot at 20 Hz, first with one Robot (reader + writer threads) per controller,
+    then with a single RobotHub I/O thread, and reports thread count, process CPU time and frames parsed.
+    Simulator threads run in the same process, so CPU time includes them for both variants.
+'''
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from parts.actuators import Robot
+from parts.robot_hub import RobotHub
+from parts.serial_sim import MegaBot_Pty_Simulator
+
+
+def drive(robots: list, seconds: float) -> (float, int):
+    frames_before = sum(robot.hardware.get_read_stats()['frames'] for robot in robots)
+    cpu_start = time.process_time()
+    deadline = time.monotonic() + seconds
+    idx = 0
+    while time.monotonic() < deadline:
+        for robot in robots:
+            robot.wheels_set(left=idx % 100, right=-(idx % 100))
+        idx += 1
+        time.sleep(0.05)
+    frames = sum(robot.hardware.get_read_stats()['frames'] for robot in robots) - frames_before
+    return time.process_time() - cpu_start, frames
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--robots', type=int, default=8)
+    arg_parser.add_argument('--rate', type=float, default=100)
+    arg_parser.add_argument('--seconds', type=float, default=5)
+    args = arg_parser.parse_args()
+
+    rates_hz = {b'SI': args.rate, b'SU': args.rate, b'SA': args.rate}
+    simulators = [MegaBot_Pty_Simulator(rates_hz=rates_hz, seed=idx) for idx in range(args.robots)]
+    for simulator in simulators:
+        simulator.start()
+    base_threads = threading.active_count()
+
+    hub = RobotHub(devices={f'robot{idx}': simulator.slave_name for idx, simulator in enumerate(simulators)})
+    hub.start()
+    threads = threading.active_count() - base_threads
+    cpu, frames = drive(list(hub.robots.values()), args.seconds)
+    print(f'RobotHub:        {threads:3d} threads, cpu {cpu:6.2f} s, {frames / args.seconds:8.0f} frames/sec')
+    hub.close()
+
+    # reader threads block in read() and are left running (daemon) until exit
+    robots = [Robot(device=simulator.slave_name) for simulator in simulators]
+    threads = threading.active_count() - base_threads
+    cpu, frames = drive(robots, args.seconds)
+    print(f'threaded robots: {threads:3d} threads, cpu {cpu:6.2f} s, {frames / args.seconds:8.0f} frames/sec')
+    for robot in robots:
+        robot.hardware.stop()
@@ -0,0 +1,82 @@
+'''
+Usage:
+    cd robot && python3 tools/bench_sensor_parser.py [--lines=200000]
+
+
+Note:
+    Compares throughput (lines/sec) of the legacy string based sensor parser
+    of RobotHardware.parse_message with the table driven Sensor_Frame_Parser.
+'''
+import os
+import sys
+import time
+import argparse
+from textwrap import wrap
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from parts.serial_protocol import Sensor_Frame_Parser
+
+
+SAMPLE_LINES = [
+    b'SI014012012013013E\r\n',
+    b'SU175065023048047E\r\n',
+    b'SI015012011013013E\r\n',
+    b'SU174066023048047E\r\n',
+    b'SA087E\r\n',
+    b'SF04A1B2C3E\r\n',
+]
+
+
+class Legacy_Parser(object):
+    '''
+    Copy of the parser used by RobotHardware.parse_message before the table driven one.
+    '''
+    def __init__(self):
+        self.sensors = {
+            'IR': {'message_mask': "SI", 'value': {idx: None for idx in range(5)}},
+            'US': {'message_mask': "SU", 'value': {idx: None for idx in range(5)}},
+            'BATTERY': {'message_mask': "SA", 'value': None},
+            'RFID': {'message_mask': "SF", 'value': None},
+        }
+
+    def parse(self, bytes_message: bytes):
+        message = bytes_message.decode(encoding='utf-8', errors='ignore')
+        if len(message):
+            message = message.replace('\r', '').replace('\n', '')
+
+        for _sensor_name, _sensor_data in self.sensors.items():
+            message_mask = self.sensors[_sensor_name]['message_mask']
+            if type(message) == str and len(message):
+                if message[:2] == message_mask[:2]:
+                    message = str(message)[2:].replace('E', '')
+                    if _sensor_name in ['IR', 'US']:
+                        raw_values = [int(_value) for _value in wrap(message, 3)]
+                        new_value = {_sensor_idx: raw_values[_sensor_idx] for _sensor_idx in range(5)}
+                    elif _sensor_name in ['BATTERY', ]:
+                        new_value = int(message)
+                    else:
+                        new_value = str(message)
+                    self.sensors[_sensor_name]['value'] = new_value
+
+
+def measure(parse_function, lines: list) -> float:
+    start = time.perf_counter()
+    for line in lines:
+        parse_function(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--lines', type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    lines = [SAMPLE_LINES[idx % len(SAMPLE_LINES)] for idx in range(args.lines)]
+
+    legacy_rate = measure(Legacy_Parser().parse, lines)
+    table_rate = measure(Sensor_Frame_Parser().parse, lines)
+
+    print(f'legacy parser:       {legacy_rate:12.0f} lines/sec')
+    print(f'table driven parser: {table_rate:12.0f} lines/sec')
+    print(f'speedup:             {table_rate / legacy_rate:12.2f}x')
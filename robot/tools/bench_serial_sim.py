@@ -0,0 +1,107 @@
+'''
+Usage:
+    cd robot && python3 tools/bench_serial_sim.py [--frames=20000] [--commands=200] [--capture=serial.txt] [--speed=1]
+
+
+Note:
+    Runs Robot against MegaBot_Pty_Simulator (no MegaBot controller needed, Linux only) and reports:
+    - parser throughput: sensor frames/sec pushed through the pty into RobotHardware;
+    - command latency: time from Robot.wheels_set() to the frame arriving at the simulated controller;
+    - ack round trip: Robot.wheels_set_async() latency from the port write to the echoed acknowledgement.
+    --capture replays a text capture (`<seconds>\\t<frame>` per line) instead of synthetic frames,
+    --speed sets the replay speed multiplier (omit for max speed).
+'''
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from parts.actuators import Robot
+from parts.serial_sim import MegaBot_Pty_Simulator, generate_sensor_frame, load_text_capture
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.0005)
+    return True
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--frames', type=int, default=20000)
+    arg_parser.add_argument('--commands', type=int, default=200)
+    arg_parser.add_argument('--capture', type=str, default=None)
+    arg_parser.add_argument('--speed', type=float, default=None)
+    args = arg_parser.parse_args()
+
+    simulator = MegaBot_Pty_Simulator(rates_hz={}, seed=0, echo_commands=True)
+    simulator.start()
+    robot = Robot(device=simulator.slave_name)
+    hardware = robot.hardware
+
+    # parser throughput
+    if args.capture is not None:
+        records = load_text_capture(args.capture)
+    else:
+        rng = random.Random(0)
+        sensor_masks = [b'SI', b'SU', b'SI', b'SU', b'SA']
+        records = [(None, generate_sensor_frame(sensor_masks[idx % len(sensor_masks)], rng))
+                   for idx in range(args.frames)]
+
+    frames_before = hardware.get_read_stats()['frames']
+    start = time.perf_counter()
+    sent = simulator.replay(records, speed=args.speed)
+    wait_for(lambda: hardware.get_read_stats()['frames'] - frames_before >= sent, timeout=30)
+    elapsed = time.perf_counter() - start
+    read_stats = hardware.get_read_stats()
+    print(f'parser throughput:   {(read_stats["frames"] - frames_before) / elapsed:10.0f} frames/sec '
+          f'({sent} sent, {read_stats["malformed_frames"]} malformed, {read_stats["dropped_frames"]} dropped)')
+
+    # command latency
+    latencies_ms = []
+    for idx in range(args.commands):
+        wheels = {'left': idx % 201 - 100, 'right': 100 - idx % 201}
+        commands_before = len(simulator.commands)
+        send_time = time.monotonic()
+        robot.wheels_set(left=wheels['left'], right=wheels['right'])
+        if wait_for(lambda: simulator.state['WHEELS'] == wheels and len(simulator.commands) > commands_before, timeout=1):
+            receive_time, _ = simulator.commands[-1]
+            latencies_ms.append((receive_time - send_time) * 1000)
+
+    if len(latencies_ms):
+        print(f'command latency:     p50 {percentile(latencies_ms, 50):.2f} ms, '
+              f'p99 {percentile(latencies_ms, 99):.2f} ms, max {max(latencies_ms):.2f} ms '
+              f'({len(latencies_ms)}/{args.commands} acknowledged)')
+
+    # ack round trip
+    async def measure_ack_latency() -> list:
+        ack_latencies_ms = []
+        for idx in range(args.commands):
+            try:
+                ack_latencies_ms.append(await robot.wheels_set_async(left=idx % 201 - 100, right=100 - idx % 201))
+            except asyncio.TimeoutError:
+                pass
+        return ack_latencies_ms
+
+    ack_latencies_ms = asyncio.run(measure_ack_latency())
+    if len(ack_latencies_ms):
+        print(f'ack round trip:      p50 {percentile(ack_latencies_ms, 50):.2f} ms, '
+              f'p99 {percentile(ack_latencies_ms, 99):.2f} ms, max {max(ack_latencies_ms):.2f} ms '
+              f'({len(ack_latencies_ms)}/{args.commands} acknowledged)')
+    print(f'writer:              {hardware.get_writer_stats()}')
+    print(f'acks:                {hardware.get_ack_stats()}')
+
+    hardware.stop()
+    simulator.close()